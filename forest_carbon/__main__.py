@@ -1,4 +1,19 @@
-from forest_carbon import combined_agb_calculator
+"""
+Command line interface: estimate AGB for one or more tree files.
+
+    python -m forest_carbon plots/ extra_plot.json --output-dir results --workers 4
+
+Inputs can be files, glob patterns or directories (which are searched for supported
+tree files). All the files are processed in one process, so the reference tables are
+loaded only once. With no inputs, the example data is processed.
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+from typing import List, Optional
 
 # Path to the data to be augmented
 PATH_TO_DATA = "./example_data/10_trees.json"
@@ -6,9 +21,316 @@ PATH_TO_DATA = "./example_data/10_trees.json"
 # Path to where the file should be saved
 SAVE_PATH = "./example_data/10_trees_processed.json"
 
+# Extensions of the files picked up when an input is a directory
+INPUT_EXTENSIONS = (
+    ".json",
+    ".ndjson",
+    ".jsonl",
+    ".csv",
+    ".parquet",
+    ".pq",
+    ".arrow",
+    ".feather",
+)
+
+# Output formats, by the extension they are written with
+OUTPUT_FORMATS = {
+    "json": ".json",
+    "ndjson": ".ndjson",
+    "csv": ".csv",
+    "parquet": ".parquet",
+    "arrow": ".arrow",
+}
+
+# Suffix added to the name of each input file to name its output
+OUTPUT_SUFFIX = "_processed"
+
+# The pipeline stages whose times are broken out in the summary (see
+# instrumentation.py). Parallel runs also report them as "worker.<stage>", with the
+# times summed over the workers
+SUMMARY_STAGES = ("load_trees", "preprocess", "estimate", "write_output")
+
+
+def expand_inputs(inputs: List[str]) -> List[str]:
+    """
+    Expand files, glob patterns and directories into a list of input files.
+
+    Directories are searched (not recursively) for files with one of the
+    `INPUT_EXTENSIONS`, skipping the outputs of previous runs. Each file is listed
+    once, in the order it is first found.
+
+    Raises:
+        FileNotFoundError: If an input matches no files.
+    """
+    paths = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            matches = sorted(
+                os.path.join(pattern, name)
+                for name in os.listdir(pattern)
+                if name.lower().endswith(INPUT_EXTENSIONS)
+                and not os.path.splitext(name)[0].endswith(OUTPUT_SUFFIX)
+            )
+        elif os.path.exists(pattern):
+            matches = [pattern]
+        else:
+            matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise FileNotFoundError(f"No input files found for {pattern!r}")
+        paths.extend(matches)
+    return list(dict.fromkeys(paths))
+
+
+def output_path_for(
+    input_path: str, output_dir: Optional[str] = None, output_format: str = None
+) -> str:
+    """
+    The path that the results for `input_path` are saved to: the input's name with
+    `OUTPUT_SUFFIX`, in `output_dir` (by default, next to the input), with the
+    extension of `output_format` (by default, the input's extension).
+    """
+    stem, extension = os.path.splitext(os.path.basename(input_path))
+    if output_format is not None:
+        extension = OUTPUT_FORMATS[output_format]
+    directory = output_dir if output_dir is not None else os.path.dirname(input_path)
+    return os.path.join(directory, stem + OUTPUT_SUFFIX + extension)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m forest_carbon",
+        description="Estimate above-ground biomass for files of trees.",
+    )
+    parser.add_argument(
+        "inputs",
+        nargs="*",
+        help="Tree files, glob patterns or directories. "
+        f"Defaults to {PATH_TO_DATA}.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        help="Directory to save the results in. Defaults to next to each input.",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=sorted(OUTPUT_FORMATS),
+        help="Output format. Defaults to the format of each input.",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="Number of worker processes. Defaults to a single process.",
+    )
+    parser.add_argument(
+        "-c",
+        "--chunk-size",
+        type=int,
+        help="Stream JSON files through the model this many trees at a time.",
+    )
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="Skip the per-tree type checks and validate each file once instead.",
+    )
+    parser.add_argument(
+        "--resolve-species",
+        action="store_true",
+        help="Match species labels that are not exact common names, such as "
+        '"oak tree", by alias and fuzzy matching.',
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Reuse the results saved in each output file for the trees whose inputs "
+        "haven't changed, and recompute only the others.",
+    )
+    parser.add_argument(
+        "--concurrent",
+        action="store_true",
+        help="Process the files concurrently, overlapping reads and writes with "
+        "estimation in --workers processes. A file that fails is reported and the "
+        "others carry on.",
+    )
+    parser.add_argument(
+        "--grid",
+        help="Also aggregate the AGB, stem count and basal area of the trees of every "
+        "input into grid cells, and save them to this .npz file.",
+    )
+    parser.add_argument(
+        "--cell-size",
+        type=float,
+        help="Width of the grid cells for --grid, in the units of the tree "
+        "positions. Defaults to config.GRID_CELL_SIZE.",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Instead of processing files, run a local HTTP server that estimates "
+        "the trees POSTed to /estimate, keeping the reference tables loaded.",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        help="Port for --serve. Defaults to config.SERVER_PORT.",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="Save the stage timings, counters and cache hit rates of the run to "
+        "this JSON file.",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    if args.inputs:
+        try:
+            input_paths = expand_inputs(args.inputs)
+        except FileNotFoundError as error:
+            sys.exit(str(error))
+        output_paths = [
+            output_path_for(path, args.output_dir, args.format) for path in input_paths
+        ]
+    else:
+        input_paths = [PATH_TO_DATA]
+        output_paths = [
+            (
+                SAVE_PATH
+                if args.output_dir is None and args.format is None
+                else output_path_for(PATH_TO_DATA, args.output_dir, args.format)
+            )
+        ]
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    if args.concurrent and (args.incremental or args.grid or args.chunk_size):
+        sys.exit(
+            "--concurrent can't be combined with --incremental, --grid or --chunk-size"
+        )
+
+    if args.incremental and args.chunk_size:
+        sys.exit("--incremental can't be combined with --chunk-size")
+
+    start = time.perf_counter()
+
+    # Imported here so that starting the CLI doesn't pay for the numerical stack
+    # until there is work to do
+    from forest_carbon import combined_agb_calculator, config, reference_tables
+    from forest_carbon import batch_runner, gridding, incremental, instrumentation
+    from forest_carbon import tree_table, typecheck
+
+    imported = time.perf_counter()
+    # Only this run's stage times go in the summary
+    stages_before = instrumentation.metrics.snapshot()["stages"]
+    if args.fast:
+        typecheck.set_fast_mode(True)
+    if args.resolve_species:
+        config.RESOLVE_SPECIES_LABELS = True
+    if args.serve:
+        from forest_carbon import server
+
+        server.serve(port=args.port)
+        return
+
+    # Load the reference tables once up front; every file below reuses them
+    reference_tables.load_species_database(
+        config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO
+    )
+    reference_tables.load_taxa_model_index(
+        config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS
+    )
+    loaded = time.perf_counter()
+
+    if args.incremental and any(tree_table.is_columnar(p) for p in output_paths):
+        sys.exit("Incremental runs save their output as JSON or NDJSON")
+
+    grid = None
+    if args.grid:
+        grid = gridding.CarbonGrid(
+            args.cell_size if args.cell_size is not None else config.GRID_CELL_SIZE
+        )
+
+    total_trees = 0
+    failed = []
+    if args.concurrent:
+        for result in batch_runner.run_files(
+            zip(input_paths, output_paths), workers=args.workers
+        ):
+            if result["error"] is not None:
+                failed.append(result["input"])
+                print(f"{result['input']}: failed: {result['error']}")
+                continue
+            total_trees += result["trees"]
+            print(
+                f"{result['input']} -> {result['output']}: {result['trees']} trees "
+                f"in {result['seconds']:.3f} s"
+            )
+
+    # Concurrent runs have processed every file already
+    sequential = [] if args.concurrent else zip(input_paths, output_paths)
+    for input_path, output_path in sequential:
+        file_start = time.perf_counter()
+        details = ""
+        try:
+            if args.incremental:
+                counts = incremental.run_model_incremental(
+                    input_path, output_path, workers=args.workers, grid=grid
+                )
+                num_trees = counts["trees"]
+                details = (
+                    f" ({counts['reused']} reused, {counts['recomputed']} recomputed)"
+                )
+            else:
+                num_trees = combined_agb_calculator.run_model(
+                    input_path,
+                    output_path,
+                    chunk_size=args.chunk_size,
+                    workers=args.workers,
+                    grid=grid,
+                )
+        except Exception as error:
+            # As with --concurrent, report the file and carry on with the others
+            failed.append(input_path)
+            print(f"{input_path}: failed: {type(error).__name__}: {error}")
+            continue
+        elapsed = time.perf_counter() - file_start
+        total_trees += num_trees
+        print(
+            f"{input_path} -> {output_path}: {num_trees} trees in {elapsed:.3f} s"
+            + details
+        )
+
+    end = time.perf_counter()
+    processing = end - loaded
+    rate = total_trees / processing if processing > 0 else float("inf")
+    print(
+        f"Processed {total_trees} trees from {len(input_paths) - len(failed)} file(s) "
+        f"in {end - start:.3f} s ({rate:.0f} trees/s)"
+    )
+    print(f"  import:           {imported - start:.3f} s")
+    print(f"  reference tables: {loaded - imported:.3f} s")
+    print(f"  processing:       {processing:.3f} s")
+    stages = instrumentation.metrics.snapshot()["stages"]
+    for name in SUMMARY_STAGES + tuple("worker." + name for name in SUMMARY_STAGES):
+        if name in stages:
+            seconds = stages[name]["seconds"]
+            seconds -= stages_before.get(name, {"seconds": 0.0})["seconds"]
+            print(f"    {name + ':':<15} {seconds:.3f} s")
+
+    if grid is not None:
+        grid.save(args.grid)
+        rows, columns = grid.shape
+        print(f"Saved a {rows} x {columns} grid of AGB totals to {args.grid}")
+
+    if args.metrics:
+        with open(args.metrics, "w") as metrics_file:
+            metrics_file.write(instrumentation.metrics.to_json())
 
-def main():
-    combined_agb_calculator.run_model(PATH_TO_DATA, SAVE_PATH)
+    if failed:
+        sys.exit(f"{len(failed)} file(s) failed")
 
 
 if __name__ == "__main__":
@@ -1,10 +1,16 @@
-from typing import Tuple, Union
+from typing import TYPE_CHECKING, Tuple, Union
 
 import numpy as np
-import pandas as pd
 
+from .instrumentation import metrics
+from .taxa_index import TaxaModelIndex
 
-def load_taxa_agb_model_data(filename: str) -> pd.DataFrame:
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+@metrics.timed("load_taxa_parameters")
+def load_taxa_agb_model_data(filename: str) -> "pd.DataFrame":
     """
     Reads the contents of a file, with data given as a csv file. Processes the data by creating a dataframe
     that has two additional columns: the lower and upper bounds of the specific gravity.
@@ -15,6 +21,8 @@ def load_taxa_agb_model_data(filename: str) -> pd.DataFrame:
     Returns:
         df (pd.DataFrame): A dataframe of the processed data.
     """
+    import pandas as pd
+
     datab = pd.read_csv(filename)
     df = pd.DataFrame(datab)
     num_rows, num_columns = df.shape
@@ -64,8 +72,22 @@ def load_taxa_agb_model_data(filename: str) -> pd.DataFrame:
     return df
 
 
+def load_taxa_model_index(filename: str) -> TaxaModelIndex:
+    """
+    Reads the taxa-level model parameters from a csv file and compiles them into a
+    `TaxaModelIndex` for fast lookups.
+
+    Args:
+        filename (str): The name of a data file.
+
+    Returns:
+        index (TaxaModelIndex): The compiled parameter index.
+    """
+    return TaxaModelIndex.from_dataframe(load_taxa_agb_model_data(filename))
+
+
 def agb_biomass_model(
-    group: str, taxa: str, spg: float, df: pd.DataFrame
+    group: str, taxa: str, spg: float, df: Union["pd.DataFrame", TaxaModelIndex]
 ) -> Union[
     dict[Tuple[str, str], Tuple[float, float, float, str]],
     Tuple[float, float, float, str],
@@ -81,7 +103,8 @@ def agb_biomass_model(
        group (str) - The group of the tree
        taxa (str) - The taxa of the tree
        spg (float) - The specific gravity of the tree
-       df - the dataframe called by the function load_taxa_agb_model_data
+       df - the dataframe called by the function load_taxa_agb_model_data, or the
+            index returned by load_taxa_model_index
 
 
      Returns:
@@ -92,6 +115,12 @@ def agb_biomass_model(
 
          If multiple matches are found, return a dictionary of such tuples.
     """
+    if isinstance(df, TaxaModelIndex):
+        parameters = df.model_parameters(group, taxa, spg)
+        if not parameters:
+            metrics.count("taxa_model.no_match")
+        return parameters
+
     num_rows, num_columns = df.shape
 
     matches = 0
@@ -127,7 +156,7 @@ def agb_biomass_model(
                     Rsquared = float(df.iloc[i, 9])
                     diameterClass = df.iloc[i, 7]  # "drc" or "dbh"
     if matches == 0:  # tree is not in the database or the user inupt is incorrect
-        print("Check inputs, no matches found")
+        metrics.count("taxa_model.no_match")
     elif exact_match:
         return b0, b1, Rsquared, diameterClass
 
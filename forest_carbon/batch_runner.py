@@ -0,0 +1,196 @@
+"""
+Concurrent processing of many tree files with asyncio.
+
+`run_model` processes one file at a time, blocking on each read and write. For
+ingesting many small plot files at once, `run_files` instead overlaps the reads and
+writes of some files with the estimation of others:
+
+- files are read and written by a bounded pool of `io_threads` threads,
+- each file is parsed, preprocessed, estimated and formatted in a pool of `workers`
+  processes, which load the reference tables once each, and
+- at most `max_pending` files are in flight (read but not yet written) at a time, so
+  memory stays bounded however many files there are.
+
+Each file is processed independently: a file that can't be read, parsed or estimated
+is reported in its result, and the others carry on. Outputs are written to a
+temporary file that is renamed into place, so a failed file never leaves a partial
+output. The outputs are the same as `run_model` produces.
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+
+from . import combined_agb_calculator, config, parallel, streaming, tree_table
+from .instrumentation import metrics
+
+# The default number of I/O threads
+IO_THREADS = 8
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as input_file:
+        return input_file.read()
+
+
+def _write_file(path: str, data: bytes):
+    """Write a file atomically, so that a failure leaves no partial output."""
+    # A plain `open` creates the file with the umask's permissions, as `run_model`
+    # does (`tempfile.mkstemp` would make it readable by its owner only)
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp_path, "xb") as output_file:
+            output_file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(temp_path)
+        raise
+
+
+def _parse_trees(input_data_path: str, data: bytes) -> list:
+    """Parse the trees of a JSON (a `{"trees": [...]}` document or a list) or
+    newline-delimited JSON file."""
+    if streaming.is_ndjson(input_data_path):
+        return [json.loads(line) for line in data.splitlines() if line.strip()]
+    document = json.loads(data)
+    return document if isinstance(document, list) else document["trees"]
+
+
+def _format_trees(save_output_path: str, trees: list) -> bytes:
+    """Format processed trees as `run_model` writes them."""
+    if streaming.is_ndjson(save_output_path):
+        return "".join(json.dumps(tree) + "\n" for tree in trees).encode()
+    return json.dumps(trees, indent=2).encode()
+
+
+def _process_file_in_worker(
+    input_data_path: str, save_output_path: str, data: Optional[bytes]
+) -> Tuple[Optional[bytes], int, dict]:
+    """
+    Process one file in a worker process.
+
+    Returns:
+        tuple: The formatted output (or None if the worker already wrote it), the
+            number of trees, and the worker's metrics.
+    """
+    if data is None:
+        # Columnar files are read and written by the worker itself, into a
+        # temporary file (with the same extension, which sets the format) that is
+        # renamed into place like the other outputs
+        root, extension = os.path.splitext(save_output_path)
+        temp_path = f"{root}.{uuid.uuid4().hex}.tmp{extension}"
+        try:
+            num_trees = combined_agb_calculator.run_model(input_data_path, temp_path)
+            os.replace(temp_path, save_output_path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(temp_path)
+            raise
+        return None, num_trees, combined_agb_calculator._worker_metrics()
+    trees, worker_metrics = combined_agb_calculator._process_tree_chunk_in_worker(
+        _parse_trees(input_data_path, data)
+    )
+    return _format_trees(save_output_path, trees), len(trees), worker_metrics
+
+
+async def run_files_async(
+    paths: Iterable[Tuple[str, str]],
+    workers: Optional[int] = None,
+    io_threads: Optional[int] = None,
+    max_pending: Optional[int] = None,
+) -> List[dict]:
+    """
+    Estimate AGB for many files of trees concurrently.
+
+    Args:
+        paths (iterable): (input path, output path) pairs. Inputs and outputs may be
+            JSON, NDJSON, CSV, Parquet or Arrow files, as for `run_model`.
+        workers (int): Number of worker processes. Defaults to the number of CPUs.
+        io_threads (int): Number of threads reading and writing files. Defaults to
+            `IO_THREADS`.
+        max_pending (int): The most files in flight at once. Defaults to twice the
+            number of workers, so the workers stay busy while files are read and
+            written.
+
+    Returns:
+        list: For each pair, in order, a dictionary with the "input" and "output"
+            paths, the number of "trees" processed, the "seconds" it took, and the
+            "error" (a message, or None if the file was processed).
+    """
+    paths = list(paths)
+    workers = workers or parallel.default_workers()
+    max_pending = max_pending or 2 * workers
+    loop = asyncio.get_running_loop()
+    results: List[Optional[dict]] = [None] * len(paths)
+    queue = iter(enumerate(paths))
+
+    with ThreadPoolExecutor(io_threads or IO_THREADS) as io_pool, parallel.process_pool(
+        workers,
+        combined_agb_calculator._init_worker,
+        combined_agb_calculator._worker_initargs(
+            config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO,
+            config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS,
+        ),
+    ) as cpu_pool:
+
+        async def process(input_data_path: str, save_output_path: str) -> int:
+            columnar = tree_table.is_columnar(
+                input_data_path
+            ) or tree_table.is_columnar(save_output_path)
+            data = None
+            if not columnar:
+                data = await loop.run_in_executor(io_pool, _read_file, input_data_path)
+            output, num_trees, worker_metrics = await loop.run_in_executor(
+                cpu_pool,
+                _process_file_in_worker,
+                input_data_path,
+                save_output_path,
+                data,
+            )
+            combined_agb_calculator._merge_worker_metrics(worker_metrics)
+            if output is not None:
+                await loop.run_in_executor(
+                    io_pool, _write_file, save_output_path, output
+                )
+            return num_trees
+
+        async def consume():
+            # Each consumer handles one file at a time, so `max_pending` consumers
+            # bound the files in flight
+            for i, (input_data_path, save_output_path) in queue:
+                start = loop.time()
+                result = {
+                    "input": input_data_path,
+                    "output": save_output_path,
+                    "trees": 0,
+                    "error": None,
+                }
+                try:
+                    result["trees"] = await process(input_data_path, save_output_path)
+                except Exception as error:
+                    result["error"] = f"{type(error).__name__}: {error}"
+                result["seconds"] = loop.time() - start
+                results[i] = result
+
+        with metrics.stage("batch_files", len(paths)):
+            await asyncio.gather(*(consume() for _ in range(max_pending)))
+
+    failed = sum(result["error"] is not None for result in results)
+    metrics.count("batch_files.processed", len(paths) - failed)
+    metrics.count("batch_files.failed", failed)
+    return results
+
+
+def run_files(
+    paths: Iterable[Tuple[str, str]],
+    workers: Optional[int] = None,
+    io_threads: Optional[int] = None,
+    max_pending: Optional[int] = None,
+) -> List[dict]:
+    """Run `run_files_async` to completion (see there for the arguments)."""
+    return asyncio.run(run_files_async(paths, workers, io_threads, max_pending))
@@ -1,13 +1,88 @@
 import json
-from typing import Callable, Optional
+import os
+from typing import TYPE_CHECKING, Callable, Optional, Tuple, Union
 
+import numpy as np
 from beartype import beartype
 
-from . import agb_biomass, config, single_tree_estimation, tree_preprocessing
+from . import (
+    agb_biomass,
+    config,
+    gridding,
+    model_cache,
+    parallel,
+    reference_tables,
+    single_tree_estimation,
+    species_resolver,
+    streaming,
+    tree_batch,
+    tree_preprocessing,
+    tree_table,
+    typecheck,
+)
+from .instrumentation import metrics
+from .taxa_index import TaxaModelIndex
+
+if TYPE_CHECKING:
+    import pandas
 
 AGBModel = Callable[[float, float, float], float]
 
 
+def _tree_records(trees: list) -> list:
+    """Keep the fields used for AGB estimation from a list of preprocessed trees."""
+    tree_data = []
+    for tree_info in trees:
+        dbh, group, taxa, x_pos, y_pos, spg = (
+            tree_info.get("dbh"),
+            tree_info.get("group"),
+            tree_info.get("taxa"),
+            tree_info.get("x_pos"),
+            tree_info.get("y_pos"),
+            tree_info.get("spg"),
+        )
+
+        tree_dict = {
+            "dbh": dbh,
+            "group": group,
+            "taxa": taxa,
+            "x_pos": x_pos,
+            "y_pos": y_pos,
+            "height": None,
+            "spg": spg,
+        }
+
+        tree_data.append(tree_dict)
+
+    return tree_data
+
+
+def _species_resolver(
+    preprocessing_species_info_path: str,
+) -> Optional[species_resolver.SpeciesResolver]:
+    """The resolver for species labels that are not exact common names, if label
+    resolution is enabled in the config."""
+    if not config.RESOLVE_SPECIES_LABELS:
+        return None
+    cache_dir = config.REFERENCE_TABLE_CACHE_DIR
+    return species_resolver.load_species_resolver(
+        preprocessing_species_info_path,
+        config.SPECIES_ALIASES,
+        os.path.join(cache_dir, "species_labels.json") if cache_dir else None,
+    )
+
+
+def _preprocess_tree_entries(trees: list, preprocessing_species_info_path: str):
+    """Run `tree_preprocessing.preprocess_tree_entries` with the cached species
+    database and, if enabled, the species label resolver."""
+    database = reference_tables.load_species_database(preprocessing_species_info_path)
+    resolver = _species_resolver(preprocessing_species_info_path)
+    trees = tree_preprocessing.preprocess_tree_entries(trees, database, resolver)
+    if resolver is not None:
+        resolver.flush()
+    return trees
+
+
 @beartype
 def load_tree_data_from_json(
     data_path: str, preprocessing_species_info_path: str
@@ -22,42 +97,14 @@ def load_tree_data_from_json(
     Returns:
     List: Processed tree data, or None if no tree data is found.
     """
-    tree_data = []
-
     try:
-        with open(data_path, "r") as json_file:
+        with metrics.stage("load_trees") as stage, open(data_path, "r") as json_file:
             data = json.load(json_file)
+            stage.items = len(data["trees"])
 
-            database = tree_preprocessing.create_common_name_dictionary(
-                preprocessing_species_info_path
-            )
-            tree = tree_preprocessing.preprocess_tree_entries(
-                trees=data["trees"], database=database
-            )
-
-            for tree_info in tree:
-                dbh, group, taxa, x_pos, y_pos, spg = (
-                    tree_info.get("dbh"),
-                    tree_info.get("group"),
-                    tree_info.get("taxa"),
-                    tree_info.get("x_pos"),
-                    tree_info.get("y_pos"),
-                    tree_info.get("spg"),
-                )
+        tree = _preprocess_tree_entries(data["trees"], preprocessing_species_info_path)
 
-                tree_dict = {
-                    "dbh": dbh,
-                    "group": group,
-                    "taxa": taxa,
-                    "x_pos": x_pos,
-                    "y_pos": y_pos,
-                    "height": None,
-                    "spg": spg,
-                }
-
-                tree_data.append(tree_dict)
-
-            return tree_data
+        return _tree_records(tree)
 
     except FileNotFoundError:
         print(f"File not found: {data_path}")
@@ -69,6 +116,100 @@ def load_tree_data_from_json(
 
 
 @beartype
+def load_tree_table(
+    data_path: str, preprocessing_species_info_path: str
+) -> "pandas.DataFrame":
+    """
+    Load tree data into a table and preprocess it column by column.
+
+    This is the columnar counterpart of `load_tree_data_from_json`: the result holds
+    the same fields, as typed columns with one row per tree.
+
+    Args:
+    - data_path (str): Path to a CSV, Parquet, Arrow, JSON or NDJSON file of trees.
+    - preprocessing_species_info_path (str): Path to the species information CSV file.
+
+    Returns:
+    pd.DataFrame: Processed tree data with the columns of `tree_table.TREE_COLUMNS`.
+
+    Raises:
+    - KeyError: If a tree's species is not in the species database.
+    """
+    with metrics.stage("load_trees") as stage:
+        trees = tree_table.read_tree_table(data_path)
+        stage.items = len(trees)
+    database = reference_tables.load_species_database(preprocessing_species_info_path)
+    resolver = _species_resolver(preprocessing_species_info_path)
+    trees = tree_preprocessing.preprocess_tree_frame(trees, database, resolver)
+    if resolver is not None:
+        resolver.flush()
+    trees["height"] = np.nan
+    return trees[list(tree_table.TREE_COLUMNS)].astype(tree_table.TREE_COLUMNS)
+
+
+# The fields read from the input to build a `TreeBatch`
+TREE_BATCH_INPUT_FIELDS = ("dbh", "species", "x_pos", "y_pos")
+
+
+@beartype
+def load_tree_batch(
+    data_path: str,
+    preprocessing_species_info_path: str,
+    chunk_size: int = 100000,
+) -> tree_batch.TreeBatch:
+    """
+    Load tree data into a compact `TreeBatch` and preprocess it.
+
+    This is the struct-of-arrays counterpart of `load_tree_data_from_json`: JSON and
+    NDJSON files are streamed `chunk_size` trees at a time, so no more than a chunk of
+    tree dicts is ever held in memory, and the result holds the same fields as typed
+    columns (with the group and taxa as integer codes).
+
+    Args:
+    - data_path (str): Path to a JSON, NDJSON, CSV, Parquet or Arrow file of trees.
+    - preprocessing_species_info_path (str): Path to the species information CSV file.
+    - chunk_size (int): Number of trees to convert at a time.
+
+    Returns:
+    TreeBatch: Processed tree data with "dbh", "group", "taxa", "x_pos", "y_pos",
+        "height" (always missing, as in `load_tree_data_from_json`) and "spg" columns.
+
+    Raises:
+    - KeyError: If a tree's species is not in the species database.
+    """
+    with metrics.stage("load_trees") as stage:
+        if tree_table.is_columnar(data_path):
+            frame = tree_table.read_tree_table(data_path)
+            batch = tree_batch.TreeBatch.from_frame(
+                frame[[name for name in TREE_BATCH_INPUT_FIELDS if name in frame]]
+            )
+        else:
+            chunks = streaming.iter_chunks(streaming.iter_trees(data_path), chunk_size)
+            batch = tree_batch.TreeBatch.concatenate(
+                [
+                    tree_batch.TreeBatch.from_records(
+                        chunk, fields=TREE_BATCH_INPUT_FIELDS
+                    )
+                    for chunk in chunks
+                ]
+                or [
+                    tree_batch.TreeBatch.from_records(
+                        [], fields=TREE_BATCH_INPUT_FIELDS
+                    )
+                ]
+            )
+        stage.items = len(batch)
+    database = reference_tables.load_species_database(preprocessing_species_info_path)
+    resolver = _species_resolver(preprocessing_species_info_path)
+    batch = tree_preprocessing.preprocess_tree_batch(batch, database, resolver)
+    if resolver is not None:
+        resolver.flush()
+    batch = batch.drop("species")
+    batch["height"] = np.full(len(batch), np.nan)
+    return batch
+
+
+@typecheck.typechecked
 def choosing_the_model(
     group: str,
     taxa: str,
@@ -88,7 +229,9 @@ def choosing_the_model(
     - dbh (float): Diameter at breast height.
     - spg (float): Specific gravity of the tree.
     - height (float): The height of the tree.
-    - df: DataFrame called by the function load_taxa_agb_model_data.
+    - df: DataFrame called by the function load_taxa_agb_model_data, or the index
+        returned by load_taxa_model_index. With the index, the model selected for
+        each (group, taxa, spg) is memoized in `model_cache.model_selection_cache`.
     - model_height (AGBModel): Model for estimating AGB when tree height is available.
     - model_no_height (AGBModel): Model for estimating AGB when tree height is not available.
 
@@ -98,18 +241,25 @@ def choosing_the_model(
 
     # If the tree species is known, use the most accurate model that estimates biomass
     # based on the species of the tree (tree_group, tree_taxa)
-    species_result = agb_biomass.agb_biomass_model(group, taxa, spg, df)
+    if isinstance(df, TaxaModelIndex):
+        species_result = model_cache.model_selection_cache.model_parameters(
+            group, taxa, spg, df
+        )
+    else:
+        species_result = agb_biomass.agb_biomass_model(group, taxa, spg, df)
     if species_result:
         if isinstance(species_result, dict):
             b0, b1, Rsquared, diameterClass = list(species_result.values())[0]
         else:
             b0, b1, Rsquared, diameterClass = species_result
         biomass = agb_biomass.biomass(b0, b1, diameterClass, dbh)
+        metrics.count("model_branch.species")
 
     # If the tree has a given height but the species is not in our database, use a more generic model
     # based on the tree's height; it does not require knowledge of the specific species.
     elif height:
         biomass = single_tree_estimation.apply_AGB_model(model_height, spg, dbh, height)
+        metrics.count("model_branch.height")
 
     # If no information is available, use the most generic and less accurate model,
     # estimating biomass based on environmental variables specific to the region.
@@ -117,27 +267,124 @@ def choosing_the_model(
         biomass = single_tree_estimation.apply_AGB_model_no_height(
             model_no_height, spg, dbh, config.E
         )
+        metrics.count("model_branch.no_height")
 
     return biomass
 
 
 @beartype
-def apply_model(tree_data, path_to_taxa_level_parameters: str) -> Optional[list]:
+def choosing_the_model_batch(
+    group,
+    taxa,
+    dbh,
+    spg,
+    height,
+    df,
+    model_height: Optional[AGBModel],
+    model_no_height: Optional[AGBModel],
+) -> np.ndarray:
     """
-    Apply the best model available for each tree data.
+    Vectorized counterpart of `choosing_the_model` for a whole batch of trees.
+
+    Trees are split into the species, height and no-height branches with boolean
+    masks. The species models of all trees are resolved in one bulk lookup against
+    the compiled `TaxaModelIndex`, and the biomass equation of each branch is
+    evaluated over the whole branch at once. The result for each tree is identical to
+    calling `choosing_the_model` on it, except that the generic (height and no-height)
+    models can differ in the last place.
 
     Args:
-    - path_to_data (str): Path to the data to augment with AGB value.
-    - path_to_csv (str): Path to the CSV file.
+    - group (array-like of str): The group of each tree.
+    - taxa (array-like of str): The taxa of each tree.
+    - dbh (array-like of float): Diameter at breast height of each tree.
+    - spg (array-like of float): Specific gravity of each tree (NaN if unknown).
+    - height (array-like of float or None): The height of each tree (NaN if unknown).
+    - df: The index returned by load_taxa_model_index (or the DataFrame returned by
+        load_taxa_agb_model_data, which is compiled into an index).
+    - model_height (AGBModel): Model for estimating AGB when tree height is available.
+    - model_no_height (AGBModel): Model for estimating AGB when tree height is not available.
 
     Returns:
-    dict: Augmented tree data with AGB values.
+    np.ndarray: Estimated Above-Ground Biomass (AGB) of each tree.
     """
+    group = np.asarray(group, dtype=object)
+    taxa = np.asarray(taxa, dtype=object)
+    dbh = np.asarray(dbh, dtype=float)
+    spg = np.asarray(spg, dtype=float)
+    num_trees = len(dbh)
+    if height is None:
+        height = np.full(num_trees, np.nan)
+    height = np.asarray(height, dtype=float)
+
+    # Resolve the taxa-level model of every tree in one bulk index lookup
+    if not isinstance(df, TaxaModelIndex):
+        df = TaxaModelIndex.from_dataframe(df)
+    rows = df.lookup_rows(group, taxa, spg)
+    return _evaluate_model_rows(
+        rows, dbh, spg, height, df, model_height, model_no_height
+    )
 
-    if tree_data is None:
-        return None
 
-    df = agb_biomass.load_taxa_agb_model_data(path_to_taxa_level_parameters)
+def _evaluate_model_rows(
+    rows: np.ndarray,
+    dbh: np.ndarray,
+    spg: np.ndarray,
+    height: np.ndarray,
+    df: TaxaModelIndex,
+    model_height,
+    model_no_height,
+) -> np.ndarray:
+    """Evaluate the biomass equations for trees whose taxa-level model rows have
+    already been looked up (-1 for trees without one)."""
+    if not np.isin(df.diameter_class[rows[rows >= 0]], ("dbh", "drc")).all():
+        raise ValueError
+
+    biomass = np.empty(len(dbh))
+
+    # Trees whose species is known use the taxa-level model
+    species_mask = rows >= 0
+    species_rows = rows[species_mask]
+    diameter = dbh[species_mask]
+    drc_mask = df.diameter_class[species_rows] == "drc"
+    diameter[drc_mask] = np.exp(0.36738 + 0.94932 * np.log(diameter[drc_mask]))
+    biomass[species_mask] = np.exp(
+        df.b0[species_rows] + df.b1[species_rows] * np.log(diameter)
+    )
+
+    # The remaining trees fall back to the generic models, depending on whether
+    # their height is known
+    has_height = ~np.isnan(height) & (height != 0)
+    height_mask = ~species_mask & has_height
+    no_height_mask = ~species_mask & ~has_height
+    # As `agb_biomass.agb_biomass_model` counts them one tree at a time
+    num_unmatched = len(rows) - len(species_rows)
+    if num_unmatched:
+        metrics.count("taxa_model.no_match", num_unmatched)
+    for branch, mask in [
+        ("species", species_mask),
+        ("height", height_mask),
+        ("no_height", no_height_mask),
+    ]:
+        num_branch_trees = int(mask.sum())
+        if num_branch_trees:
+            metrics.count(f"model_branch.{branch}", num_branch_trees)
+    # The generic models are evaluated over each branch's trees at once
+    if height_mask.any():
+        biomass[height_mask] = model_height(
+            spg[height_mask], dbh[height_mask], height[height_mask]
+        )
+    if no_height_mask.any():
+        rho, diameter = spg[no_height_mask], dbh[no_height_mask]
+        # The model takes logarithms, which fail on one tree in `choosing_the_model`
+        if (diameter <= 0).any() or (rho <= 0).any():
+            raise ValueError("math domain error")
+        biomass[no_height_mask] = model_no_height(rho, diameter, config.E)
+
+    return biomass
+
+
+def _create_fallback_models() -> tuple:
+    """Create the generic height and no-height AGB models from the config."""
     model_height = single_tree_estimation.create_AGB_function(
         coef=config.COEF, exp=config.EXP
     )
@@ -148,54 +395,601 @@ def apply_model(tree_data, path_to_taxa_level_parameters: str) -> Optional[list]
         coef_d=config.COEF_D,
         coef_d_squared=config.COEF_D_SQUARED,
     )
+    return model_height, model_no_height
 
-    for tree in tree_data:
-        group, taxa, dbh, spg, height = (
-            tree["group"],
-            tree["taxa"],
-            tree["dbh"],
-            tree["spg"],
-            tree["height"],
-        )
 
-        biomass = choosing_the_model(
-            group=group,
-            taxa=taxa,
-            dbh=dbh,
-            spg=spg,
-            height=height,
+def _tree_columns(trees, positions: bool = False) -> dict:
+    """Return the columns needed for AGB estimation from a batch of trees.
+
+    The trees may be given as a DataFrame, as a mapping from column name to array,
+    or as a list of tree dictionaries. The "height" column is optional. If
+    `positions` is True, the "x_pos" and "y_pos" columns are included too.
+    """
+    names = ["group", "taxa", "dbh", "spg"] + (["x_pos", "y_pos"] if positions else [])
+    if isinstance(trees, list):
+        if any("height" in tree for tree in trees):
+            names = names + ["height"]
+        trees = {name: [tree.get(name) for tree in trees] for name in names}
+
+    columns = {name: np.asarray(trees[name]) for name in names}
+    columns["height"] = np.asarray(trees["height"]) if "height" in trees else None
+
+    # None marks a missing value in the dictionary format; use NaN instead
+    for name in ("dbh", "spg", "height", "x_pos", "y_pos"):
+        if columns.get(name) is not None and columns[name].dtype == object:
+            columns[name] = np.array(
+                [np.nan if value is None else value for value in columns[name]],
+                dtype=float,
+            )
+    return columns
+
+
+def _estimate_columns(
+    columns: dict, df, model_height: AGBModel, model_no_height: AGBModel
+) -> np.ndarray:
+    """Run `choosing_the_model_batch` on the columns returned by `_tree_columns`."""
+    with metrics.stage("estimate", len(columns["dbh"])):
+        return choosing_the_model_batch(
+            group=columns["group"],
+            taxa=columns["taxa"],
+            dbh=columns["dbh"],
+            spg=columns["spg"],
+            height=columns["height"],
             df=df,
             model_height=model_height,
             model_no_height=model_no_height,
         )
-        tree["AGB value"] = biomass
+
+
+def _estimate_tree_batch(
+    batch: tree_batch.TreeBatch,
+    df: TaxaModelIndex,
+    model_height: AGBModel,
+    model_no_height: AGBModel,
+) -> np.ndarray:
+    """Estimate AGB for a `TreeBatch`, looking up the taxa-level models by the
+    batch's group and taxa codes rather than by label."""
+    with metrics.stage("estimate", len(batch)):
+        rows = df.lookup_row_codes(
+            batch.codes["group"],
+            batch.labels["group"],
+            batch.codes["taxa"],
+            batch.labels["taxa"],
+            batch["spg"],
+        )
+        height = batch.columns.get("height")
+        if height is None:
+            height = np.full(len(batch), np.nan)
+        return _evaluate_model_rows(
+            rows,
+            np.asarray(batch["dbh"], dtype=float),
+            np.asarray(batch["spg"], dtype=float),
+            np.asarray(height, dtype=float),
+            df,
+            model_height,
+            model_no_height,
+        )
+
+
+def _process_tree_chunk(
+    chunk: list,
+    database: dict,
+    df,
+    model_height: AGBModel,
+    model_no_height: AGBModel,
+    resolver: Optional[species_resolver.SpeciesResolver] = None,
+) -> list:
+    """Preprocess a list of raw tree entries and augment them with AGB values."""
+    tree_data = _tree_records(
+        tree_preprocessing.preprocess_tree_entries(chunk, database, resolver)
+    )
+    if resolver is not None:
+        resolver.flush()
+    if tree_data:
+        biomass = _estimate_columns(
+            _tree_columns(tree_data), df, model_height, model_no_height
+        )
+        for tree, value in zip(tree_data, biomass.tolist()):
+            tree["AGB value"] = value
+    return tree_data
+
+
+# Reference tables loaded once by each worker process of a parallel run
+_worker_tables: dict = {}
+
+# The config values that workers need from the parent process. Workers started with
+# the "spawn" or "forkserver" method re-import the config instead of inheriting it,
+# so changes made at runtime (e.g. by the CLI's --resolve-species, or to the model
+# coefficients between analyses) are passed on
+WORKER_CONFIG = config.MODEL_CONFIG + ("REFERENCE_TABLE_CACHE_DIR",)
+
+
+def _worker_initargs(
+    preprocessing_species_info_path: Optional[str], path_to_taxa_level_parameters: str
+) -> tuple:
+    """The arguments of `_init_worker`, including the parent's settings."""
+    settings = {name: getattr(config, name) for name in WORKER_CONFIG}
+    settings["fast_mode"] = typecheck.fast_mode_enabled()
+    return preprocessing_species_info_path, path_to_taxa_level_parameters, settings
+
+
+def _init_worker(
+    preprocessing_species_info_path: Optional[str],
+    path_to_taxa_level_parameters: str,
+    settings: Optional[dict] = None,
+):
+    """Apply the parent's settings (see `_worker_initargs`) to a worker process of a
+    parallel run, and load the reference tables into it."""
+    # A forked worker starts with a copy of the parent's metrics, which must not be
+    # handed back to it (see `_worker_metrics`)
+    metrics.reset()
+    if settings is not None:
+        settings = dict(settings)
+        typecheck.set_fast_mode(settings.pop("fast_mode"))
+        for name, value in settings.items():
+            setattr(config, name, value)
+    if preprocessing_species_info_path is not None:
+        _worker_tables["database"] = reference_tables.load_species_database(
+            preprocessing_species_info_path
+        )
+        _worker_tables["resolver"] = _species_resolver(preprocessing_species_info_path)
+    _worker_tables["df"] = reference_tables.load_taxa_model_index(
+        path_to_taxa_level_parameters
+    )
+    _worker_tables["models"] = _create_fallback_models()
+
+
+def _worker_metrics() -> dict:
+    """Take the metrics recorded in a worker process since the last call, to be
+    returned with a task's result and merged into the parent's with
+    `_merge_worker_metrics`."""
+    snapshot = metrics.snapshot()
+    metrics.reset()
+    return snapshot
+
+
+def _merge_worker_metrics(snapshot: dict):
+    """Add the metrics recorded by a worker task to this process's. The workers'
+    stages overlap the parent's (e.g. its "estimate" stage around the whole pool),
+    so they are kept apart as "worker.<stage>"."""
+    metrics.merge(snapshot, stage_prefix="worker.")
+
+
+def _estimate_shard_in_worker(columns: dict) -> Tuple[np.ndarray, dict]:
+    """Estimate AGB for one shard of tree columns in a worker process. Returns the
+    estimates and the worker's metrics."""
+    biomass = _estimate_columns(
+        columns, _worker_tables["df"], *_worker_tables["models"]
+    )
+    return biomass, _worker_metrics()
+
+
+def _process_tree_chunk_in_worker(chunk: list) -> Tuple[list, dict]:
+    """Process one chunk of raw tree entries in a worker process. Returns the
+    processed trees and the worker's metrics."""
+    trees = _process_tree_chunk(
+        chunk,
+        _worker_tables["database"],
+        _worker_tables["df"],
+        *_worker_tables["models"],
+        resolver=_worker_tables["resolver"],
+    )
+    return trees, _worker_metrics()
+
+
+@beartype
+def apply_model_batch(
+    trees,
+    path_to_taxa_level_parameters: str,
+) -> np.ndarray:
+    """
+    Apply the best model available to a whole batch of trees at once.
+
+    Args:
+    - trees: The preprocessed trees, as a `TreeBatch`, a DataFrame, a mapping from
+        column name to array, or a list of tree dictionaries, with "dbh", "group",
+        "taxa", "spg" and (optionally) "height" columns.
+    - path_to_taxa_level_parameters (str): Path to the taxa-level parameters CSV file.
+
+    Returns:
+    np.ndarray: Estimated AGB value of each tree, in the same order as the input.
+    """
+    df = reference_tables.load_taxa_model_index(path_to_taxa_level_parameters)
+    model_height, model_no_height = _create_fallback_models()
+    if isinstance(trees, tree_batch.TreeBatch):
+        return _estimate_tree_batch(trees, df, model_height, model_no_height)
+
+    columns = _tree_columns(trees)
+    return _estimate_columns(columns, df, model_height, model_no_height)
+
+
+@beartype
+def apply_model_parallel(
+    trees,
+    path_to_taxa_level_parameters: str,
+    workers: Optional[int] = None,
+    shard_size: Optional[int] = None,
+    tile_size: Optional[float] = None,
+) -> np.ndarray:
+    """
+    Apply the best model available to a batch of trees using a pool of processes.
+
+    The trees are split into shards that are estimated with `choosing_the_model_batch`
+    in separate worker processes, each of which loads the taxa-level parameters only
+    once. The result is identical to `apply_model_batch`, and in the same order as
+    the input whatever the number of workers.
+
+    Args:
+    - trees: The preprocessed trees, in any format accepted by `apply_model_batch`.
+    - path_to_taxa_level_parameters (str): Path to the taxa-level parameters CSV file.
+    - workers (int): Number of worker processes (defaults to the number of CPUs).
+    - shard_size (int): Number of trees per shard (defaults to an equal split of the
+        trees between the workers).
+    - tile_size (float): If given, group the trees into square spatial tiles of this
+        size (using "x_pos" and "y_pos") and keep each tile within one shard.
+
+    Returns:
+    np.ndarray: Estimated AGB value of each tree, in the same order as the input.
+    """
+    columns = _tree_columns(trees, positions=tile_size is not None)
+    num_trees = len(columns["dbh"])
+    workers = workers or parallel.default_workers()
+    if shard_size is None:
+        shard_size = max(1, -(-num_trees // workers))
+
+    order = None
+    if tile_size is not None:
+        order, shards = parallel.tile_shards(
+            columns.pop("x_pos"), columns.pop("y_pos"), tile_size, shard_size
+        )
+        columns = {
+            name: None if column is None else column[order]
+            for name, column in columns.items()
+        }
+    else:
+        shards = parallel.row_shards(num_trees, -(-num_trees // shard_size))
+
+    shard_columns = (
+        {
+            name: None if column is None else column[start:stop]
+            for name, column in columns.items()
+        }
+        for start, stop in shards
+    )
+    with metrics.stage("estimate", num_trees), parallel.process_pool(
+        workers, _init_worker, _worker_initargs(None, path_to_taxa_level_parameters)
+    ) as pool:
+        results = []
+        for shard_biomass, worker_metrics in pool.map(
+            _estimate_shard_in_worker, shard_columns
+        ):
+            results.append(shard_biomass)
+            _merge_worker_metrics(worker_metrics)
+    biomass = np.concatenate(results) if results else np.empty(0)
+
+    if order is not None:
+        unsorted = np.empty_like(biomass)
+        unsorted[order] = biomass
+        biomass = unsorted
+    return biomass
+
+
+@beartype
+def apply_model(
+    tree_data,
+    path_to_taxa_level_parameters: str,
+    vectorized: bool = False,
+    workers: Optional[int] = None,
+) -> Optional[Union[list, tree_batch.TreeBatch]]:
+    """
+    Apply the best model available for each tree data.
+
+    Args:
+    - path_to_data (str): Path to the data to augment with AGB value.
+    - path_to_csv (str): Path to the CSV file.
+    - vectorized (bool): If True, estimate all trees at once with `apply_model_batch`
+        instead of one tree at a time.
+    - workers (int): If given, estimate the trees in this many processes with
+        `apply_model_parallel`.
+
+    A `TreeBatch` is always estimated as a whole batch, and is returned with an
+    "AGB value" column.
+
+    Returns:
+    dict: Augmented tree data with AGB values.
+    """
+
+    if tree_data is None:
+        return None
+
+    if isinstance(tree_data, tree_batch.TreeBatch):
+        if workers is not None:
+            biomass = apply_model_parallel(
+                tree_data, path_to_taxa_level_parameters, workers=workers
+            )
+        else:
+            biomass = apply_model_batch(tree_data, path_to_taxa_level_parameters)
+        tree_data[tree_table.AGB_COLUMN] = biomass
+        return tree_data
+
+    if vectorized or workers is not None:
+        if not tree_data:
+            return tree_data
+        if workers is not None:
+            biomass = apply_model_parallel(
+                tree_data, path_to_taxa_level_parameters, workers=workers
+            )
+        else:
+            biomass = apply_model_batch(tree_data, path_to_taxa_level_parameters)
+        for tree, value in zip(tree_data, biomass.tolist()):
+            tree["AGB value"] = value
+        return tree_data
+
+    # In fast mode the per-tree functions skip their type checks, so check the whole
+    # batch here instead
+    if typecheck.fast_mode_enabled():
+        typecheck.validate_tree_records(tree_data)
+
+    df = reference_tables.load_taxa_model_index(path_to_taxa_level_parameters)
+    model_height, model_no_height = _create_fallback_models()
+
+    with metrics.stage("estimate", len(tree_data)):
+        for tree in tree_data:
+            group, taxa, dbh, spg, height = (
+                tree["group"],
+                tree["taxa"],
+                tree["dbh"],
+                tree["spg"],
+                tree["height"],
+            )
+
+            biomass = choosing_the_model(
+                group=group,
+                taxa=taxa,
+                dbh=dbh,
+                spg=spg,
+                height=height,
+                df=df,
+                model_height=model_height,
+                model_no_height=model_no_height,
+            )
+            tree["AGB value"] = biomass
 
     return tree_data
 
 
 @beartype
-def run_model(input_data_path: str, save_output_path: str):
+def run_model_streaming(
+    input_data_path: str,
+    save_output_path: str,
+    chunk_size: int = 10000,
+    workers: Optional[int] = None,
+    grid: Optional[gridding.CarbonGrid] = None,
+) -> int:
+    """
+    Estimate AGB for a file of trees without loading it all into memory.
+
+    Trees are read incrementally from a `{"trees": [...]}` JSON document or a
+    newline-delimited JSON file, preprocessed and estimated `chunk_size` trees at a
+    time, and written out as each chunk completes, so peak memory depends on the chunk
+    size rather than on the size of the input. The output is the same as `run_model`
+    produces, as a JSON list or (for `.ndjson`/`.jsonl` paths) newline-delimited JSON.
+
+    Args:
+    - input_data_path (str): Path to the input data.
+    - save_output_path (str): Path where the augmented data should be saved.
+    - chunk_size (int): Number of trees to process at a time.
+    - workers (int): If given, process the chunks in this many worker processes.
+        Chunks are still written in input order.
+    - grid (CarbonGrid): If given, each chunk is also added to this grid.
+
+    Returns:
+    int: The number of trees processed.
+
+    Raises:
+    - json.JSONDecodeError: If the input is not valid JSON.
+    - KeyError: If a tree's species is not in the species database.
+    """
+    chunks = streaming.iter_chunks(streaming.iter_trees(input_data_path), chunk_size)
+
+    with streaming.open_tree_writer(save_output_path) as writer:
+        if workers is None:
+            database = reference_tables.load_species_database(
+                config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO
+            )
+            df = reference_tables.load_taxa_model_index(
+                config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS
+            )
+            model_height, model_no_height = _create_fallback_models()
+            resolver = _species_resolver(config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO)
+            for chunk in chunks:
+                tree_data = _process_tree_chunk(
+                    chunk, database, df, model_height, model_no_height, resolver
+                )
+                with metrics.stage("write_output", len(tree_data)):
+                    writer.write_many(tree_data)
+                if grid is not None:
+                    grid.add_trees(tree_data)
+        else:
+            # Keep a couple of chunks per worker in flight, so that memory stays
+            # bounded while the workers stay busy
+            with parallel.process_pool(
+                workers,
+                _init_worker,
+                _worker_initargs(
+                    config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO,
+                    config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS,
+                ),
+            ) as pool:
+                for tree_data, worker_metrics in parallel.imap_ordered(
+                    pool, _process_tree_chunk_in_worker, chunks, 2 * workers
+                ):
+                    _merge_worker_metrics(worker_metrics)
+                    with metrics.stage("write_output", len(tree_data)):
+                        writer.write_many(tree_data)
+                    if grid is not None:
+                        grid.add_trees(tree_data)
+
+    return writer.count
+
+
+@beartype
+def run_model_columnar(
+    input_data_path: str,
+    save_output_path: str,
+    workers: Optional[int] = None,
+    grid: Optional[gridding.CarbonGrid] = None,
+) -> "pandas.DataFrame":
+    """
+    Estimate AGB for a table of trees, working on columns rather than tree dicts.
+
+    Args:
+    - input_data_path (str): Path to a CSV, Parquet, Arrow, JSON or NDJSON file.
+    - save_output_path (str): Path where the augmented data should be saved. CSV,
+        Parquet and Arrow paths are written as typed columns; other paths as JSON.
+    - workers (int): If given, estimate the trees in this many processes with
+        `apply_model_parallel`.
+    - grid (CarbonGrid): If given, the trees are also added to this grid.
+
+    Returns:
+    pd.DataFrame: The processed trees with an "AGB value" column.
+    """
+    trees = load_tree_table(
+        input_data_path, config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO
+    )
+    if workers is None:
+        trees[tree_table.AGB_COLUMN] = apply_model_batch(
+            trees, config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS
+        )
+    else:
+        trees[tree_table.AGB_COLUMN] = apply_model_parallel(
+            trees, config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS, workers=workers
+        )
+
+    with metrics.stage("write_output", len(trees)):
+        if tree_table.is_columnar(save_output_path):
+            tree_table.write_tree_table(trees, save_output_path)
+        else:
+            with streaming.open_tree_writer(save_output_path) as writer:
+                writer.write_many(tree_table.tree_table_records(trees))
+    if grid is not None:
+        grid.add_trees(trees)
+
+    return trees
+
+
+@beartype
+def run_model_tree_batch(
+    input_data_path: str,
+    save_output_path: str,
+    workers: Optional[int] = None,
+    grid: Optional[gridding.CarbonGrid] = None,
+) -> tree_batch.TreeBatch:
+    """
+    Estimate AGB for a file of trees, holding them as a compact `TreeBatch`.
+
+    The trees take about 60 bytes each in memory instead of about 1 KB as tree
+    dicts, and the output is the same as `run_model` produces.
+
+    Args:
+    - input_data_path (str): Path to a JSON, NDJSON, CSV, Parquet or Arrow file.
+    - save_output_path (str): Path where the augmented data should be saved (see
+        `tree_batch.write_tree_batch`).
+    - workers (int): If given, estimate the trees in this many processes with
+        `apply_model_parallel`.
+    - grid (CarbonGrid): If given, the trees are also added to this grid.
+
+    Returns:
+    TreeBatch: The processed trees with an "AGB value" column.
+    """
+    batch = load_tree_batch(
+        input_data_path, config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO
+    )
+    batch = apply_model(
+        batch, config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS, workers=workers
+    )
+    with metrics.stage("write_output", len(batch)):
+        tree_batch.write_tree_batch(batch, save_output_path)
+    if grid is not None:
+        grid.add_trees(batch)
+    return batch
+
+
+@beartype
+def run_model(
+    input_data_path: str,
+    save_output_path: str,
+    chunk_size: Optional[int] = None,
+    workers: Optional[int] = None,
+    grid: Optional[gridding.CarbonGrid] = None,
+) -> int:
     """
     Save the augmented data to the specified path.
 
     Args:
     - input_data_path (str): Path to the input data.
     - save_output_path (str): Path where the augmented data should be saved.
+    - chunk_size (int): If given, stream the data through the model this many trees
+        at a time with `run_model_streaming` instead of loading it all at once.
+        Newline-delimited JSON (`.ndjson`/`.jsonl`, for either path) is always
+        streamed.
+    - workers (int): If given, estimate the trees in this many worker processes.
+        The output is the same as with a single process.
+    - grid (CarbonGrid): If given, the processed trees are also added to this grid
+        (see `gridding`), so that the totals of many files can be accumulated.
+
+    CSV, Parquet and Arrow files (for either path) are processed as tables with
+    `run_model_columnar`.
+
+    Returns:
+    int: The number of trees processed.
+
+    Raises:
+    - ValueError: If a JSON input that is loaded whole is missing or is not valid
+        JSON. Nothing is saved.
     """
+    if tree_table.is_columnar(input_data_path) or tree_table.is_columnar(
+        save_output_path
+    ):
+        trees = run_model_columnar(
+            input_data_path, save_output_path, workers=workers, grid=grid
+        )
+        return len(trees)
+
+    if (
+        chunk_size is not None
+        or streaming.is_ndjson(input_data_path)
+        or streaming.is_ndjson(save_output_path)
+    ):
+        count = run_model_streaming(
+            input_data_path,
+            save_output_path,
+            chunk_size=chunk_size if chunk_size is not None else 10000,
+            workers=workers,
+            grid=grid,
+        )
+        return count
+
     # Loading the tree data and preprocessing it
     preprocessing_species_info_path = config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO
     path_to_taxa_level_parameters = config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS
-    print(input_data_path)
-    print(preprocessing_species_info_path)
     tree_data = load_tree_data_from_json(
         input_data_path, preprocessing_species_info_path
     )
+    if tree_data is None:
+        raise ValueError(f"No tree data could be loaded from {input_data_path}")
 
     # Augmenting the tree data with Above-Ground Biomass (AGB) information
-    processed_data = apply_model(tree_data, path_to_taxa_level_parameters)
+    processed_data = apply_model(
+        tree_data, path_to_taxa_level_parameters, workers=workers
+    )
 
     # Saving the augmented tree data into a new file
-    with open(save_output_path, "w") as json_file:
+    with metrics.stage("write_output", len(processed_data)), open(
+        save_output_path, "w"
+    ) as json_file:
         json.dump(processed_data, json_file, indent=2)
+    if grid is not None:
+        grid.add_trees(processed_data)
 
-    print("Augmented data saved successfully.")
+    return len(processed_data)
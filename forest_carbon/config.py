@@ -14,6 +14,19 @@ COEF_D_SQUARED = 0.0299
 # Environmental variable, to be changed to the relevant value based on the forest's position
 E = 1.0
 
+# Skip the runtime type checks on the per-tree functions (see typecheck.py), which
+# are validated once per batch instead
+TYPECHECK_FAST_MODE = os.environ.get("FOREST_CARBON_FAST_MODE", "").lower() not in (
+    "",
+    "0",
+    "false",
+    "no",
+)
+
+# Maximum number of (group, taxa, spg) model selections memoized by the per-tree
+# model (see model_cache.py)
+MODEL_SELECTION_CACHE_SIZE = 1024
+
 # Path to the CSV file used to augment the data with the group and taxa name
 PATH_TO_TREE_PREPROCESSING_SPECIES_INFO = os.path.join(
     os.path.dirname(__file__), "data/tree_species_info.csv"
@@ -23,3 +36,79 @@ PATH_TO_TREE_PREPROCESSING_SPECIES_INFO = os.path.join(
 PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS = os.path.join(
     os.path.dirname(__file__), "data/taxa_level_agb_model_parameters.csv"
 )
+
+# Directory where compiled reference tables are cached between runs (see
+# reference_tables.py). Set to None to disable the on-disk cache.
+REFERENCE_TABLE_CACHE_DIR = os.environ.get(
+    "FOREST_CARBON_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "forest_carbon"),
+)
+
+# Resolve species labels that are not exact common names in the species info CSV
+# (e.g. "oak tree", "Pinus contorta" or FIA codes) with species_resolver.py
+RESOLVE_SPECIES_LABELS = os.environ.get(
+    "FOREST_CARBON_RESOLVE_SPECIES", ""
+).lower() not in ("", "0", "false", "no")
+
+# Extra species labels for the resolver, mapping to common names. The generic labels
+# in the example data stand for the species they were generated with (see
+# scripts/generate_test_data.py)
+SPECIES_ALIASES = {
+    "maple tree": "Maple, sugar",
+    "pine tree": "Pine, lodgepole",
+}
+
+# The settings above that affect the AGB estimates. They are passed on to worker
+# processes (see combined_agb_calculator.py) and hashed into the manifests of
+# incremental runs (see incremental.py)
+MODEL_CONFIG = (
+    "COEF",
+    "EXP",
+    "CONST",
+    "COEF_E",
+    "COEF_RHO",
+    "COEF_D",
+    "COEF_D_SQUARED",
+    "E",
+    "RESOLVE_SPECIES_LABELS",
+    "SPECIES_ALIASES",
+)
+
+# Record stage timings, counters and cache hit rates as the pipeline runs (see
+# instrumentation.py)
+INSTRUMENTATION_ENABLED = os.environ.get(
+    "FOREST_CARBON_INSTRUMENTATION", "1"
+).lower() not in ("", "0", "false", "no")
+
+# Width of the cells that trees are aggregated into with `--grid` (see gridding.py), in
+# the units of the tree positions
+GRID_CELL_SIZE = 10.0
+
+# Monte Carlo uncertainty of the AGB estimates (see uncertainty.py).
+# Number of samples drawn for each tree, and the random seed (None for a fresh one)
+UNCERTAINTY_SAMPLES = 1000
+UNCERTAINTY_SEED = None
+# Largest number of (sample, tree) values held in memory at once
+UNCERTAINTY_CHUNK_ELEMENTS = 1 << 22
+# Relative standard deviation of the dbh and spg measurements
+DBH_RELATIVE_ERROR = 0.05
+SPG_RELATIVE_ERROR = 0.1
+# Residual standard errors, on the log scale, of the generic height model (Chave et
+# al., 2014) and of the no-height model, which is less precise as it also has to
+# account for the unknown height, and the number of trees they were fitted to
+HEIGHT_MODEL_RSE = 0.357
+NO_HEIGHT_MODEL_RSE = 0.4
+GENERIC_MODEL_OBSERVATIONS = 4004
+# Residual standard error, on the log scale, of taxa-level models whose fit statistics
+# are incomplete
+TAXA_MODEL_RSE = 0.8
+
+# Estimation server (see server.py). It only listens on the local machine by default
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+# How long the server waits for more requests to join a batch, in seconds, and the
+# most trees it estimates in one batch
+SERVER_BATCH_WAIT = 0.0002
+SERVER_MAX_BATCH_TREES = 100000
+# Number of recent request latencies kept for the percentiles in /metrics
+SERVER_LATENCY_WINDOW = 10000
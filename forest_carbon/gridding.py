@@ -0,0 +1,281 @@
+"""
+Gridded aggregation of per-tree AGB into raster cells.
+
+`CarbonGrid` bins trees into square cells of `cell_size` (in the units of "x_pos"
+and "y_pos"), aligned to `origin`, and keeps three totals per cell:
+
+- "agb": the total AGB of the trees in the cell,
+- "stems": the number of trees, and
+- "basal_area": the total basal area, pi * (dbh / 2) ** 2, in the squared units of
+  "dbh".
+
+Trees are added a batch at a time with `np.bincount`, so the cost is linear in the
+number of trees. The grid grows to cover each batch, so its extent doesn't need to be
+known in advance, and only the per-cell totals are kept: trees from any number of
+files can be accumulated a chunk at a time, by passing the grid to
+`combined_agb_calculator.run_model` or, for outputs that are already saved, with
+`aggregate_files`. Grids are saved as compressed `.npz` arrays. Tiles are just
+larger cells, so a grid of 100 m tiles is `CarbonGrid(100.0)`.
+"""
+
+import math
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+from . import streaming, tree_table
+from .instrumentation import metrics
+
+# The per-cell totals kept by a CarbonGrid
+GRID_LAYERS = ("agb", "stems", "basal_area")
+
+
+class CarbonGrid:
+    """
+    Per-cell totals of AGB, stem count and basal area on a regular grid.
+
+    Cell (i, j) covers x in [x_min + j * cell_size, x_min + (j + 1) * cell_size) and
+    y in [y_min + i * cell_size, y_min + (i + 1) * cell_size), where (x_min, y_min)
+    is the corner of the grid given by `bounds`, so rows run from south to north.
+
+    Args:
+        cell_size (float): The width of each (square) cell.
+        origin (tuple): A corner (x, y) of one of the cells; the cell edges are
+            aligned to it.
+
+    Attributes:
+        agb (np.ndarray): The total AGB of each cell.
+        stems (np.ndarray): The number of trees in each cell.
+        basal_area (np.ndarray): The total basal area of each cell.
+        skipped (int): The number of trees left out because their position or AGB
+            was missing.
+    """
+
+    def __init__(self, cell_size: float, origin: Tuple[float, float] = (0.0, 0.0)):
+        if not cell_size > 0:
+            raise ValueError("cell_size must be positive")
+        self.cell_size = float(cell_size)
+        self.origin = (float(origin[0]), float(origin[1]))
+        # The cell indices, counted from the origin, of cell (0, 0)
+        self.offset = (0, 0)
+        self.agb = np.zeros((0, 0))
+        self.stems = np.zeros((0, 0), dtype=np.int64)
+        self.basal_area = np.zeros((0, 0))
+        self.skipped = 0
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        """The number of (rows, columns) of cells."""
+        return self.stems.shape
+
+    @property
+    def bounds(self) -> Tuple[float, float, float, float]:
+        """The (x_min, x_max, y_min, y_max) edges of the grid."""
+        x_min = self.origin[0] + self.offset[0] * self.cell_size
+        y_min = self.origin[1] + self.offset[1] * self.cell_size
+        rows, columns = self.shape
+        return (
+            x_min,
+            x_min + columns * self.cell_size,
+            y_min,
+            y_min + rows * self.cell_size,
+        )
+
+    def cell_centers(self) -> Tuple[np.ndarray, np.ndarray]:
+        """The x coordinates of the centers of the columns, and the y coordinates of
+        the centers of the rows."""
+        x_min, _, y_min, _ = self.bounds
+        rows, columns = self.shape
+        return (
+            x_min + (np.arange(columns) + 0.5) * self.cell_size,
+            y_min + (np.arange(rows) + 0.5) * self.cell_size,
+        )
+
+    def agb_density(self) -> np.ndarray:
+        """The AGB per unit area of each cell."""
+        return self.agb / self.cell_size**2
+
+    def _grow(self, ix_min: int, ix_max: int, iy_min: int, iy_max: int):
+        """Extend the grid to cover the cells from (ix_min, iy_min) to (ix_max,
+        iy_max), counted from the origin."""
+        rows, columns = self.shape
+        if rows:
+            x0, y0 = self.offset
+            ix_min, ix_max = min(ix_min, x0), max(ix_max, x0 + columns - 1)
+            iy_min, iy_max = min(iy_min, y0), max(iy_max, y0 + rows - 1)
+            if (ix_min, iy_min, ix_max, iy_max) == (
+                x0,
+                y0,
+                x0 + columns - 1,
+                y0 + rows - 1,
+            ):
+                return
+        shape = (iy_max - iy_min + 1, ix_max - ix_min + 1)
+        for name in GRID_LAYERS:
+            layer = getattr(self, name)
+            grown = np.zeros(shape, dtype=layer.dtype)
+            if rows:
+                row, column = self.offset[1] - iy_min, self.offset[0] - ix_min
+                grown[row : row + rows, column : column + columns] = layer
+            setattr(self, name, grown)
+        self.offset = (ix_min, iy_min)
+
+    def _accumulate(
+        self,
+        ix: np.ndarray,
+        iy: np.ndarray,
+        agb: np.ndarray,
+        stems: np.ndarray,
+        basal_area: np.ndarray,
+    ):
+        """Add totals to the cells (ix, iy), counted from the origin."""
+        if not len(ix):
+            return
+        self._grow(int(ix.min()), int(ix.max()), int(iy.min()), int(iy.max()))
+        rows, columns = self.shape
+        cells = (iy - self.offset[1]) * columns + (ix - self.offset[0])
+        size = rows * columns
+        self.agb += np.bincount(cells, agb, size).reshape(rows, columns)
+        stem_counts = np.bincount(cells, stems, size).round().astype(np.int64)
+        self.stems += stem_counts.reshape(rows, columns)
+        self.basal_area += np.bincount(cells, basal_area, size).reshape(rows, columns)
+
+    def add(self, x, y, agb, dbh) -> int:
+        """
+        Add a batch of trees.
+
+        Args:
+            x (array-like): The x position of each tree.
+            y (array-like): The y position of each tree.
+            agb (array-like): The AGB of each tree.
+            dbh (array-like): The diameter of each tree; missing diameters add no
+                basal area.
+
+        Returns:
+            int: The number of trees added. Trees with a missing position or AGB
+                are left out, and counted in `skipped`.
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        agb = np.asarray(agb, dtype=float)
+        dbh = np.asarray(dbh, dtype=float)
+        with metrics.stage("aggregate", len(x)):
+            valid = np.isfinite(x) & np.isfinite(y) & np.isfinite(agb)
+            if not valid.all():
+                self.skipped += int(len(valid) - valid.sum())
+                x, y, agb, dbh = x[valid], y[valid], agb[valid], dbh[valid]
+            ix = np.floor((x - self.origin[0]) / self.cell_size).astype(np.int64)
+            iy = np.floor((y - self.origin[1]) / self.cell_size).astype(np.int64)
+            basal_area = np.nan_to_num(math.pi * (dbh / 2) ** 2)
+            self._accumulate(ix, iy, agb, np.ones(len(ix)), basal_area)
+        return len(ix)
+
+    def add_trees(self, trees, value: str = tree_table.AGB_COLUMN) -> int:
+        """
+        Add a batch of trees with their AGB, as returned by `apply_model`.
+
+        Args:
+            trees: The trees, as a list of dictionaries, a DataFrame, or a mapping
+                from column name to array, with "x_pos", "y_pos", "dbh" and `value`
+                columns. Missing values may be None or NaN.
+            value (str): The column holding the AGB of each tree.
+
+        Returns:
+            int: The number of trees added.
+        """
+        names = ("x_pos", "y_pos", value, "dbh")
+        if isinstance(trees, list):
+            columns = [
+                np.array(
+                    [
+                        np.nan if tree.get(name) is None else tree[name]
+                        for tree in trees
+                    ],
+                    dtype=float,
+                )
+                for name in names
+            ]
+        else:
+            columns = [np.asarray(trees[name], dtype=float) for name in names]
+        return self.add(*columns)
+
+    def merge(self, other: "CarbonGrid"):
+        """
+        Add the totals of another grid, with the same cell size and alignment.
+
+        Raises:
+            ValueError: If the cells of the grids don't line up.
+        """
+        if other.cell_size != self.cell_size or other.origin != self.origin:
+            raise ValueError(
+                "Only grids with the same cell size and origin can be merged"
+            )
+        self.skipped += other.skipped
+        if not other.stems.size:
+            return
+        iy, ix = np.indices(other.shape)
+        self._accumulate(
+            (ix + other.offset[0]).ravel(),
+            (iy + other.offset[1]).ravel(),
+            other.agb.ravel(),
+            other.stems.ravel(),
+            other.basal_area.ravel(),
+        )
+
+    def save(self, path: str):
+        """Save the grid as a compressed `.npz` file of arrays."""
+        np.savez_compressed(
+            path,
+            cell_size=self.cell_size,
+            origin=np.array(self.origin),
+            offset=np.array(self.offset),
+            bounds=np.array(self.bounds),
+            skipped=self.skipped,
+            **{name: getattr(self, name) for name in GRID_LAYERS},
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "CarbonGrid":
+        """Load a grid saved with `save`."""
+        with np.load(path) as arrays:
+            grid = cls(float(arrays["cell_size"]), tuple(arrays["origin"].tolist()))
+            grid.offset = tuple(int(i) for i in arrays["offset"])
+            grid.skipped = int(arrays["skipped"])
+            for name in GRID_LAYERS:
+                setattr(grid, name, arrays[name])
+        return grid
+
+
+def aggregate_files(
+    paths: Iterable[str],
+    cell_size: float,
+    origin: Tuple[float, float] = (0.0, 0.0),
+    chunk_size: int = 10000,
+    grid: Optional[CarbonGrid] = None,
+) -> CarbonGrid:
+    """
+    Aggregate files of trees that already have their AGB (e.g. the outputs of
+    `run_model`) onto a grid.
+
+    JSON and newline-delimited JSON files are read `chunk_size` trees at a time, and
+    columnar files one file at a time, so only the grid is kept between files.
+
+    Args:
+        paths (iterable): Paths to JSON, NDJSON, CSV, Parquet or Arrow files of trees.
+        cell_size (float): The width of each cell, if `grid` is not given.
+        origin (tuple): The alignment of the cells, if `grid` is not given.
+        chunk_size (int): The number of trees to read at a time from JSON files.
+        grid (CarbonGrid): A grid to add the trees to, instead of a new one.
+
+    Returns:
+        CarbonGrid: The grid with the trees of every file added.
+    """
+    if grid is None:
+        grid = CarbonGrid(cell_size, origin)
+    for path in paths:
+        if tree_table.is_columnar(path):
+            grid.add_trees(tree_table.read_tree_table(path))
+        else:
+            for chunk in streaming.iter_chunks(streaming.iter_trees(path), chunk_size):
+                grid.add_trees(chunk)
+    return grid
@@ -0,0 +1,224 @@
+"""
+Incremental re-estimation: reuse the AGB of trees that haven't changed since the last
+run.
+
+Re-surveyed inventories mostly contain the same trees as before. `run_model_incremental`
+fingerprints the inputs of each tree ("species", "dbh", "height", "x_pos" and
+"y_pos") and saves the fingerprints next to the output, in a manifest
+(`manifest_path`) that also records the version of the model: a hash of the species
+and parameter tables and of the `config` values that affect the estimates. On the next
+run, trees whose fingerprint appears in the previous output reuse its AGB and the other
+trees are preprocessed and estimated as usual. If the model version has changed, or
+there is no manifest, every tree is recomputed. The output is the same as a full
+`run_model` run.
+"""
+
+import contextlib
+import hashlib
+import json
+import math
+import os
+import uuid
+from typing import Optional
+
+from . import (
+    combined_agb_calculator,
+    config,
+    gridding,
+    reference_tables,
+    streaming,
+    tree_table,
+)
+from .instrumentation import metrics
+
+# Bump when the fingerprints or the manifest format change
+MANIFEST_VERSION = 1
+
+# The fields of a tree that its fingerprint covers
+INPUT_FIELDS = ("species", "dbh", "height", "x_pos", "y_pos")
+
+# The config values that affect the estimates
+MODEL_CONFIG = config.MODEL_CONFIG
+
+
+def manifest_path(output_path: str) -> str:
+    """The path of the manifest (a JSON file) saved with an output file. It doesn't
+    end in ".json", so that it isn't picked up as an input."""
+    return output_path + ".manifest"
+
+
+def model_version(
+    preprocessing_species_info_path: str, path_to_taxa_level_parameters: str
+) -> str:
+    """
+    Hash everything other than a tree's own inputs that its AGB depends on.
+
+    Args:
+        preprocessing_species_info_path (str): Path to the species info CSV.
+        path_to_taxa_level_parameters (str): Path to the taxa-level parameters CSV.
+
+    Returns:
+        str: A hash of the species table, the taxa-level parameters and the model
+            settings in `config`.
+    """
+    digest = hashlib.sha256(f"forest_carbon-manifest-{MANIFEST_VERSION}".encode())
+    with open(preprocessing_species_info_path, "rb") as species_file:
+        digest.update(hashlib.sha256(species_file.read()).digest())
+    index = reference_tables.load_taxa_model_index(path_to_taxa_level_parameters)
+    digest.update(index.fingerprint.encode())
+    settings = {name: getattr(config, name) for name in MODEL_CONFIG}
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def _normalize(value):
+    """Make equal inputs hash the same whichever format they were read from."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, str):
+        return value
+    return float(value)
+
+
+def tree_fingerprint(tree: dict) -> str:
+    """Hash the `INPUT_FIELDS` of a tree (missing fields count as None)."""
+    key = repr(tuple(map(_normalize, map(tree.get, INPUT_FIELDS))))
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+def _read_trees(data_path: str) -> list:
+    """Read the trees of a JSON (a `{"trees": [...]}` document or a list), NDJSON or
+    columnar file as dictionaries."""
+    if tree_table.is_columnar(data_path):
+        return tree_table.tree_table_records(tree_table.read_tree_table(data_path))
+    if streaming.is_ndjson(data_path):
+        return list(streaming.iter_ndjson_trees(data_path))
+    # All the trees are kept anyway, so parse the file in one go
+    with open(data_path) as json_file:
+        data = json.load(json_file)
+    return data if isinstance(data, list) else data["trees"]
+
+
+def load_previous_results(output_path: str, version: str) -> dict:
+    """
+    Load the processed trees of a previous run, by the fingerprint of their inputs.
+
+    Args:
+        output_path (str): The output file of the previous run.
+        version (str): The current `model_version`.
+
+    Returns:
+        dict: The processed tree for each fingerprint, or an empty dict if there is
+            no previous output with a manifest of the same model version.
+    """
+    try:
+        with open(manifest_path(output_path)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    if manifest.get("model_version") != version:
+        return {}
+    # A missing or damaged output (say, cut short by a crash) is recomputed
+    try:
+        previous = _read_trees(output_path)
+    except (OSError, ValueError, KeyError):
+        return {}
+    if len(previous) != len(manifest["fingerprints"]):
+        return {}
+    return dict(zip(manifest["fingerprints"], previous))
+
+
+def _write_manifest(output_path: str, version: str, fingerprints: list):
+    """Save the manifest of an output file, atomically."""
+    path = manifest_path(output_path)
+    # Opened plainly so that it gets the same permissions as its output file
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, "x") as manifest_file:
+        json.dump(
+            {"model_version": version, "fingerprints": fingerprints}, manifest_file
+        )
+    os.replace(temp_path, path)
+
+
+def run_model_incremental(
+    input_data_path: str,
+    save_output_path: str,
+    previous_output_path: Optional[str] = None,
+    workers: Optional[int] = None,
+    grid: Optional[gridding.CarbonGrid] = None,
+) -> dict:
+    """
+    Estimate AGB for a file of trees, reusing the results of a previous run for the
+    trees whose inputs haven't changed.
+
+    Args:
+        input_data_path (str): Path to a JSON, NDJSON, CSV, Parquet or Arrow file of
+            trees.
+        save_output_path (str): Path to save the processed trees to, as JSON or (for
+            `.ndjson`/`.jsonl` paths) newline-delimited JSON. Its manifest is saved
+            next to it.
+        previous_output_path (str): The output of the previous run. Defaults to
+            `save_output_path`, which is then updated in place.
+        workers (int): If given, estimate the recomputed trees in this many processes
+            (see `combined_agb_calculator.apply_model_parallel`).
+        grid (CarbonGrid): If given, every processed tree (reused or recomputed) is
+            also added to this grid.
+
+    Returns:
+        dict: The number of "trees", and how many were "reused" and "recomputed".
+
+    Raises:
+        ValueError: If the output path is a columnar file.
+        KeyError: If a recomputed tree's species is not in the species database.
+    """
+    if tree_table.is_columnar(save_output_path):
+        raise ValueError("Incremental runs save their output as JSON or NDJSON")
+    preprocessing_species_info_path = config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO
+    path_to_taxa_level_parameters = config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS
+
+    version = model_version(
+        preprocessing_species_info_path, path_to_taxa_level_parameters
+    )
+    previous = load_previous_results(previous_output_path or save_output_path, version)
+
+    with metrics.stage("load_trees") as stage:
+        trees = _read_trees(input_data_path)
+        stage.items = len(trees)
+    fingerprints = [tree_fingerprint(tree) for tree in trees]
+    results = [previous.get(fingerprint) for fingerprint in fingerprints]
+
+    changed = [i for i, result in enumerate(results) if result is None]
+    if changed:
+        processed = combined_agb_calculator.apply_model(
+            combined_agb_calculator._tree_records(
+                combined_agb_calculator._preprocess_tree_entries(
+                    [trees[i] for i in changed], preprocessing_species_info_path
+                )
+            ),
+            path_to_taxa_level_parameters,
+            vectorized=True,
+            workers=workers,
+        )
+        for i, tree in zip(changed, processed):
+            results[i] = tree
+
+    with metrics.stage("write_output", len(results)):
+        # Remove the old manifest first, so that a crash before the new one is saved
+        # can't pair the old fingerprints with the new output. The output itself is
+        # replaced atomically
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(manifest_path(save_output_path))
+        with streaming.open_tree_writer(save_output_path) as writer:
+            writer.write_many(results)
+        _write_manifest(save_output_path, version, fingerprints)
+    if grid is not None:
+        grid.add_trees(results)
+
+    counts = {
+        "trees": len(trees),
+        "reused": len(trees) - len(changed),
+        "recomputed": len(changed),
+    }
+    metrics.count("incremental.reused", counts["reused"])
+    metrics.count("incremental.recomputed", counts["recomputed"])
+    return counts
@@ -0,0 +1,209 @@
+"""
+Lightweight instrumentation of the AGB pipeline.
+
+The pipeline records into the module-level `metrics` object as it runs:
+
+- stages (e.g. "load_trees", "preprocess", "estimate", "write_output"): the number
+  of calls, the wall time and the number of items (usually trees) processed,
+- counters (e.g. which model branch each tree took, "model_branch.species",
+  "model_branch.height" and "model_branch.no_height"), and
+- the hit rates of the caches along the way, collected when a snapshot is taken.
+
+`metrics.snapshot()` returns all of it as a dictionary, and `metrics.to_json()` as
+JSON. Recording costs a dictionary update per event, so it is on by default; set
+`metrics.enabled = False` (or the `FOREST_CARBON_INSTRUMENTATION=0` environment
+variable) to turn it off. Stages may be nested, in which case their times overlap.
+The worker processes of a parallel run hand what they record back with their
+results (see `Instrumentation.merge`): their counters are added to the parent's, and
+their stages are recorded as "worker.<stage>", with the times summed over the
+workers. The hit rates of the caches in the workers are not collected.
+"""
+
+import functools
+import json
+import sys
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+from . import config
+
+
+class StageRecord:
+    """The measurements of one run of a stage; `items` can be set while it runs."""
+
+    __slots__ = ("items",)
+
+    def __init__(self, items: Optional[int] = None):
+        self.items = items
+
+
+def _hit_rate(hits: int, misses: int) -> Optional[float]:
+    return hits / (hits + misses) if hits + misses else None
+
+
+class Instrumentation:
+    """
+    Records the wall time and item counts of pipeline stages, and named counters.
+
+    Args:
+        enabled (bool): Whether to record anything.
+
+    Attributes:
+        stages (dict): The "calls", "seconds" and "items" of each stage.
+        counters (dict): The value of each counter.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.stages: Dict[str, dict] = {}
+        self.counters: Dict[str, int] = {}
+
+    def reset(self):
+        """Forget the stages and counters recorded so far (the model selection and
+        species label caches keep their own hit counts)."""
+        self.stages.clear()
+        self.counters.clear()
+
+    def record(self, name: str, seconds: float, items: Optional[int] = None):
+        """Add one run of a stage."""
+        if not self.enabled:
+            return
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = {"calls": 0, "seconds": 0.0, "items": 0}
+        stage["calls"] += 1
+        stage["seconds"] += seconds
+        if items is not None:
+            stage["items"] += items
+
+    @contextmanager
+    def stage(self, name: str, items: Optional[int] = None) -> Iterator[StageRecord]:
+        """
+        Time the body of a `with` block as a run of a stage.
+
+        Args:
+            name (str): The name of the stage.
+            items (int): The number of items processed, if known up front. Otherwise
+                it can be set on the yielded `StageRecord`.
+        """
+        record = StageRecord(items)
+        if not self.enabled:
+            yield record
+            return
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self.record(name, time.perf_counter() - start, record.items)
+
+    def timed(self, name: str) -> Callable:
+        """A decorator that records each call of a function as a run of a stage."""
+
+        def decorator(function: Callable) -> Callable:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+
+            return wrapper
+
+        return decorator
+
+    def count(self, name: str, value: int = 1):
+        """Add to a counter."""
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def merge(self, snapshot: dict, stage_prefix: str = ""):
+        """
+        Add the stages and counters of a snapshot taken in another process, such as
+        a worker of a parallel run. Its cache hit rates are not merged.
+
+        Args:
+            snapshot (dict): As returned by `snapshot`.
+            stage_prefix (str): Prepended to the names of the snapshot's stages.
+        """
+        if not self.enabled:
+            return
+        for name, recorded in snapshot["stages"].items():
+            stage = self.stages.get(stage_prefix + name)
+            if stage is None:
+                stage = self.stages[stage_prefix + name] = {
+                    "calls": 0,
+                    "seconds": 0.0,
+                    "items": 0,
+                }
+            for key in ("calls", "seconds", "items"):
+                stage[key] += recorded[key]
+        for name, value in snapshot["counters"].items():
+            self.count(name, value)
+
+    def cache_stats(self) -> dict:
+        """Collect the hits, misses and hit rates of the pipeline's caches."""
+        counters = self.counters
+        memory_hits = counters.get("reference_tables.memory_hits", 0)
+        disk_hits = counters.get("reference_tables.disk_hits", 0)
+        builds = counters.get("reference_tables.builds", 0)
+        caches = {
+            "reference_tables": {
+                "memory_hits": memory_hits,
+                "disk_hits": disk_hits,
+                "builds": builds,
+                "hit_rate": _hit_rate(memory_hits + disk_hits, builds),
+            }
+        }
+
+        # Only report the caches of modules that have been used
+        model_cache = sys.modules.get(f"{__package__}.model_cache")
+        if model_cache is not None:
+            stats = model_cache.model_selection_cache.stats()
+            stats["hit_rate"] = _hit_rate(stats["hits"], stats["misses"])
+            caches["model_selection"] = stats
+        species_resolver = sys.modules.get(f"{__package__}.species_resolver")
+        if species_resolver is not None and species_resolver._resolvers:
+            resolvers = species_resolver._resolvers.values()
+            hits = sum(resolver.hits for resolver in resolvers)
+            misses = sum(resolver.misses for resolver in resolvers)
+            caches["species_labels"] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": _hit_rate(hits, misses),
+            }
+        return caches
+
+    def snapshot(self) -> dict:
+        """
+        Return everything recorded so far.
+
+        Returns:
+            dict: "stages" (with the calls, seconds, items and items per second of
+                each stage), "counters" and "caches".
+        """
+        stages = {}
+        for name, stage in self.stages.items():
+            stage = dict(stage)
+            stage["items_per_second"] = (
+                stage["items"] / stage["seconds"]
+                if stage["items"] and stage["seconds"] > 0
+                else None
+            )
+            stages[name] = stage
+        return {
+            "stages": stages,
+            "counters": dict(self.counters),
+            "caches": self.cache_stats(),
+        }
+
+    def to_json(self, indent: Optional[int] = 2) -> str:
+        """Return `snapshot()` as JSON."""
+        return json.dumps(self.snapshot(), indent=indent)
+
+
+# The instrumentation recorded by the pipeline
+metrics = Instrumentation(config.INSTRUMENTATION_ENABLED)
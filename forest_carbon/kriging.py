@@ -0,0 +1,551 @@
+"""
+Local-neighborhood ordinary kriging of per-tree values (e.g. DBH or AGB) onto a grid.
+
+`notebooks/kriging.ipynb` fits `pykrige.OrdinaryKriging` over all trees, which solves
+one dense system over every tree and does not scale past a few thousand trees. Here
+each grid cell is instead estimated from its `num_neighbors` nearest trees (optionally
+only those within `search_radius`), as in moving-window kriging:
+
+- the variogram is fitted once, to the empirical semivariogram of a random sample of
+  trees, with the same models and parameters as pykrige ("linear", "power",
+  "spherical", "gaussian" and "exponential"),
+- the neighbors of each cell are found with `PointGrid`, a uniform grid hash over the
+  tree positions, and
+- the small kriging systems of many cells are solved at once, `batch_size` cells at a
+  time, with batched `np.linalg.solve`.
+
+The cost is then linear in the numbers of trees and grid cells.
+"""
+
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .instrumentation import metrics
+
+# The names of the parameters of each variogram model, in order (as in pykrige)
+VARIOGRAM_PARAMETERS = {
+    "linear": ("slope", "nugget"),
+    "power": ("scale", "exponent", "nugget"),
+    "spherical": ("psill", "range", "nugget"),
+    "gaussian": ("psill", "range", "nugget"),
+    "exponential": ("psill", "range", "nugget"),
+}
+
+
+def _spherical(parameters: Sequence[float], d: np.ndarray) -> np.ndarray:
+    psill, range_, nugget = parameters
+    h = np.minimum(d / range_, 1.0)
+    return psill * (1.5 * h - 0.5 * h**3) + nugget
+
+
+def _gaussian(parameters: Sequence[float], d: np.ndarray) -> np.ndarray:
+    psill, range_, nugget = parameters
+    return psill * (1.0 - np.exp(-(d**2) / (range_ * 4.0 / 7.0) ** 2)) + nugget
+
+
+def _exponential(parameters: Sequence[float], d: np.ndarray) -> np.ndarray:
+    psill, range_, nugget = parameters
+    return psill * (1.0 - np.exp(-d / (range_ / 3.0))) + nugget
+
+
+def _linear(parameters: Sequence[float], d: np.ndarray) -> np.ndarray:
+    slope, nugget = parameters
+    return slope * d + nugget
+
+
+def _power(parameters: Sequence[float], d: np.ndarray) -> np.ndarray:
+    scale, exponent, nugget = parameters
+    return scale * d**exponent + nugget
+
+
+_VARIOGRAM_FUNCTIONS: Dict[str, Callable] = {
+    "linear": _linear,
+    "power": _power,
+    "spherical": _spherical,
+    "gaussian": _gaussian,
+    "exponential": _exponential,
+}
+
+
+def variogram(model: str, parameters: Sequence[float], d) -> np.ndarray:
+    """
+    Evaluate a variogram model at distances `d`.
+
+    The semivariance at distance zero is zero; the nugget applies to d > 0.
+
+    Args:
+        model (str): One of the keys of `VARIOGRAM_PARAMETERS`.
+        parameters (sequence): The model's parameters, in the order given by
+            `VARIOGRAM_PARAMETERS`.
+        d (array-like): Distances.
+
+    Returns:
+        np.ndarray: The semivariance at each distance.
+    """
+    d = np.asarray(d, dtype=float)
+    return np.where(d > 0, _VARIOGRAM_FUNCTIONS[model](parameters, d), 0.0)
+
+
+def empirical_variogram(
+    x, y, values, num_lags: int = 6, max_points: int = 2000, seed: int = 0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the empirical semivariogram of a random sample of points.
+
+    As in pykrige, the pairwise distances are split into `num_lags` equal bins
+    between the smallest and largest distance.
+
+    Args:
+        x, y (array-like): The positions of the points.
+        values (array-like): The value at each point.
+        num_lags (int): The number of distance bins.
+        max_points (int): The number of points sampled (without replacement) to
+            compute the semivariogram from, to bound its cost.
+        seed (int): The seed for the sample.
+
+    Returns:
+        lags (np.ndarray): The mean distance of the pairs in each non-empty bin.
+        semivariance (np.ndarray): The semivariance of each non-empty bin.
+    """
+    x, y, values = (np.asarray(a, dtype=float) for a in (x, y, values))
+    if len(x) > max_points:
+        sample = np.random.default_rng(seed).choice(len(x), max_points, replace=False)
+        x, y, values = x[sample], y[sample], values[sample]
+
+    i, j = np.triu_indices(len(x), k=1)
+    d = np.hypot(x[i] - x[j], y[i] - y[j])
+    g = 0.5 * (values[i] - values[j]) ** 2
+
+    edges = np.linspace(d.min(), d.max(), num_lags + 1)
+    edges[-1] += 0.001
+    bins = np.clip(np.searchsorted(edges, d, side="right") - 1, 0, num_lags - 1)
+    counts = np.bincount(bins, minlength=num_lags)
+    nonempty = counts > 0
+    lags = np.bincount(bins, weights=d, minlength=num_lags)[nonempty]
+    semivariance = np.bincount(bins, weights=g, minlength=num_lags)[nonempty]
+    return lags / counts[nonempty], semivariance / counts[nonempty]
+
+
+def _nonnegative_least_squares(columns: np.ndarray, target: np.ndarray) -> np.ndarray:
+    """Least squares for two non-negative coefficients."""
+    solution = np.linalg.lstsq(columns, target, rcond=None)[0]
+    if (solution >= 0).all():
+        return solution
+    # At least one coefficient is zero; keep whichever single one fits best
+    best, best_error = np.zeros(2), np.sum(target**2)
+    for k in range(2):
+        column = columns[:, k]
+        norm = column @ column
+        coefficient = max(column @ target / norm, 0.0) if norm > 0 else 0.0
+        error = np.sum((target - coefficient * column) ** 2)
+        if error < best_error:
+            best, best_error = np.zeros(2), error
+            best[k] = coefficient
+    return best
+
+
+def fit_variogram(
+    model: str, lags: np.ndarray, semivariance: np.ndarray
+) -> Tuple[float, ...]:
+    """
+    Fit a variogram model to an empirical semivariogram by least squares.
+
+    Each model is linear in its sill (or slope or scale) and nugget, which are fitted
+    exactly (and kept non-negative) for each of a grid of ranges (or exponents); the
+    best fit is returned. The range is at most the largest lag, as in pykrige.
+
+    Args:
+        model (str): One of the keys of `VARIOGRAM_PARAMETERS`.
+        lags (np.ndarray): The lag distances, from `empirical_variogram`.
+        semivariance (np.ndarray): The semivariance at each lag.
+
+    Returns:
+        tuple: The fitted parameters, in the order given by `VARIOGRAM_PARAMETERS`.
+
+    Raises:
+        ValueError: If the model is unknown.
+    """
+    if model not in VARIOGRAM_PARAMETERS:
+        raise ValueError(f"Unknown variogram model: {model!r}")
+    ones = np.ones_like(lags)
+    if model == "linear":
+        slope, nugget = _nonnegative_least_squares(
+            np.column_stack([lags, ones]), semivariance
+        )
+        return float(slope), float(nugget)
+
+    if model == "power":
+        shapes = np.linspace(0.001, 1.999, 100)
+    else:
+        shapes = np.geomspace(lags.max() / 100, lags.max(), 100)
+
+    best, best_error = None, np.inf
+    for shape in shapes:
+        if model == "power":
+            column = lags**shape
+        else:
+            column = _VARIOGRAM_FUNCTIONS[model]((1.0, shape, 0.0), lags)
+        coefficient, nugget = _nonnegative_least_squares(
+            np.column_stack([column, ones]), semivariance
+        )
+        error = np.sum((coefficient * column + nugget - semivariance) ** 2)
+        if error < best_error:
+            best, best_error = (float(coefficient), float(shape), float(nugget)), error
+    return best
+
+
+class PointGrid:
+    """
+    A uniform grid hash over a set of 2D points, for nearest neighbor searches.
+
+    The points are sorted by the (row-major) grid cell they fall in, so that the
+    points in a run of cells within one row are a contiguous slice of `order`.
+
+    Args:
+        x, y (np.ndarray): The positions of the points.
+        cell_size (float): The width and height of the grid cells. By default, cells
+            hold 8 points on average.
+    """
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, cell_size: Optional[float] = None):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.x_min, self.y_min = self.x.min(), self.y.min()
+        width = self.x.max() - self.x_min
+        height = self.y.max() - self.y_min
+        if cell_size is None:
+            if width > 0 and height > 0:
+                cell_size = np.sqrt(width * height * 8.0 / len(self.x))
+            else:
+                cell_size = max(width, height) * 8.0 / len(self.x)
+        self.cell_size = float(cell_size) if cell_size > 0 else 1.0
+        self.num_x = int(width // self.cell_size) + 1
+        self.num_y = int(height // self.cell_size) + 1
+
+        cells = self.cell_y(self.y) * self.num_x + self.cell_x(self.x)
+        self.order = np.argsort(cells, kind="stable")
+        self.starts = np.searchsorted(
+            cells[self.order], np.arange(self.num_x * self.num_y + 1)
+        )
+
+    def cell_x(self, x) -> np.ndarray:
+        """The column of the grid cell of each x coordinate (clipped to the grid)."""
+        cell = np.floor((np.asarray(x) - self.x_min) / self.cell_size)
+        return np.clip(cell, 0, self.num_x - 1).astype(int)
+
+    def cell_y(self, y) -> np.ndarray:
+        """The row of the grid cell of each y coordinate (clipped to the grid)."""
+        cell = np.floor((np.asarray(y) - self.y_min) / self.cell_size)
+        return np.clip(cell, 0, self.num_y - 1).astype(int)
+
+    def _block_segments(
+        self, x: np.ndarray, y: np.ndarray, ring: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """The start in `order` and length of each row of the block of cells around
+        each query point, as (num_queries, 2 * ring + 1) arrays."""
+        cell_x, cell_y = self.cell_x(x), self.cell_y(y)
+        rows = cell_y[:, None] + np.arange(-ring, ring + 1)
+        valid = (rows >= 0) & (rows < self.num_y)
+        first = rows.clip(0, self.num_y - 1) * self.num_x
+        x0 = np.clip(cell_x - ring, 0, self.num_x - 1)[:, None]
+        x1 = np.clip(cell_x + ring, 0, self.num_x - 1)[:, None]
+        starts = self.starts[first + x0]
+        lengths = np.where(valid, self.starts[first + x1 + 1] - starts, 0)
+        return starts, lengths
+
+    def block_counts(self, x: np.ndarray, y: np.ndarray, ring: int) -> np.ndarray:
+        """The number of points returned by `block_candidates` for each query."""
+        return self._block_segments(x, y, ring)[1].sum(axis=1)
+
+    def block_candidates(self, x: np.ndarray, y: np.ndarray, ring: int) -> np.ndarray:
+        """
+        Return the points in the (2 ring + 1) x (2 ring + 1) block of cells around
+        each query point.
+
+        Every point outside a query's block is at least `ring * cell_size` away from
+        it.
+
+        Returns:
+            np.ndarray: (num_queries, max_count) indices of the points, padded with -1.
+        """
+        starts, lengths = self._block_segments(x, y, ring)
+        counts = lengths.sum(axis=1)
+        candidates = np.full((len(counts), counts.max(initial=0)), -1)
+
+        # Gather the ragged segments into one flat array, then scatter it into rows
+        segment_lengths = lengths.ravel()
+        total = segment_lengths.sum()
+        positions = np.arange(total)
+        flat = (
+            positions
+            - np.repeat(np.cumsum(segment_lengths) - segment_lengths, segment_lengths)
+            + np.repeat(starts.ravel(), segment_lengths)
+        )
+        rows = np.repeat(np.arange(len(counts)), counts)
+        columns = positions - np.repeat(np.cumsum(counts) - counts, counts)
+        candidates[rows, columns] = self.order[flat]
+        return candidates
+
+
+def nearest_neighbors(
+    grid: PointGrid,
+    query_x: np.ndarray,
+    query_y: np.ndarray,
+    k: int,
+    search_radius: Optional[float] = None,
+    max_pairs: int = 4_000_000,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the `k` nearest points to each query point.
+
+    The candidates for each query are the points in the block of grid cells around
+    it. Queries whose k-th nearest candidate might be beaten by a point outside the
+    block are searched again with a block twice the size.
+
+    Args:
+        grid (PointGrid): The points.
+        query_x, query_y (np.ndarray): The query positions.
+        k (int): The number of neighbors.
+        search_radius (float): If given, only points within this distance are
+            neighbors.
+        max_pairs (int): The maximum size of the query-candidate distance matrices
+            computed at once.
+
+    Returns:
+        indices (np.ndarray): (num_queries, k) indices of the neighbors, nearest
+            first, with -1 where there are fewer than `k` neighbors.
+        distances (np.ndarray): (num_queries, k) distances to the neighbors, inf
+            where there is no neighbor.
+    """
+    query_x = np.asarray(query_x, dtype=float)
+    query_y = np.asarray(query_y, dtype=float)
+    k = min(k, len(grid.x))
+    indices = np.full((len(query_x), k), -1)
+    distances = np.full((len(query_x), k), np.inf)
+
+    max_ring = max(grid.num_x, grid.num_y)
+    if search_radius is not None:
+        ring = min(max(1, int(np.ceil(search_radius / grid.cell_size))), max_ring)
+    else:
+        # Start with a block that usually holds a few times k points
+        per_cell = len(grid.x) / (grid.num_x * grid.num_y)
+        ring = 1
+        while (2 * ring + 1) ** 2 * per_cell < 3 * k and ring < max_ring:
+            ring += 1
+
+    pending = np.arange(len(query_x))
+    while len(pending):
+        counts = grid.block_counts(query_x[pending], query_y[pending], ring)
+        batch_size = max(1, max_pairs // max(int(counts.max(initial=0)), k, 1))
+        retry = []
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start : start + batch_size]
+            qx, qy = query_x[batch], query_y[batch]
+            candidates = grid.block_candidates(qx, qy, ring)
+            safe = np.maximum(candidates, 0)
+            d = np.hypot(qx[:, None] - grid.x[safe], qy[:, None] - grid.y[safe])
+            d[candidates < 0] = np.inf
+            if search_radius is not None:
+                d[d > search_radius] = np.inf
+
+            num = min(k, candidates.shape[1])
+            if num < candidates.shape[1]:
+                nearest = np.argpartition(d, num - 1, axis=1)[:, :num]
+            else:
+                nearest = np.broadcast_to(np.arange(num), (len(batch), num))
+            nearest_d = np.take_along_axis(d, nearest, axis=1)
+            by_distance = np.argsort(nearest_d, axis=1, kind="stable")
+            nearest = np.take_along_axis(
+                np.take_along_axis(candidates, nearest, axis=1), by_distance, axis=1
+            )
+            nearest_d = np.take_along_axis(nearest_d, by_distance, axis=1)
+
+            # The search is exact for queries with k neighbors within `ring` cells
+            if search_radius is None and ring < max_ring:
+                kth = nearest_d[:, -1] if num == k else np.full(len(batch), np.inf)
+                again = kth > ring * grid.cell_size
+                retry.append(batch[again])
+                batch, nearest, nearest_d = (
+                    batch[~again],
+                    nearest[~again],
+                    nearest_d[~again],
+                )
+
+            found = np.isfinite(nearest_d)
+            indices[batch, :num] = np.where(found, nearest, -1)
+            distances[batch, :num] = nearest_d
+        pending = np.concatenate(retry) if retry else pending[:0]
+        ring = min(2 * ring, max_ring)
+    return indices, distances
+
+
+def _solve_batch(
+    x: np.ndarray,
+    y: np.ndarray,
+    values: np.ndarray,
+    neighbors: np.ndarray,
+    distances: np.ndarray,
+    model: str,
+    parameters: Sequence[float],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Solve the ordinary kriging systems of a batch of query points at once.
+
+    Missing neighbors (-1) are given a weight of exactly zero.
+    """
+    num_queries, k = neighbors.shape
+    valid = neighbors >= 0
+    safe = np.where(valid, neighbors, 0)
+    nx, ny = x[safe], y[safe]
+
+    # [[gamma(d_ij), 1], [1, 0]] [w, mu] = [gamma(d_i0), 1]
+    matrix = np.zeros((num_queries, k + 1, k + 1))
+    pair_distances = np.hypot(
+        nx[:, :, None] - nx[:, None, :], ny[:, :, None] - ny[:, None, :]
+    )
+    both = valid[:, :, None] & valid[:, None, :]
+    matrix[:, :k, :k] = np.where(both, variogram(model, parameters, pair_distances), 0)
+    matrix[:, :k, k] = valid
+    matrix[:, k, :k] = valid
+    diagonal = np.arange(k)
+    matrix[:, diagonal, diagonal] = np.where(valid, 0.0, 1.0)
+
+    rhs = np.zeros((num_queries, k + 1))
+    rhs[:, :k] = np.where(valid, variogram(model, parameters, distances), 0)
+    rhs[:, k] = 1.0
+
+    try:
+        solution = np.linalg.solve(matrix, rhs[:, :, None])[:, :, 0]
+    except np.linalg.LinAlgError:
+        # e.g. trees at identical positions; fall back to the pseudo-inverse
+        solution = (np.linalg.pinv(matrix) @ rhs[:, :, None])[:, :, 0]
+
+    weights = solution[:, :k]
+    estimates = np.sum(weights * values[safe], axis=1)
+    variances = np.sum(solution * rhs, axis=1)
+    return estimates, variances
+
+
+def ordinary_kriging(
+    x,
+    y,
+    values,
+    grid_x,
+    grid_y,
+    variogram_model: str = "linear",
+    variogram_parameters: Optional[Sequence[float]] = None,
+    num_neighbors: int = 16,
+    search_radius: Optional[float] = None,
+    min_neighbors: int = 1,
+    batch_size: int = 4096,
+    num_lags: int = 6,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Interpolate values at scattered points onto a rectangular grid.
+
+    Like `pykrige.OrdinaryKriging(x, y, values).execute("grid", grid_x, grid_y)`,
+    but each grid point is estimated from its nearest points only. With
+    `num_neighbors` at least the number of points, the result is the same as
+    global ordinary kriging.
+
+    Args:
+        x, y (array-like): The positions of the points.
+        values (array-like): The value at each point.
+        grid_x, grid_y (array-like): The x and y coordinates of the grid.
+        variogram_model (str): One of the keys of `VARIOGRAM_PARAMETERS`.
+        variogram_parameters (sequence): The variogram parameters. By default they
+            are fitted to the empirical semivariogram.
+        num_neighbors (int): The (maximum) number of points used for each grid point.
+        search_radius (float): If given, only points within this distance of a grid
+            point are used for it.
+        min_neighbors (int): Grid points with fewer neighbors are NaN.
+        batch_size (int): The number of grid points solved at a time.
+        num_lags (int): The number of lags of the empirical semivariogram.
+
+    Returns:
+        estimates (np.ndarray): The interpolated values, of shape
+            (len(grid_y), len(grid_x)).
+        variances (np.ndarray): The kriging variance at each grid point.
+    """
+    x, y, values = (np.asarray(a, dtype=float) for a in (x, y, values))
+    grid_x = np.asarray(grid_x, dtype=float)
+    grid_y = np.asarray(grid_y, dtype=float)
+    if variogram_parameters is None:
+        lags, semivariance = empirical_variogram(x, y, values, num_lags)
+        variogram_parameters = fit_variogram(variogram_model, lags, semivariance)
+
+    query_x, query_y = (a.ravel() for a in np.meshgrid(grid_x, grid_y))
+    num_queries = len(query_x)
+    estimates = np.full(num_queries, np.nan)
+    variances = np.full(num_queries, np.nan)
+
+    with metrics.stage("kriging", num_queries):
+        grid = PointGrid(x, y)
+        for start in range(0, num_queries, batch_size):
+            stop = min(start + batch_size, num_queries)
+            neighbors, distances = nearest_neighbors(
+                grid,
+                query_x[start:stop],
+                query_y[start:stop],
+                num_neighbors,
+                search_radius,
+            )
+            enough = (neighbors >= 0).sum(axis=1) >= max(min_neighbors, 1)
+            if not enough.any():
+                continue
+            batch_estimates, batch_variances = _solve_batch(
+                x,
+                y,
+                values,
+                neighbors[enough],
+                distances[enough],
+                variogram_model,
+                variogram_parameters,
+            )
+            estimates[start:stop][enough] = batch_estimates
+            variances[start:stop][enough] = batch_variances
+
+    shape = (len(grid_y), len(grid_x))
+    return estimates.reshape(shape), variances.reshape(shape)
+
+
+def krige_trees(
+    trees,
+    cell_size: float,
+    value: str = "AGB value",
+    bounds: Optional[Tuple[float, float, float, float]] = None,
+    **kwargs,
+) -> dict:
+    """
+    Interpolate a per-tree value, by default the AGB from `apply_model`, onto a grid.
+
+    Args:
+        trees: The trees, as the list of dictionaries returned by `apply_model`, a
+            DataFrame, or a mapping from column name to array, with "x_pos",
+            "y_pos" and `value` columns.
+        cell_size (float): The spacing of the grid.
+        value (str): The column to interpolate.
+        bounds (tuple): (x_min, x_max, y_min, y_max) of the grid, including both
+            ends. Defaults to the extent of the trees.
+        **kwargs: Passed on to `ordinary_kriging`.
+
+    Returns:
+        dict: "x" and "y", the coordinates of the grid, and "estimate" and
+            "variance", arrays of shape (len(y), len(x)).
+    """
+    if isinstance(trees, list):
+        trees = {
+            name: [tree[name] for tree in trees] for name in ("x_pos", "y_pos", value)
+        }
+    x = np.asarray(trees["x_pos"], dtype=float)
+    y = np.asarray(trees["y_pos"], dtype=float)
+    if bounds is None:
+        bounds = (x.min(), x.max(), y.min(), y.max())
+    x_min, x_max, y_min, y_max = bounds
+    grid_x = np.arange(x_min, x_max + cell_size / 2, cell_size)
+    grid_y = np.arange(y_min, y_max + cell_size / 2, cell_size)
+
+    estimates, variances = ordinary_kriging(
+        x, y, np.asarray(trees[value], dtype=float), grid_x, grid_y, **kwargs
+    )
+    return {"x": grid_x, "y": grid_y, "estimate": estimates, "variance": variances}
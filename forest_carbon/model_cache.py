@@ -0,0 +1,95 @@
+"""
+Memoization of the taxa-level model selected for each (group, taxa, spg).
+
+Forest plots contain a handful of species repeated many times, and every tree of a
+species has the same group, taxa and specific gravity, so the per-tree
+`choosing_the_model` asks for the same model over and over. The cache below keeps the
+result of `agb_biomass.agb_biomass_model` for each key, in a bounded LRU. It is tied
+to one version of the parameter table (by `TaxaModelIndex.fingerprint`), and is
+cleared as soon as it is used with another one, e.g. after the table is reloaded.
+"""
+
+import math
+from collections import OrderedDict
+from typing import Optional
+
+from . import agb_biomass, config
+from .instrumentation import metrics
+from .taxa_index import TaxaModelIndex
+
+
+class ModelSelectionCache:
+    """
+    A bounded LRU cache of the model parameters selected for (group, taxa, spg).
+
+    Args:
+        max_size (int): The maximum number of keys kept.
+
+    Attributes:
+        hits (int): The number of lookups answered from the cache.
+        misses (int): The number of lookups that ran the model selection.
+        invalidations (int): The number of times the cache has been cleared.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.entries: OrderedDict = OrderedDict()
+        self.fingerprint: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def invalidate(self):
+        """Forget all the cached selections."""
+        self.entries.clear()
+        self.fingerprint = None
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        """Return the size of the cache and its hit and miss counts."""
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+    def model_parameters(
+        self, group: str, taxa: str, spg: Optional[float], index: TaxaModelIndex
+    ):
+        """
+        Return `agb_biomass.agb_biomass_model(group, taxa, spg, index)`, from the cache
+        if this key has been seen before with the same version of the table.
+
+        The result is shared with other callers, and must not be modified.
+        """
+        if index.fingerprint != self.fingerprint:
+            if self.fingerprint is not None:
+                self.invalidate()
+            self.fingerprint = index.fingerprint
+
+        # A missing spg can be NaN or None, which select the same model
+        key = (group, taxa, None if spg is None or math.isnan(spg) else spg)
+        parameters = self.entries.get(key)
+        if parameters is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            if not parameters:
+                # agb_biomass_model counts every tree without a match
+                metrics.count("taxa_model.no_match")
+            return parameters
+
+        self.misses += 1
+        parameters = agb_biomass.agb_biomass_model(group, taxa, spg, index)
+        self.entries[key] = parameters
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return parameters
+
+
+# The cache used by `combined_agb_calculator.choosing_the_model`
+model_selection_cache = ModelSelectionCache(config.MODEL_SELECTION_CACHE_SIZE)
@@ -0,0 +1,106 @@
+"""
+Helpers for splitting trees into shards and processing them in a process pool.
+
+The shards are contiguous ranges of rows, either in input order or after sorting the
+trees into square spatial tiles, and results are always collected in shard order so
+that the output is deterministic regardless of which worker finishes first.
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+def default_workers() -> int:
+    """The number of worker processes to use when none is given."""
+    return os.cpu_count() or 1
+
+
+def row_shards(num_rows: int, num_shards: int) -> List[Tuple[int, int]]:
+    """
+    Split `num_rows` rows into at most `num_shards` contiguous, near-equal ranges.
+
+    Returns:
+        list: (start, stop) row ranges, in order.
+    """
+    num_shards = max(1, min(num_shards, num_rows))
+    bounds = np.linspace(0, num_rows, num_shards + 1).astype(int)
+    return [
+        (start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start
+    ]
+
+
+def tile_shards(
+    x_pos: np.ndarray, y_pos: np.ndarray, tile_size: float, shard_size: int
+) -> Tuple[np.ndarray, List[Tuple[int, int]]]:
+    """
+    Group trees into square spatial tiles, then split the tiles into shards.
+
+    Tiles are never split across shards; consecutive tiles (in row-major tile order)
+    are combined until a shard holds at least `shard_size` trees.
+
+    Args:
+        x_pos (np.ndarray): The x position of each tree.
+        y_pos (np.ndarray): The y position of each tree.
+        tile_size (float): The width and height of each tile, in the units of the
+            positions.
+        shard_size (int): The target number of trees per shard.
+
+    Returns:
+        order (np.ndarray): The permutation that sorts the trees by tile.
+        shards (list): (start, stop) ranges into the sorted trees, one per shard.
+    """
+    if len(x_pos) == 0:
+        return np.empty(0, dtype=np.intp), []
+    tile_x = np.floor(np.asarray(x_pos) / tile_size).astype(np.int64)
+    tile_y = np.floor(np.asarray(y_pos) / tile_size).astype(np.int64)
+    order = np.lexsort((tile_x, tile_y))
+
+    sorted_x, sorted_y = tile_x[order], tile_y[order]
+    tile_starts = np.flatnonzero(
+        np.r_[True, (sorted_x[1:] != sorted_x[:-1]) | (sorted_y[1:] != sorted_y[:-1])]
+    )
+    # Start a new shard at the first tile beginning past each multiple of shard_size
+    shard_ids = tile_starts // max(1, shard_size)
+    cuts = tile_starts[np.r_[True, shard_ids[1:] != shard_ids[:-1]]]
+    bounds = np.r_[cuts, len(order)]
+    return order, list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def process_pool(
+    workers: Optional[int], initializer: Callable, initargs: tuple = ()
+) -> ProcessPoolExecutor:
+    """
+    Create a process pool whose workers each run `initializer(*initargs)` once on
+    start-up, e.g. to load the reference tables.
+    """
+    return ProcessPoolExecutor(
+        max_workers=workers or default_workers(),
+        initializer=initializer,
+        initargs=initargs,
+    )
+
+
+def imap_ordered(
+    executor: ProcessPoolExecutor,
+    function: Callable,
+    items: Iterable,
+    max_pending: int,
+) -> Iterator:
+    """
+    Like `executor.map`, but consume `items` lazily.
+
+    At most `max_pending` items are submitted ahead of the result being yielded, so
+    memory stays bounded when `items` is a long (or unbounded) stream. Results are
+    yielded in the order of `items`.
+    """
+    pending: deque = deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
@@ -0,0 +1,155 @@
+"""
+Cached loading of the reference tables used by the AGB pipeline.
+
+Parsing `tree_species_info.csv` and `taxa_level_agb_model_parameters.csv` with pandas
+is a fixed cost that dominates small runs. The functions below compile each table
+once and keep the result:
+
+- in memory, so repeated calls in the same process return immediately, and
+- on disk (as a pickle in `config.REFERENCE_TABLE_CACHE_DIR`), keyed by a hash of the
+  source CSV and a cache format version, so later processes can load the compiled
+  table without importing pandas. Only pickles that are owned by the current user
+  and not writable by anyone else are loaded; others are ignored and rebuilt.
+
+A cached table is rebuilt automatically when the contents of its CSV change. The
+returned objects are shared between callers and should be treated as read-only.
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+from typing import Callable, Dict, Optional, Tuple
+
+from . import config
+from .instrumentation import metrics
+
+# Bump when the format of the compiled tables changes, to invalidate old caches
+CACHE_VERSION = 3
+
+# Compiled tables by (kind, path): the file's stat signature, hash, and the table
+_memory_cache: Dict[Tuple[str, str], Tuple[Tuple[int, int], str, object]] = {}
+
+
+def _source_hash(path: str) -> str:
+    """Hash the contents of a source file, together with the cache version."""
+    digest = hashlib.sha256(f"forest_carbon-{CACHE_VERSION}".encode())
+    with open(path, "rb") as source:
+        for block in iter(lambda: source.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _is_trusted(stat: os.stat_result) -> bool:
+    """Whether a cache file can be unpickled: only files owned by the current user
+    that nobody else can write to are, since unpickling can run arbitrary code."""
+    if hasattr(os, "getuid") and stat.st_uid != os.getuid():
+        return False
+    return not stat.st_mode & 0o022
+
+
+def _read_cache_file(cache_path: str):
+    """Load a pickled table, or return None if it is missing, unreadable or not
+    trusted (see `_is_trusted`)."""
+    try:
+        with open(cache_path, "rb") as cache_file:
+            if not _is_trusted(os.fstat(cache_file.fileno())):
+                metrics.count("reference_tables.untrusted")
+                return None
+            return pickle.load(cache_file)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+
+
+def _write_cache_file(cache_dir: str, cache_path: str, table):
+    """Pickle a table, atomically so that concurrent readers never see a partial
+    file. Failing to write the cache is not an error."""
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as cache_file:
+            pickle.dump(table, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        pass
+
+
+def _load(kind: str, path: str, build: Callable[[str], object]):
+    """Return the compiled table of the given kind for a source file, using the
+    in-memory and on-disk caches where possible."""
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    key = (kind, path)
+    cached = _memory_cache.get(key)
+    if cached is not None and cached[0] == signature:
+        metrics.count("reference_tables.memory_hits")
+        return cached[2]
+
+    source_hash = _source_hash(path)
+    if cached is not None and cached[1] == source_hash:
+        metrics.count("reference_tables.memory_hits")
+        _memory_cache[key] = (signature, source_hash, cached[2])
+        return cached[2]
+
+    table = None
+    cache_dir: Optional[str] = config.REFERENCE_TABLE_CACHE_DIR
+    if cache_dir:
+        cache_path = os.path.join(cache_dir, f"{kind}-{source_hash}.pickle")
+        table = _read_cache_file(cache_path)
+    if table is None:
+        metrics.count("reference_tables.builds")
+        table = build(path)
+        if cache_dir:
+            _write_cache_file(cache_dir, cache_path, table)
+    else:
+        metrics.count("reference_tables.disk_hits")
+
+    _memory_cache[key] = (signature, source_hash, table)
+    return table
+
+
+def _build_species_database(path: str) -> dict:
+    from .tree_preprocessing import create_common_name_dictionary
+
+    return create_common_name_dictionary(path)
+
+
+def _build_taxa_model_index(path: str):
+    from .agb_biomass import load_taxa_model_index
+
+    return load_taxa_model_index(path)
+
+
+def load_species_database(path: str) -> dict:
+    """
+    Load the species database, as built by
+    `tree_preprocessing.create_common_name_dictionary`, from cache where possible.
+
+    Args:
+        path (str): Path to the species information CSV file.
+
+    Returns:
+        dict: The species information, keyed by common name.
+    """
+    return _load("species", path, _build_species_database)
+
+
+def load_taxa_model_index(path: str):
+    """
+    Load the taxa-level model parameter index, as built by
+    `agb_biomass.load_taxa_model_index`, from cache where possible.
+
+    Args:
+        path (str): Path to the taxa-level model parameters CSV file.
+
+    Returns:
+        TaxaModelIndex: The compiled parameter index.
+    """
+    return _load("taxa_index", path, _build_taxa_model_index)
+
+
+def clear_memory_cache():
+    """Forget the tables cached in this process (the on-disk cache is kept)."""
+    _memory_cache.clear()
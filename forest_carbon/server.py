@@ -0,0 +1,337 @@
+"""
+A local HTTP service for estimating AGB, with warm reference tables.
+
+Calling the library from another program loads the species and taxa-parameter
+tables in every process. `serve` instead runs a long-lived server, on the local
+machine only by default, that loads them once:
+
+- `POST /estimate` with a JSON body of trees (a `{"trees": [...]}` document or a
+  list, as in the input files) returns the processed trees, as `run_model` writes
+  them (without the indentation),
+- `GET /metrics` returns the number of requests, trees and batches, request latency
+  percentiles, throughput, and the pipeline's instrumentation, and
+- `GET /health` returns `{"status": "ok"}`.
+
+Requests are handled on their own threads, but estimated by a single batching
+thread: it takes the requests waiting when it becomes free (waiting up to
+`config.SERVER_BATCH_WAIT` for more), preprocesses and estimates all of their trees
+in one vectorized pass, and hands each request its share. So a burst of small
+requests costs about as much as one large one. If a batch fails (e.g. one request
+has an unknown species), its requests are retried one at a time, so the error only
+affects the request that caused it.
+"""
+
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+import numpy as np
+
+from . import combined_agb_calculator, config, reference_tables
+from .instrumentation import metrics
+from .tree_preprocessing import UnknownSpeciesError
+
+
+class EstimationService:
+    """
+    Estimates AGB for batches of requests, with the reference tables kept loaded.
+
+    Args:
+        batch_wait (float): How long to wait for more requests to join a batch, in
+            seconds. Defaults to `config.SERVER_BATCH_WAIT`.
+        max_batch_trees (int): The most trees to estimate in one batch. Defaults to
+            `config.SERVER_MAX_BATCH_TREES`.
+    """
+
+    def __init__(
+        self,
+        batch_wait: Optional[float] = None,
+        max_batch_trees: Optional[int] = None,
+    ):
+        self.batch_wait = config.SERVER_BATCH_WAIT if batch_wait is None else batch_wait
+        self.max_batch_trees = max_batch_trees or config.SERVER_MAX_BATCH_TREES
+        self.database = reference_tables.load_species_database(
+            config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO
+        )
+        self.df = reference_tables.load_taxa_model_index(
+            config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS
+        )
+        self.models = combined_agb_calculator._create_fallback_models()
+        self.resolver = combined_agb_calculator._species_resolver(
+            config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO
+        )
+
+        self._requests: queue.Queue = queue.Queue()
+        # Guards the statistics, and the instrumentation while a batch is processed
+        self._lock = threading.Lock()
+        self._batch_lock = threading.Lock()
+        self._latencies: deque = deque(maxlen=config.SERVER_LATENCY_WINDOW)
+        self._started = time.perf_counter()
+        self.num_requests = 0
+        self.num_failed = 0
+        self.num_trees = 0
+        self.num_batches = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop the batching thread, once the requests already queued are done."""
+        self._requests.put(None)
+        self._thread.join()
+
+    def estimate(self, trees: List[dict]) -> List[dict]:
+        """
+        Estimate AGB for the trees of one request, waiting for its batch.
+
+        Args:
+            trees (list): Raw tree dictionaries, with a "species" label.
+
+        Returns:
+            list: The processed trees, as `run_model` writes them.
+
+        Raises:
+            UnknownSpeciesError: If a tree's species is not in the species database.
+        """
+        start = time.perf_counter()
+        future: Future = Future()
+        self._requests.put((trees, future))
+        try:
+            return future.result()
+        finally:
+            self.record_request(time.perf_counter() - start, future.exception())
+
+    def record_request(self, seconds: float, error: Optional[BaseException] = None):
+        """Record the latency of a request."""
+        with self._lock:
+            self._latencies.append(seconds)
+            self.num_requests += 1
+            self.num_failed += error is not None
+
+    def _next_batch(self) -> Optional[list]:
+        """Wait for a request, then gather more until the batch is full or none
+        arrive within `batch_wait`."""
+        request = self._requests.get()
+        if request is None:
+            return None
+        batch, num_trees = [request], len(request[0])
+        deadline = time.perf_counter() + self.batch_wait
+        while num_trees < self.max_batch_trees:
+            try:
+                request = self._requests.get(
+                    timeout=max(0.0, deadline - time.perf_counter())
+                )
+            except queue.Empty:
+                break
+            if request is None:
+                # Finish this batch, then stop
+                self._requests.put(None)
+                break
+            batch.append(request)
+            num_trees += len(request[0])
+        return batch
+
+    def _process(self, trees: list) -> list:
+        return combined_agb_calculator._process_tree_chunk(
+            trees, self.database, self.df, *self.models, resolver=self.resolver
+        )
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            with self._lock:
+                self.num_batches += 1
+                self.num_trees += sum(len(trees) for trees, _ in batch)
+            with self._batch_lock:
+                try:
+                    processed = self._process(
+                        [tree for trees, _ in batch for tree in trees]
+                    )
+                except Exception:
+                    processed = None
+                if processed is not None:
+                    start = 0
+                    for trees, future in batch:
+                        future.set_result(processed[start : start + len(trees)])
+                        start += len(trees)
+                    continue
+                # Find the requests that failed by processing them one at a time
+                for trees, future in batch:
+                    try:
+                        future.set_result(self._process(trees))
+                    except Exception as error:
+                        future.set_exception(error)
+
+    def stats(self) -> dict:
+        """
+        Return the statistics of the service.
+
+        Returns:
+            dict: The number of "requests" (and "failed" ones), "trees" and
+                "batches", the mean "trees_per_batch", the "uptime" in seconds, the
+                "requests_per_second" and "trees_per_second" since it started, the
+                "latency" percentiles of the recent requests ("p50", "p90", "p99" and
+                "max", in milliseconds), and the pipeline's "instrumentation".
+        """
+        with self._batch_lock:
+            instrumentation = metrics.snapshot()
+        with self._lock:
+            uptime = time.perf_counter() - self._started
+            latencies = np.array(self._latencies) * 1000.0
+            if len(latencies):
+                p50, p90, p99 = np.percentile(latencies, [50, 90, 99]).tolist()
+                latency = {
+                    "p50": p50,
+                    "p90": p90,
+                    "p99": p99,
+                    "max": float(latencies.max()),
+                }
+            else:
+                latency = {"p50": None, "p90": None, "p99": None, "max": None}
+            return {
+                "requests": self.num_requests,
+                "failed": self.num_failed,
+                "trees": self.num_trees,
+                "batches": self.num_batches,
+                "trees_per_batch": (
+                    self.num_trees / self.num_batches if self.num_batches else None
+                ),
+                "uptime": uptime,
+                "requests_per_second": self.num_requests / uptime,
+                "trees_per_second": self.num_trees / uptime,
+                "latency": latency,
+                "instrumentation": instrumentation,
+            }
+
+
+# The numeric fields of the trees in a request, and whether each is required
+NUMERIC_FIELDS = {"dbh": True, "x_pos": False, "y_pos": False}
+
+
+def check_trees(trees: list):
+    """
+    Check the fields of the trees of a request before they are estimated, so that
+    bad input is reported to the client rather than failing its batch.
+
+    Raises:
+        ValueError: If a tree has no string "species", or a numeric field (see
+            `NUMERIC_FIELDS`) that isn't a number. Optional fields may be null.
+    """
+    for index, tree in enumerate(trees):
+        if not isinstance(tree.get("species"), str):
+            raise ValueError(f"Tree {index} has no species label")
+        for name, required in NUMERIC_FIELDS.items():
+            value = tree.get(name)
+            if value is None and not required:
+                continue
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(
+                    f"Tree {index} has {name}={value!r}, expected a number"
+                )
+
+
+class EstimationRequestHandler(BaseHTTPRequestHandler):
+    """Handles the requests of an `EstimationServer`."""
+
+    # Keep connections open between requests, and send small responses at once
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def _send_json(self, status: int, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif self.path == "/metrics":
+            self._send_json(200, self.server.service.stats())
+        else:
+            self._send_json(404, {"error": f"Not found: {self.path}"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self.path != "/estimate":
+            self._send_json(404, {"error": f"Not found: {self.path}"})
+            return
+        service = self.server.service
+        start = time.perf_counter()
+        try:
+            document = json.loads(body)
+            trees = document if isinstance(document, list) else document["trees"]
+            if not isinstance(trees, list) or not all(
+                isinstance(tree, dict) for tree in trees
+            ):
+                raise ValueError("Expected a list of tree objects")
+            check_trees(trees)
+        except (ValueError, KeyError, TypeError) as error:
+            service.record_request(time.perf_counter() - start, error)
+            self._send_json(400, {"error": f"Invalid request: {error}"})
+            return
+        try:
+            processed = service.estimate(trees)
+        except UnknownSpeciesError as error:
+            self._send_json(400, {"error": str(error), "species": error.species})
+            return
+        except ValueError as error:
+            # Values outside a model's domain, e.g. a zero dbh for a generic model
+            self._send_json(400, {"error": f"Invalid tree: {error}"})
+            return
+        except Exception as error:
+            self._send_json(500, {"error": f"{type(error).__name__}: {error}"})
+            return
+        self._send_json(200, processed)
+
+    def log_message(self, format, *args):
+        # Don't log every request to stderr
+        pass
+
+
+class EstimationServer(ThreadingHTTPServer):
+    """
+    An HTTP server around an `EstimationService`.
+
+    Args:
+        address (tuple): The (host, port) to listen on. Port 0 picks a free port.
+        service (EstimationService): The service. Defaults to a new one.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple, service: Optional[EstimationService] = None):
+        self.service = service or EstimationService()
+        super().__init__(address, EstimationRequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        self.service.close()
+
+
+def serve(host: Optional[str] = None, port: Optional[int] = None):
+    """
+    Run the estimation server until interrupted.
+
+    Args:
+        host (str): The address to listen on. Defaults to `config.SERVER_HOST`, the
+            local machine only.
+        port (int): The port to listen on. Defaults to `config.SERVER_PORT`.
+    """
+    host = config.SERVER_HOST if host is None else host
+    port = config.SERVER_PORT if port is None else port
+    with EstimationServer((host, port)) as server:
+        print(f"Serving AGB estimates on http://{host}:{server.server_port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -7,29 +7,72 @@ trees" by Chave et. al.
 import math
 from typing import Callable
 
-from beartype import beartype
+import numpy as np
+
+from .typecheck import typechecked
 
 AGBModel = Callable[[float, float, float], float]
 
 
-@beartype
-def create_AGB_function(coef: float, exp: float) -> AGBModel:
+def _is_scalar(*values) -> bool:
+    """Return True if all the inputs of an AGB function are single numbers (Python or
+    NumPy scalars)."""
+    return all(isinstance(value, (int, float, np.generic)) for value in values)
+
+
+def _python_scalars(*values) -> tuple:
+    """Convert NumPy scalars to the equivalent Python numbers."""
+    return tuple(
+        value.item() if isinstance(value, np.generic) else value for value in values
+    )
+
+
+def _prepare_arrays(dtype, out, *values) -> tuple:
+    """Convert the inputs of an AGB function to arrays of `dtype`, and allocate the
+    output array (with their broadcast shape) unless one is given."""
+    arrays = [np.asarray(value, dtype=dtype) for value in values]
+    if out is None:
+        out = np.empty(np.broadcast_shapes(*(a.shape for a in arrays)), dtype=dtype)
+    return arrays, out
+
+
+@typechecked
+def create_AGB_function(coef: float, exp: float, dtype=np.float64) -> AGBModel:
     """
     Returns a function that takes in the parameters rho, d, and h and outputs the
     estimated AGB.
     The model is in an exponential form: AGB = coef * (rho * d^2 * h) ^ exp.
 
+    The function also accepts NumPy arrays of rho, d and h, evaluating the model
+    element-wise, and an optional `out` array to write the result into. It returns a
+    float when given scalars, and an array otherwise. Scalars are evaluated with the
+    `math` module, as they always have been; arrays are evaluated with NumPy, whose
+    results can differ from the scalar ones in the last place.
+
     Arguments:
     coef (float), exp (float): the parameters that were fitted to the exponential AGB model.
+    dtype: the floating-point type to evaluate arrays in (e.g. np.float32).
     """
-
-    def AGB_function(rho, d, h):
-        return coef * (rho * d**2 * h) ** exp
+    scalar = np.dtype(dtype).type
+    array_coef, array_exp = scalar(coef), scalar(exp)
+
+    def AGB_function(rho, d, h, out=None):
+        if out is None and _is_scalar(rho, d, h):
+            rho, d, h = _python_scalars(rho, d, h)
+            return coef * (rho * d**2 * h) ** exp
+
+        (rho, d, h), result = _prepare_arrays(dtype, out, rho, d, h)
+        np.square(d, out=result)
+        np.multiply(rho, result, out=result)
+        np.multiply(result, h, out=result)
+        np.power(result, array_exp, out=result)
+        np.multiply(array_coef, result, out=result)
+        return result
 
     return AGB_function
 
 
-@beartype
+@typechecked
 def apply_AGB_model(agb: AGBModel, rho: float, d: float, h: float) -> float:
     """
     Returns the estimate for the AGB given a model to apply (agb), rho, d, and h.
@@ -42,15 +85,25 @@ def apply_AGB_model(agb: AGBModel, rho: float, d: float, h: float) -> float:
     return agb(rho, d, h)
 
 
-@beartype
+@typechecked
 def create_AGB_function_no_height(
-    const: float, coef_e: float, coef_rho: float, coef_d: float, coef_d_squared: float
+    const: float,
+    coef_e: float,
+    coef_rho: float,
+    coef_d: float,
+    coef_d_squared: float,
+    dtype=np.float64,
 ) -> AGBModel:
     """
     Returns a function that takes in the parameters rho, d, and e and outputs the
     estimated AGB.
     The model is in an exponential form: AGB = coef * (rho * d^2 * h) ^ exp.
 
+    Like the function returned by `create_AGB_function`, it also accepts NumPy arrays
+    and an optional `out` array. Scalars are evaluated with the `math` module, so a
+    diameter or specific gravity that isn't positive raises a ValueError; in arrays,
+    it gives NaN.
+
     Arguments:
     const (float),
     coef_e (float),
@@ -58,21 +111,47 @@ def create_AGB_function_no_height(
     coef_d (float),
     coef_d_squared (float)
      the parameters that were fitted to the exponential AGB model.
+    dtype: the floating-point type to evaluate arrays in (e.g. np.float32).
     """
-
-    def AGB_function(rho, d, e):
-        return math.exp(
-            const
-            - coef_e * e
-            + coef_rho * math.log(rho)
-            + coef_d * math.log(d)
-            - coef_d_squared * math.log(d**2)
-        )
+    scalar = np.dtype(dtype).type
+    array_const, array_coef_e, array_coef_rho, array_coef_d, array_coef_d_squared = (
+        scalar(value) for value in (const, coef_e, coef_rho, coef_d, coef_d_squared)
+    )
+
+    def AGB_function(rho, d, e, out=None):
+        if out is None and _is_scalar(rho, d, e):
+            rho, d, e = _python_scalars(rho, d, e)
+            return math.exp(
+                const
+                - coef_e * e
+                + coef_rho * math.log(rho)
+                + coef_d * math.log(d)
+                - coef_d_squared * math.log(d**2)
+            )
+
+        (rho, d, e), result = _prepare_arrays(dtype, out, rho, d, e)
+        term = np.empty_like(result)
+        # const - coef_e * e + coef_rho * log(rho) + coef_d * log(d)
+        #   - coef_d_squared * log(d^2), evaluated left to right
+        np.multiply(array_coef_e, e, out=result)
+        np.subtract(array_const, result, out=result)
+        np.log(rho, out=term)
+        np.multiply(array_coef_rho, term, out=term)
+        np.add(result, term, out=result)
+        np.log(d, out=term)
+        np.multiply(array_coef_d, term, out=term)
+        np.add(result, term, out=result)
+        np.square(d, out=term)
+        np.log(term, out=term)
+        np.multiply(array_coef_d_squared, term, out=term)
+        np.subtract(result, term, out=result)
+        np.exp(result, out=result)
+        return result
 
     return AGB_function
 
 
-@beartype
+@typechecked
 def apply_AGB_model_no_height(agb: AGBModel, rho: float, d: float, e: float) -> float:
     """
     Returns the estimate for the AGB given a model to apply (agb), rho, d, and e.
@@ -0,0 +1,413 @@
+"""
+A spatial index over tree positions, for bounding box, radius and polygon queries.
+
+`SpatialIndex` is a uniform grid hash, like `kriging.PointGrid`: the trees are sorted
+by the (row-major) grid cell they fall in, so the trees of a run of cells within one
+row of the grid are a contiguous slice of the sorted trees. A query only visits the
+cells that overlap its bounding box. In each row of those, the run of cells that lie
+wholly inside the query is taken as a whole slice, and only the trees in the other
+cells (which cross the query's boundary or lie outside it) are tested one by one.
+Where a concave polygon leaves several runs inside one row, only the widest is taken
+whole. Summed AGB uses a running total over the sorted trees, so the AGB of an
+interior slice is a difference of two totals, and the cost of a sum depends on the
+trees near the query's boundary and in its bounding box's corners, rather than on
+the number of trees inside it.
+
+Build an index from the output of `apply_model` (any batch of trees with "x_pos",
+"y_pos" and "AGB value") with `SpatialIndex.from_trees`. Queries return the rows of
+the trees in that batch, in increasing order. Trees without a position are left out
+of the index. Indexes are saved as compressed `.npz` arrays, so repeated queries
+against the same trees don't need to rebuild them.
+"""
+
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from . import tree_table
+from .instrumentation import metrics
+
+# The arrays saved by `SpatialIndex.save`
+INDEX_ARRAYS = ("x", "y", "agb", "rows", "starts")
+
+# Cells closer to a radius query's boundary than this share of its radius are tested
+# tree by tree, so that rounding never decides whether a tree is inside
+_RADIUS_MARGIN = 1e-9
+
+# Likewise for cells closer to a polygon's edges than this many cell widths
+_POLYGON_MARGIN = 1e-6
+
+
+def _concatenate_ranges(starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+    """The indices in the ranges [start, stop), concatenated."""
+    lengths = np.maximum(stops - starts, 0)
+    total = int(lengths.sum())
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(total)
+
+
+def _points_in_polygon(
+    x: np.ndarray, y: np.ndarray, vertices: np.ndarray
+) -> np.ndarray:
+    """Whether each point is inside a polygon, by the even-odd rule."""
+    inside = np.zeros(len(x), dtype=bool)
+    x0, y0 = vertices[-1]
+    for x1, y1 in vertices:
+        # Count the edges crossed by a ray from each point towards +x
+        crosses = (y0 > y) != (y1 > y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_cross = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+        inside ^= crosses & (x < x_cross)
+        x0, y0 = x1, y1
+    return inside
+
+
+class SpatialIndex:
+    """
+    A grid hash over tree positions, with the AGB of each tree.
+
+    Args:
+        x, y (array-like): The position of each tree.
+        agb (array-like): The AGB of each tree. Missing values count as 0 in sums.
+        cell_size (float): The width and height of the grid cells. By default, cells
+            hold 8 trees on average.
+
+    Attributes:
+        x, y, agb (np.ndarray): The indexed trees, sorted by cell.
+        rows (np.ndarray): The row of each sorted tree in the input.
+        starts (np.ndarray): The start of each cell's trees in the sorted trees
+            (with the total number of trees appended).
+        skipped (int): The number of trees left out for lacking a position.
+    """
+
+    def __init__(self, x, y, agb=None, cell_size: Optional[float] = None):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        agb = np.zeros(len(x)) if agb is None else np.asarray(agb, dtype=float)
+        rows = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+        self.skipped = len(x) - len(rows)
+        x, y, agb = x[rows], y[rows], agb[rows]
+
+        if len(rows):
+            self.x_min, self.y_min = float(x.min()), float(y.min())
+            width, height = x.max() - self.x_min, y.max() - self.y_min
+        else:
+            self.x_min = self.y_min = width = height = 0.0
+        if cell_size is None:
+            if width > 0 and height > 0:
+                cell_size = np.sqrt(width * height * 8.0 / len(x))
+            else:
+                cell_size = max(width, height) * 8.0 / max(len(x), 1)
+        self.cell_size = float(cell_size) if cell_size > 0 else 1.0
+        self.num_x = int(width // self.cell_size) + 1
+        self.num_y = int(height // self.cell_size) + 1
+
+        with metrics.stage("spatial_index", len(rows)):
+            cells = self._cell(y, self.y_min, self.num_y) * self.num_x + self._cell(
+                x, self.x_min, self.num_x
+            )
+            order = np.argsort(cells, kind="stable")
+            self.x, self.y, self.agb = x[order], y[order], agb[order]
+            self.rows = rows[order]
+            self.starts = np.searchsorted(
+                cells[order], np.arange(self.num_x * self.num_y + 1)
+            )
+        self._totals = None
+
+    @classmethod
+    def from_trees(
+        cls,
+        trees,
+        value: str = tree_table.AGB_COLUMN,
+        cell_size: Optional[float] = None,
+    ) -> "SpatialIndex":
+        """
+        Index a batch of trees, as returned by `apply_model`.
+
+        Args:
+            trees: The trees, as a list of dictionaries, a DataFrame, a `TreeBatch`
+                or a mapping from column name to array, with "x_pos" and "y_pos" and
+                (optionally) `value` columns. Missing values may be None or NaN.
+            value (str): The column holding the AGB of each tree.
+            cell_size (float): As for `SpatialIndex`.
+        """
+        names = ("x_pos", "y_pos", value)
+        if isinstance(trees, list):
+            columns = [
+                np.array(
+                    [
+                        np.nan if tree.get(name) is None else tree[name]
+                        for tree in trees
+                    ],
+                    dtype=float,
+                )
+                for name in names
+            ]
+        else:
+            columns = [
+                np.asarray(trees[name], dtype=float) if name in trees else None
+                for name in names
+            ]
+        return cls(*columns, cell_size=cell_size)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _cell(self, values, low: float, num_cells: int) -> np.ndarray:
+        """The grid column (or row) of each coordinate, clipped to the grid."""
+        cell = np.floor((np.asarray(values) - low) / self.cell_size)
+        return np.clip(cell, 0, num_cells - 1).astype(np.int64)
+
+    @property
+    def totals(self) -> np.ndarray:
+        """The running total of the AGB of the sorted trees, starting at 0."""
+        if self._totals is None:
+            self._totals = np.concatenate([[0.0], np.cumsum(np.nan_to_num(self.agb))])
+        return self._totals
+
+    def _search(self, bounds, interior, contains) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the trees matching a query.
+
+        Args:
+            bounds (tuple): The (x_min, x_max, y_min, y_max) box around the query.
+            interior (callable): Given the grid rows of the box, returns the first
+                and last grid column of the cells in each row that lie wholly inside
+                the query (last < first for none).
+            contains (callable): Given positions, whether each is inside the query.
+
+        Returns:
+            interior (np.ndarray): (start, stop) ranges of the sorted trees in the
+                interior cells, as a (ranges, 2) array.
+            boundary (np.ndarray): The sorted trees in the other cells that are
+                inside the query.
+        """
+        x_min, x_max, y_min, y_max = bounds
+        if not len(self) or x_max < self.x_min or y_max < self.y_min:
+            return np.empty((0, 2), dtype=np.int64), np.empty(0, dtype=np.int64)
+        first_x, last_x = self._cell([x_min, x_max], self.x_min, self.num_x)
+        first_y, last_y = self._cell([y_min, y_max], self.y_min, self.num_y)
+        grid_rows = np.arange(first_y, last_y + 1)
+        inner_first, inner_last = interior(grid_rows)
+        inner_first = np.maximum(inner_first, first_x)
+        inner_last = np.minimum(inner_last, last_x)
+        has_inner = inner_last >= inner_first
+
+        # Each grid row is split into the boundary cells left and right of its
+        # interior cells (or is all boundary)
+        row_start = grid_rows * self.num_x
+        left_stop = np.where(has_inner, inner_first, last_x + 1)
+        right_start = np.where(has_inner, inner_last + 1, last_x + 1)
+        boundary_starts = self.starts[
+            np.r_[row_start + first_x, row_start + right_start]
+        ]
+        boundary_stops = self.starts[
+            np.r_[row_start + left_stop, row_start + last_x + 1]
+        ]
+        candidates = _concatenate_ranges(boundary_starts, boundary_stops)
+        boundary = candidates[contains(self.x[candidates], self.y[candidates])]
+
+        inner_rows = row_start[has_inner]
+        ranges = np.stack(
+            [
+                self.starts[inner_rows + inner_first[has_inner]],
+                self.starts[inner_rows + inner_last[has_inner] + 1],
+            ],
+            axis=1,
+        )
+        return ranges, boundary
+
+    def _rows(self, ranges: np.ndarray, boundary: np.ndarray) -> np.ndarray:
+        sorted_trees = np.r_[_concatenate_ranges(ranges[:, 0], ranges[:, 1]), boundary]
+        return np.sort(self.rows[sorted_trees])
+
+    def _sum(self, ranges: np.ndarray, boundary: np.ndarray) -> float:
+        totals = self.totals
+        inner = (totals[ranges[:, 1]] - totals[ranges[:, 0]]).sum()
+        return float(inner + np.nan_to_num(self.agb[boundary]).sum())
+
+    def _box_search(self, x_min: float, x_max: float, y_min: float, y_max: float):
+        # A cell is interior if its edges are strictly inside the box, measured in
+        # cells the same way the trees were binned
+        def cells(values, low):
+            return (np.asarray(values, dtype=float) - low) / self.cell_size
+
+        x_inner = cells([x_min, x_max], self.x_min)
+        y_inner = cells([y_min, y_max], self.y_min)
+
+        def interior(grid_rows):
+            inside = (grid_rows > y_inner[0]) & (grid_rows + 1 < y_inner[1])
+            first = np.floor(x_inner[0]).astype(np.int64) + 1
+            last = np.ceil(x_inner[1]).astype(np.int64) - 2
+            return (
+                np.full(len(grid_rows), first),
+                np.where(inside, last, first - 1),
+            )
+
+        def contains(x, y):
+            return (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+
+        return self._search((x_min, x_max, y_min, y_max), interior, contains)
+
+    def _radius_search(self, x: float, y: float, radius: float):
+        if radius < 0:
+            raise ValueError("The radius must not be negative")
+        inner_radius = radius * (1 - _RADIUS_MARGIN)
+
+        def interior(grid_rows):
+            # The half-width of the circle at the far edge of each row of cells
+            bottom = self.y_min + grid_rows * self.cell_size
+            dy = np.maximum(np.abs(bottom - y), np.abs(bottom + self.cell_size - y))
+            with np.errstate(invalid="ignore"):
+                half_width = np.sqrt(inner_radius**2 - dy**2)
+            half_width = np.nan_to_num(half_width, nan=-1.0)
+            first = np.ceil((x - half_width - self.x_min) / self.cell_size)
+            last = np.floor((x + half_width - self.x_min) / self.cell_size) - 1
+            empty = half_width < 0
+            first, last = first.astype(np.int64), last.astype(np.int64)
+            return first, np.where(empty, first - 1, last)
+
+        def contains(tree_x, tree_y):
+            return (tree_x - x) ** 2 + (tree_y - y) ** 2 <= radius**2
+
+        bounds = (x - radius, x + radius, y - radius, y + radius)
+        return self._search(bounds, interior, contains)
+
+    def _polygon_search(self, vertices: Sequence[Tuple[float, float]]):
+        vertices = np.asarray(vertices, dtype=float)
+        if vertices.ndim != 2 or vertices.shape[1] != 2 or len(vertices) < 3:
+            raise ValueError("A polygon needs at least 3 (x, y) vertices")
+        (x_min, y_min), (x_max, y_max) = vertices.min(axis=0), vertices.max(axis=0)
+        first_x, last_x = self._cell([x_min, x_max], self.x_min, self.num_x)
+
+        # The edges of the polygon, measured in cells the same way the trees were
+        # binned, so that cell c of a row spans c <= u < c + 1
+        u0 = (vertices[:, 0] - self.x_min) / self.cell_size
+        v0 = (vertices[:, 1] - self.y_min) / self.cell_size
+        u1, v1 = np.roll(u0, -1), np.roll(v0, -1)
+        edge_v_min, edge_v_max = np.minimum(v0, v1), np.maximum(v0, v1)
+
+        def interior(grid_rows):
+            # In each row, the cells that no edge passes through (with a margin) form
+            # runs that are wholly inside or wholly outside the polygon; testing one
+            # point per run tells which. Only the widest run inside is taken whole
+            first = np.zeros(len(grid_rows), dtype=np.int64)
+            last = np.full(len(grid_rows), -1, dtype=np.int64)
+            columns = last_x - first_x + 1
+            for i, row in enumerate(grid_rows.tolist()):
+                band_min, band_max = row - _POLYGON_MARGIN, row + 1 + _POLYGON_MARGIN
+                crossing = (edge_v_max >= band_min) & (edge_v_min <= band_max)
+                a_u, a_v = u0[crossing], v0[crossing]
+                b_u, b_v = u1[crossing], v1[crossing]
+                # The part of each edge within the row's band
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    t_min = (band_min - a_v) / (b_v - a_v)
+                    t_max = (band_max - a_v) / (b_v - a_v)
+                flat = b_v == a_v
+                t_low = np.where(flat, 0.0, np.clip(np.minimum(t_min, t_max), 0, 1))
+                t_high = np.where(flat, 1.0, np.clip(np.maximum(t_min, t_max), 0, 1))
+                u_low = a_u + t_low * (b_u - a_u)
+                u_high = a_u + t_high * (b_u - a_u)
+                edge_first = np.floor(np.minimum(u_low, u_high) - _POLYGON_MARGIN)
+                edge_last = np.floor(np.maximum(u_low, u_high) + _POLYGON_MARGIN)
+
+                # Mark the cells each edge passes through, then find the runs of
+                # unmarked cells
+                changes = np.zeros(columns + 1, dtype=np.int64)
+                np.add.at(
+                    changes,
+                    np.clip(edge_first - first_x, 0, columns).astype(np.int64),
+                    1,
+                )
+                np.add.at(
+                    changes,
+                    np.clip(edge_last + 1 - first_x, 0, columns).astype(np.int64),
+                    -1,
+                )
+                free = np.r_[False, np.cumsum(changes[:-1]) == 0, False]
+                run_starts = np.flatnonzero(free[1:] & ~free[:-1])
+                run_stops = np.flatnonzero(~free[1:] & free[:-1])
+                if not len(run_starts):
+                    continue
+                inside = _points_in_polygon(
+                    first_x + run_starts + 0.5,
+                    np.full(len(run_starts), row + 0.5),
+                    np.stack([u0, v0], axis=1),
+                )
+                if inside.any():
+                    widths = np.where(inside, run_stops - run_starts, -1)
+                    widest = int(np.argmax(widths))
+                    first[i] = first_x + run_starts[widest]
+                    last[i] = first_x + run_stops[widest] - 1
+            return first, last
+
+        def contains(x, y):
+            return _points_in_polygon(x, y, vertices)
+
+        return self._search((x_min, x_max, y_min, y_max), interior, contains)
+
+    def query_box(
+        self, x_min: float, x_max: float, y_min: float, y_max: float
+    ) -> np.ndarray:
+        """The rows of the trees with x_min <= x_pos <= x_max and y_min <= y_pos <=
+        y_max."""
+        return self._rows(*self._box_search(x_min, x_max, y_min, y_max))
+
+    def query_radius(self, x: float, y: float, radius: float) -> np.ndarray:
+        """
+        The rows of the trees within `radius` of (x, y).
+
+        Raises:
+            ValueError: If the radius is negative.
+        """
+        return self._rows(*self._radius_search(x, y, radius))
+
+    def query_polygon(self, vertices: Sequence[Tuple[float, float]]) -> np.ndarray:
+        """
+        The rows of the trees inside a polygon (by the even-odd rule).
+
+        Args:
+            vertices (sequence): The (x, y) vertices of the polygon, in order. The
+                polygon is closed automatically.
+
+        Raises:
+            ValueError: If there are fewer than 3 vertices.
+        """
+        return self._rows(*self._polygon_search(vertices))
+
+    def sum_box(self, x_min: float, x_max: float, y_min: float, y_max: float) -> float:
+        """The total AGB of the trees returned by `query_box`."""
+        return self._sum(*self._box_search(x_min, x_max, y_min, y_max))
+
+    def sum_radius(self, x: float, y: float, radius: float) -> float:
+        """The total AGB of the trees returned by `query_radius`."""
+        return self._sum(*self._radius_search(x, y, radius))
+
+    def sum_polygon(self, vertices: Sequence[Tuple[float, float]]) -> float:
+        """The total AGB of the trees returned by `query_polygon`."""
+        return self._sum(*self._polygon_search(vertices))
+
+    def save(self, path: str):
+        """Save the index as a compressed `.npz` file of arrays."""
+        np.savez_compressed(
+            path,
+            grid=np.array(
+                [self.x_min, self.y_min, self.cell_size, self.num_x, self.num_y]
+            ),
+            skipped=self.skipped,
+            **{name: getattr(self, name) for name in INDEX_ARRAYS},
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "SpatialIndex":
+        """Load an index saved with `save`."""
+        index = cls.__new__(cls)
+        with np.load(path) as arrays:
+            x_min, y_min, cell_size, num_x, num_y = arrays["grid"].tolist()
+            index.x_min, index.y_min, index.cell_size = x_min, y_min, cell_size
+            index.num_x, index.num_y = int(num_x), int(num_y)
+            index.skipped = int(arrays["skipped"])
+            for name in INDEX_ARRAYS:
+                setattr(index, name, arrays[name])
+        index._totals = None
+        return index
@@ -0,0 +1,270 @@
+"""
+Resolve messy species labels from field data to the common names in the species
+database.
+
+Labels such as "oak tree", "white oak", "Pinus contorta" or "802" are normalized and
+matched, in order, against:
+
+1. aliases (normalized label -> common name),
+2. the common names, the genus and species names, and the FIA species codes in
+   `tree_species_info.csv`, and
+3. the same names with fuzzy matching, to allow for misspellings.
+
+Fuzzy matching is comparatively slow, so the result for each distinct label is kept
+in a bounded LRU cache, which can be saved to disk and shared between runs (and
+machines). A saved cache is ignored if the species table or aliases change.
+"""
+
+import csv
+import difflib
+import hashlib
+import json
+import os
+import re
+import tempfile
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Mapping, Optional
+
+# Bump when the normalization or matching rules change, to invalidate saved caches
+RESOLVER_VERSION = 1
+
+# Words that don't help to identify a species
+_FILLER_WORDS = {"tree", "trees", "spp", "sp", "species", "the"}
+
+# Minimum similarity (as computed by difflib) for a fuzzy match
+FUZZY_CUTOFF = 0.85
+
+
+def _singular(word: str) -> str:
+    """Strip a plural "s", so that e.g. "oaks" and "oak" match."""
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def normalize_label(label) -> str:
+    """
+    Normalize a species label for matching.
+
+    The label is lower-cased and split into words, filler words such as "tree" and
+    "spp" are dropped, plurals are made singular, and the words are sorted so that
+    "Oak, white" and "white oak" give the same result.
+
+    Args:
+        label: A species label.
+
+    Returns:
+        str: The normalized label.
+    """
+    words = re.findall(r"[a-z0-9]+", str(label).lower())
+    return " ".join(sorted(_singular(w) for w in words if w not in _FILLER_WORDS))
+
+
+def _scientific_names(rows: List[dict]) -> List[str]:
+    """Expand abbreviated genera ("A. fraseri") using the previous full genus."""
+    names = []
+    genus = ""
+    for row in rows:
+        name = row["Genus and species"].strip()
+        words = name.split()
+        if words and words[0].endswith(".") and len(words[0]) <= 3:
+            name = " ".join([genus] + words[1:])
+        elif words:
+            genus = words[0]
+        names.append(name)
+    return names
+
+
+class SpeciesResolver:
+    """
+    Match species labels to the common names in the species database.
+
+    Args:
+        rows (list): The rows of `tree_species_info.csv`, as dictionaries.
+        aliases (dict): Extra labels for some of the common names.
+        max_size (int): The maximum number of labels kept in the LRU cache.
+
+    Raises:
+        ValueError: If an alias refers to a common name that is not in the table.
+    """
+
+    def __init__(
+        self,
+        rows: List[dict],
+        aliases: Optional[Mapping[str, str]] = None,
+        max_size: int = 4096,
+    ):
+        aliases = dict(aliases or {})
+        common_names = {row["Common name"] for row in rows}
+        unknown = sorted(set(aliases.values()) - common_names)
+        if unknown:
+            raise ValueError(f"Aliases refer to unknown species: {unknown}")
+
+        # Normalized names that refer to more than one common name are ambiguous,
+        # and are left out
+        candidates: Dict[str, set] = {}
+        for row, scientific_name in zip(rows, _scientific_names(rows)):
+            for name in (row["Common name"], scientific_name):
+                candidates.setdefault(normalize_label(name), set()).add(
+                    row["Common name"]
+                )
+        self.names = {
+            key: next(iter(targets))
+            for key, targets in candidates.items()
+            if key and len(targets) == 1
+        }
+        self.codes = {
+            str(int(row["FIA species code"])): row["Common name"] for row in rows
+        }
+        self.aliases = {normalize_label(a): name for a, name in aliases.items()}
+
+        self.max_size = max_size
+        self.path: Optional[str] = None
+        self.cache: "OrderedDict[str, Optional[str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.modified = False
+        # Everything a label is matched against: the common and scientific names,
+        # the FIA codes and the aliases
+        self.fingerprint = hashlib.sha256(
+            json.dumps(
+                [RESOLVER_VERSION, self.names, self.codes, self.aliases],
+                sort_keys=True,
+            ).encode()
+        ).hexdigest()
+
+    @classmethod
+    def from_csv(
+        cls,
+        path: str,
+        aliases: Optional[Mapping[str, str]] = None,
+        max_size: int = 4096,
+    ) -> "SpeciesResolver":
+        """Create a resolver for the species in a `tree_species_info.csv` file."""
+        with open(path, newline="") as csv_file:
+            rows = list(csv.DictReader(csv_file))
+        return cls(rows, aliases, max_size)
+
+    def _match(self, label) -> Optional[str]:
+        """Resolve a label without the cache."""
+        key = normalize_label(label)
+        if key in self.aliases:
+            return self.aliases[key]
+        if key in self.names:
+            return self.names[key]
+        if key in self.codes:
+            return self.codes[key]
+
+        # Only accept a fuzzy match if the best candidate is clearly the best
+        matches = difflib.get_close_matches(key, self.names, n=2, cutoff=FUZZY_CUTOFF)
+        if not matches:
+            return None
+        if len(matches) == 2 and self.names[matches[0]] != self.names[matches[1]]:
+            scores = [difflib.SequenceMatcher(None, key, m).ratio() for m in matches]
+            if scores[0] == scores[1]:
+                return None
+        return self.names[matches[0]]
+
+    def resolve(self, label) -> Optional[str]:
+        """
+        Find the common name for a species label.
+
+        Args:
+            label: A species label from field data.
+
+        Returns:
+            str: The matching common name, or None if the label can't be resolved.
+        """
+        label = str(label)
+        if label in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(label)
+            return self.cache[label]
+
+        self.misses += 1
+        name = self._match(label)
+        self.cache[label] = name
+        self.modified = True
+        if len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+        return name
+
+    def resolve_many(self, labels: Iterable) -> Dict[str, Optional[str]]:
+        """Resolve each distinct label once, returning a label -> name mapping."""
+        return {label: self.resolve(label) for label in dict.fromkeys(labels)}
+
+    def save(self, path: str):
+        """Save the cached resolutions as JSON, atomically."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as cache_file:
+            json.dump(
+                {"fingerprint": self.fingerprint, "labels": self.cache}, cache_file
+            )
+        os.replace(temp_path, path)
+        self.modified = False
+
+    def flush(self):
+        """Save new resolutions to the file given to `load_species_resolver`, if any.
+        Failing to write the file is not an error."""
+        if self.modified and self.path is not None:
+            try:
+                self.save(self.path)
+            except OSError:
+                pass
+
+    def load(self, path: str) -> bool:
+        """
+        Add the resolutions saved by `save` to the cache.
+
+        Returns:
+            bool: False if the file is missing, unreadable or was saved for a
+                different species table or aliases (in which case it is ignored).
+        """
+        try:
+            with open(path) as cache_file:
+                saved = json.load(cache_file)
+        except (OSError, ValueError):
+            return False
+        if not isinstance(saved, dict) or saved.get("fingerprint") != self.fingerprint:
+            return False
+        for label, name in saved["labels"].items():
+            self.cache.setdefault(label, name)
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+        return True
+
+
+# Resolvers created by load_species_resolver, by the path of their species table
+_resolvers: Dict[str, SpeciesResolver] = {}
+
+
+def load_species_resolver(
+    path: str,
+    aliases: Optional[Mapping[str, str]] = None,
+    cache_path: Optional[str] = None,
+) -> SpeciesResolver:
+    """
+    Return a resolver for a species table, shared by all callers in this process.
+
+    Args:
+        path (str): Path to the species information CSV file.
+        aliases (dict): Extra labels for some of the common names.
+        cache_path (str): A file of saved resolutions to load, if it exists, and
+            that `SpeciesResolver.flush` saves new resolutions to.
+
+    Returns:
+        SpeciesResolver: The resolver.
+    """
+    key = os.path.realpath(path)
+    resolver = _resolvers.get(key)
+    if resolver is None or resolver.aliases != {
+        normalize_label(a): name for a, name in (aliases or {}).items()
+    }:
+        resolver = SpeciesResolver.from_csv(path, aliases)
+        _resolvers[key] = resolver
+    if cache_path is not None and resolver.path != cache_path:
+        resolver.load(cache_path)
+        resolver.path = cache_path
+    return resolver
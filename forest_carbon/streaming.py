@@ -0,0 +1,249 @@
+"""
+Incremental reading and writing of tree data, for files that do not fit in memory.
+
+Trees can be read one at a time either from a JSON document of the form
+`{"trees": [...]}` or from newline-delimited JSON (one tree object per line, in files
+ending in `.ndjson` or `.jsonl`). Results are written incrementally in the same two
+formats.
+"""
+
+import contextlib
+import json
+import os
+import textwrap
+import uuid
+from typing import Iterable, Iterator, List
+
+NDJSON_EXTENSIONS = (".ndjson", ".jsonl")
+
+# Number of characters read from the input file at a time
+READ_SIZE = 1 << 16
+
+_WHITESPACE = " \t\n\r"
+
+
+def is_ndjson(path: str) -> bool:
+    """Return True if the path names a newline-delimited JSON file."""
+    return os.path.splitext(path)[1].lower() in NDJSON_EXTENSIONS
+
+
+class _JsonStreamReader:
+    """A minimal pull parser over a JSON file, decoding one value at a time."""
+
+    def __init__(self, file, read_size: int = READ_SIZE):
+        self.file = file
+        self.read_size = read_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        """Read more of the file into the buffer. Returns False at end of file."""
+        if self.eof:
+            return False
+        data = self.file.read(self.read_size)
+        if not data:
+            self.eof = True
+            return False
+        # Drop the consumed part of the buffer so it doesn't grow with the file
+        self.buffer = self.buffer[self.pos :] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character ("" at end of file)."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos : self.pos + 1]
+
+    def expect(self, char: str):
+        """Consume the next non-whitespace character, which must be `char`."""
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buffer, self.pos)
+        self.pos += 1
+
+    def decode(self):
+        """Decode the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # The value may just be cut off at the end of the buffer
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next read
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+
+def _iter_array(reader: _JsonStreamReader) -> Iterator:
+    """Decode the values of the JSON array at the reader's position, one at a time."""
+    reader.expect("[")
+    if reader.peek() == "]":
+        return
+    while True:
+        yield reader.decode()
+        if reader.peek() == "]":
+            return
+        reader.expect(",")
+
+
+def iter_json_trees(
+    data_path: str, key: str = "trees", read_size: int = READ_SIZE
+) -> Iterator[dict]:
+    """
+    Iterate over the trees in a JSON document without loading the whole file.
+
+    Args:
+        data_path (str): Path to a JSON file of the form `{"trees": [...]}`, or a
+            JSON list of trees as written by `run_model`.
+        key (str): The key of the list of trees in the top-level object.
+        read_size (int): Number of characters to read from the file at a time.
+
+    Yields:
+        dict: The information on each tree, in file order.
+
+    Raises:
+        json.JSONDecodeError: If the file is not valid JSON.
+        KeyError: If the top-level object has no `key` entry.
+    """
+    with open(data_path, "r") as json_file:
+        reader = _JsonStreamReader(json_file, read_size)
+        if reader.peek() == "[":
+            yield from _iter_array(reader)
+            return
+        reader.expect("{")
+        if reader.peek() == "}":
+            raise KeyError(key)
+        while True:
+            name = reader.decode()
+            reader.expect(":")
+            if name == key:
+                yield from _iter_array(reader)
+                return
+            reader.decode()  # skip the value of any other key
+            if reader.peek() == "}":
+                raise KeyError(key)
+            reader.expect(",")
+
+
+def iter_ndjson_trees(data_path: str) -> Iterator[dict]:
+    """
+    Iterate over the trees in a newline-delimited JSON file.
+
+    Args:
+        data_path (str): Path to a file with one JSON tree object per line.
+
+    Yields:
+        dict: The information on each tree, in file order. Blank lines are skipped.
+    """
+    with open(data_path, "r") as ndjson_file:
+        for line in ndjson_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_trees(data_path: str) -> Iterator[dict]:
+    """Iterate over the trees in a JSON or newline-delimited JSON file."""
+    if is_ndjson(data_path):
+        return iter_ndjson_trees(data_path)
+    return iter_json_trees(data_path)
+
+
+def iter_chunks(items: Iterable, chunk_size: int) -> Iterator[List]:
+    """Group an iterable into lists of at most `chunk_size` items."""
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class JsonTreeWriter:
+    """
+    Write trees incrementally as a JSON list.
+
+    The output is identical to `json.dump(trees, file, indent=2)` on the full list.
+    It is written to a temporary file next to `save_path`, which replaces
+    `save_path` on `close()`. Leaving a `with` block with an exception (or calling
+    `discard()`) deletes the temporary file instead, so a failed run never leaves a
+    partial output that looks complete.
+    """
+
+    def __init__(self, save_path: str):
+        self.save_path = save_path
+        # A plain `open` creates the file with the umask's permissions
+        self.temp_path = f"{save_path}.{uuid.uuid4().hex}.tmp"
+        self.file = open(self.temp_path, "x")
+        self.count = 0
+
+    def write(self, tree: dict):
+        self.file.write("[\n" if self.count == 0 else ",\n")
+        self.file.write(textwrap.indent(json.dumps(tree, indent=2), "  "))
+        self.count += 1
+
+    def write_many(self, trees: Iterable[dict]):
+        for tree in trees:
+            self.write(tree)
+
+    def _finish(self):
+        """Write anything that ends the output."""
+        self.file.write("[]" if self.count == 0 else "\n]")
+
+    def close(self):
+        """Finish the output and move it to `save_path`."""
+        if self.file.closed:
+            return
+        try:
+            self._finish()
+            self.file.close()
+            os.replace(self.temp_path, self.save_path)
+        except BaseException:
+            self.discard()
+            raise
+
+    def discard(self):
+        """Abandon the output, leaving `save_path` untouched."""
+        self.file.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is not None:
+            self.discard()
+        else:
+            self.close()
+
+
+class NdjsonTreeWriter(JsonTreeWriter):
+    """Write trees incrementally as newline-delimited JSON (see `JsonTreeWriter`)."""
+
+    def write(self, tree: dict):
+        self.file.write(json.dumps(tree))
+        self.file.write("\n")
+        self.count += 1
+
+    def _finish(self):
+        pass
+
+
+def open_tree_writer(save_path: str) -> JsonTreeWriter:
+    """Open a JSON or newline-delimited JSON writer, depending on the extension."""
+    if is_ndjson(save_path):
+        return NdjsonTreeWriter(save_path)
+    return JsonTreeWriter(save_path)
@@ -0,0 +1,365 @@
+"""
+A compiled lookup index over the taxa-level AGB model parameters.
+
+`agb_biomass.agb_biomass_model` scans every row of the parameter table for each
+tree. The index below is built once from the table returned by
+`agb_biomass.load_taxa_agb_model_data` and maps each (group, taxa) pair to a sorted
+array of specific gravity breakpoints, so that a lookup costs one hash plus one binary
+search. It reproduces the matching rules of `agb_biomass_model` exactly.
+"""
+
+import hashlib
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+
+# Column positions in the table returned by `agb_biomass.load_taxa_agb_model_data`
+(
+    _GROUP,
+    _TAXA,
+    _B0,
+    _B1,
+    _NUM_OBSERVATIONS,
+    _DIAMETER,
+    _DIAMETER_RANGE,
+    _R2,
+    _SPG_LOWER,
+    _SPG_UPPER,
+) = (
+    0,
+    1,
+    3,
+    4,
+    5,
+    7,
+    8,
+    9,
+    10,
+    11,
+)
+
+
+def _parse_diameter_range(label) -> Tuple[float, float]:
+    """Parse a diameter range such as "3-69" (cm) into its bounds, or NaNs."""
+    try:
+        lower, upper = str(label).split("-")
+        return float(lower), float(upper)
+    except ValueError:
+        return np.nan, np.nan
+
+
+class _KeyEntry:
+    """The rows matching one (group, taxa) pair, compiled for spg lookups.
+
+    `breakpoints` holds the sorted, distinct spg bounds of the matching rows. The
+    specific gravity `spg` falls in segment `np.searchsorted(breakpoints, spg, "right")`
+    and `segment_rows[segment]` is the row `agb_biomass_model` would select for it.
+    `segment_exact[segment]` is False where no row's spg range covers the segment, in
+    which case the first matching row is selected.
+    """
+
+    __slots__ = ("rows", "breakpoints", "segment_rows", "segment_exact")
+
+    def __init__(self, rows: np.ndarray, spg_lower: np.ndarray, spg_upper: np.ndarray):
+        self.rows = rows
+        self.breakpoints = np.unique(np.concatenate([spg_lower[rows], spg_upper[rows]]))
+
+        num_segments = len(self.breakpoints) + 1
+        self.segment_rows = np.full(num_segments, rows[0] if len(rows) else -1)
+        self.segment_exact = np.zeros(num_segments, dtype=bool)
+        for segment in range(1, num_segments - 1):
+            start = self.breakpoints[segment - 1]
+            end = self.breakpoints[segment]
+            for row in rows:
+                # The last row whose range covers the segment wins, as in the row scan
+                if spg_lower[row] <= start and end <= spg_upper[row]:
+                    self.segment_rows[segment] = row
+                    self.segment_exact[segment] = True
+
+
+class TaxaModelIndex:
+    """
+    Lookup index mapping (group, taxa, spg) to a row of the taxa-level parameter table.
+
+    Attributes:
+        groups (np.ndarray): The group of each row.
+        taxa (np.ndarray): The taxa label of each row.
+        b0 (np.ndarray): The b0 regression parameter of each row.
+        b1 (np.ndarray): The b1 regression parameter of each row.
+        rsquared (np.ndarray): The R^2 statistic of each row.
+        diameter_class (np.ndarray): "dbh" or "drc" for each row.
+        spg_lower (np.ndarray): The lower specific gravity bound of each row.
+        spg_upper (np.ndarray): The upper specific gravity bound of each row.
+        diameter_min (np.ndarray): The smallest diameter (cm) of the data each row's
+            model was fitted to, or NaN if unknown.
+        diameter_max (np.ndarray): The largest diameter (cm) of the data each row's
+            model was fitted to, or NaN if unknown.
+        num_observations (np.ndarray): The number of (pseudo-)observations each
+            row's model was fitted to, or NaN if unknown.
+        fingerprint (str): A hash of the table contents, identifying this version of
+            the parameters (e.g. to invalidate results cached from another version).
+    """
+
+    def __init__(
+        self,
+        groups,
+        taxa,
+        b0,
+        b1,
+        rsquared,
+        diameter_class,
+        spg_lower,
+        spg_upper,
+        diameter_min=None,
+        diameter_max=None,
+        num_observations=None,
+    ):
+        self.groups = np.asarray(groups, dtype=object)
+        self.taxa = np.asarray(taxa, dtype=object)
+        self.b0 = np.asarray(b0, dtype=float)
+        self.b1 = np.asarray(b1, dtype=float)
+        self.rsquared = np.asarray(rsquared, dtype=float)
+        self.diameter_class = np.asarray(diameter_class, dtype=object)
+        self.spg_lower = np.asarray(spg_lower, dtype=float)
+        self.spg_upper = np.asarray(spg_upper, dtype=float)
+        unknown = np.full(len(self.groups), np.nan)
+        self.diameter_min = np.asarray(
+            diameter_min if diameter_min is not None else unknown, dtype=float
+        )
+        self.diameter_max = np.asarray(
+            diameter_max if diameter_max is not None else unknown, dtype=float
+        )
+        self.num_observations = np.asarray(
+            num_observations if num_observations is not None else unknown, dtype=float
+        )
+
+        digest = hashlib.sha256()
+        for column in (
+            self.b0,
+            self.b1,
+            self.rsquared,
+            self.spg_lower,
+            self.spg_upper,
+            self.diameter_min,
+            self.diameter_max,
+            self.num_observations,
+        ):
+            digest.update(column.tobytes())
+        for column in (self.groups, self.taxa, self.diameter_class):
+            digest.update("\0".join(map(str, column)).encode())
+        self.fingerprint = digest.hexdigest()
+
+        # Taxa labels containing "/" match on any of their "/"-separated parts; the
+        # others match any substring of the label
+        self._taxa_parts = [
+            [part.strip() for part in label.split("/")] if "/" in label else None
+            for label in self.taxa
+        ]
+
+        # Compile the entries for every taxa name that appears in the table up front;
+        # any other query is compiled the first time it is seen
+        self._entries: Dict[Tuple[str, str], _KeyEntry] = {}
+        for group, label, parts in zip(self.groups, self.taxa, self._taxa_parts):
+            for name in parts if parts is not None else label.split():
+                self._entry(group, name)
+
+    @classmethod
+    def from_dataframe(cls, df) -> "TaxaModelIndex":
+        """
+        Build the index from the table returned by `load_taxa_agb_model_data`.
+
+        Args:
+            df (pd.DataFrame): The processed taxa-level parameter table.
+
+        Returns:
+            TaxaModelIndex: The compiled index.
+        """
+        diameter_range = [
+            _parse_diameter_range(label) for label in df.iloc[:, _DIAMETER_RANGE]
+        ]
+        return cls(
+            groups=df.iloc[:, _GROUP].to_numpy(),
+            taxa=df.iloc[:, _TAXA].to_numpy(),
+            b0=df.iloc[:, _B0].to_numpy(),
+            b1=df.iloc[:, _B1].to_numpy(),
+            rsquared=df.iloc[:, _R2].to_numpy(),
+            diameter_class=df.iloc[:, _DIAMETER].to_numpy(),
+            spg_lower=df.iloc[:, _SPG_LOWER].to_numpy(),
+            spg_upper=df.iloc[:, _SPG_UPPER].to_numpy(),
+            diameter_min=[lower for lower, _ in diameter_range],
+            diameter_max=[upper for _, upper in diameter_range],
+            num_observations=df.iloc[:, _NUM_OBSERVATIONS].to_numpy(),
+        )
+
+    def __len__(self) -> int:
+        return len(self.groups)
+
+    def _entry(self, group: str, taxa: str) -> _KeyEntry:
+        """Return the compiled entry for a (group, taxa) pair, building it if needed."""
+        key = (group, taxa)
+        entry = self._entries.get(key)
+        if entry is None:
+            rows = [
+                row
+                for row in range(len(self.groups))
+                if self.groups[row] == group
+                and taxa
+                in (
+                    self._taxa_parts[row]
+                    if self._taxa_parts[row] is not None
+                    else self.taxa[row]
+                )
+            ]
+            entry = _KeyEntry(
+                np.array(rows, dtype=np.intp), self.spg_lower, self.spg_upper
+            )
+            self._entries[key] = entry
+        return entry
+
+    def _select(self, group: str, taxa: str, spg: Optional[float]) -> Tuple[int, bool]:
+        """Return the selected row (-1 if none) and whether the spg range matched."""
+        entry = self._entry(group, taxa)
+        if spg is None:
+            return entry.segment_rows[0], False
+        segment = np.searchsorted(entry.breakpoints, spg, side="right")
+        return entry.segment_rows[segment], entry.segment_exact[segment]
+
+    def lookup(
+        self, group: str, taxa: str, spg: Optional[float]
+    ) -> Optional[Tuple[float, float, float, str]]:
+        """
+        Find the model parameters `choosing_the_model` would use for a tree.
+
+        Args:
+            group (str): The group of the tree.
+            taxa (str): The taxa of the tree.
+            spg (float): The specific gravity of the tree, or None if unknown.
+
+        Returns:
+            (b0, b1, R^2, diameterClass) of the selected model, or None if no model
+            matches the group and taxa.
+        """
+        row, _ = self._select(group, taxa, spg)
+        if row < 0:
+            return None
+        return (
+            float(self.b0[row]),
+            float(self.b1[row]),
+            float(self.rsquared[row]),
+            self.diameter_class[row],
+        )
+
+    def model_parameters(
+        self, group: str, taxa: str, spg: Optional[float]
+    ) -> Union[
+        Dict[Tuple[str, str], Tuple[float, float, float, str]],
+        Tuple[float, float, float, str],
+    ]:
+        """
+        Find the model parameters for a tree, with the same return value as
+        `agb_biomass.agb_biomass_model`.
+
+        Returns:
+            (b0, b1, R^2, diameterClass) if the specific gravity falls in the range of
+            a matching model, otherwise a dict mapping the (group, taxa) of every
+            matching model to its parameters (empty if there are no matches).
+        """
+        row, exact = self._select(group, taxa, spg)
+        if exact:
+            return self.lookup(group, taxa, spg)
+        return {
+            (self.groups[row], self.taxa[row]): (
+                float(self.b0[row]),
+                float(self.b1[row]),
+                float(self.rsquared[row]),
+                self.diameter_class[row],
+            )
+            for row in self._entry(group, taxa).rows
+        }
+
+    def lookup_rows(self, groups, taxa, spg) -> np.ndarray:
+        """
+        Resolve the selected parameter table row for a whole batch of trees.
+
+        Args:
+            groups (array-like of str): The group of each tree.
+            taxa (array-like of str): The taxa of each tree.
+            spg (array-like of float): The specific gravity of each tree (NaN if
+                unknown). It may also be 2-D, with one row per sample of the specific
+                gravities (e.g. for Monte Carlo) and one column per tree.
+
+        Returns:
+            np.ndarray: The index of the selected row for each tree (with the shape
+                of `spg`), or -1 where no model matches the group and taxa. Use it to
+                gather from the `b0`, `b1`, `rsquared` and `diameter_class` arrays.
+        """
+        groups = np.asarray(groups, dtype=object)
+        taxa = np.asarray(taxa, dtype=object)
+        if len(groups) == 0:
+            return self.lookup_row_codes([], [], [], [], spg)
+        group_names, group_codes = np.unique(groups, return_inverse=True)
+        taxa_names, taxa_codes = np.unique(taxa, return_inverse=True)
+        return self.lookup_row_codes(
+            group_codes.reshape(-1),
+            group_names,
+            taxa_codes.reshape(-1),
+            taxa_names,
+            spg,
+        )
+
+    def lookup_row_codes(
+        self, group_codes, group_labels, taxa_codes, taxa_labels, spg
+    ) -> np.ndarray:
+        """
+        Resolve the selected parameter table row for a batch of trees whose group and
+        taxa are given as integer codes, as in a `TreeBatch`.
+
+        Args:
+            group_codes (array-like of int): The index into `group_labels` of each
+                tree's group, or -1 if it is missing.
+            group_labels (array-like of str): The distinct groups.
+            taxa_codes (array-like of int): The index into `taxa_labels` of each
+                tree's taxa, or -1 if it is missing.
+            taxa_labels (array-like of str): The distinct taxa.
+            spg (array-like of float): As for `lookup_rows`.
+
+        Returns:
+            np.ndarray: As for `lookup_rows`, with -1 for trees with a missing group
+                or taxa too.
+        """
+        spg = np.asarray(spg, dtype=float)
+        rows = np.full(spg.shape, -1, dtype=np.intp)
+        if spg.shape[-1] == 0:
+            return rows
+
+        # Group the trees by (group, taxa) pair, then binary search each pair's spg
+        # values against its breakpoints in one call
+        group_codes = np.asarray(group_codes, dtype=np.int64)
+        taxa_codes = np.asarray(taxa_codes, dtype=np.int64)
+        num_taxa = len(taxa_labels)
+        pair_codes = np.where(
+            (group_codes < 0) | (taxa_codes < 0),
+            -1,
+            group_codes * num_taxa + taxa_codes,
+        )
+        order = np.argsort(pair_codes, kind="stable")
+        sorted_codes = pair_codes[order]
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        ends = np.r_[starts[1:], len(order)]
+        for start, end in zip(starts, ends):
+            members = order[start:end]
+            code = sorted_codes[start]
+            if code < 0:
+                continue
+            entry = self._entry(
+                group_labels[code // num_taxa], taxa_labels[code % num_taxa]
+            )
+            if len(entry.segment_rows) == 1:
+                # A single segment: the row doesn't depend on spg
+                rows[..., members] = entry.segment_rows[0]
+                continue
+            segments = np.searchsorted(
+                entry.breakpoints, spg[..., members], side="right"
+            )
+            rows[..., members] = entry.segment_rows[segments]
+        return rows
@@ -1,33 +1,186 @@
 """Pre-process tree measurements to make AGB estimation easier."""
-import pandas as pd
+from collections import Counter
+from typing import TYPE_CHECKING
 
+from .instrumentation import metrics
 
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+# The fields added to each tree from the species database
+SPECIES_FIELDS = ("taxa", "group", "spg", "fia_species_code")
+
+
+class UnknownSpeciesError(KeyError):
+    """Raised when trees have species labels that are not in the species database.
+
+    Attributes:
+        species (list): The unknown labels, in the order they first appear.
+        counts (list): The number of trees with each unknown label.
+    """
+
+    def __init__(self, species: list, counts: list):
+        super().__init__(species[0] if len(species) == 1 else tuple(species))
+        self.species = species
+        self.counts = counts
+
+    def __reduce__(self):
+        # Rebuild from the labels and counts, so the error can be sent back from a
+        # worker process
+        return type(self), (self.species, self.counts)
+
+    def __str__(self):
+        labels = ", ".join(
+            f"{label!r} ({count})" for label, count in zip(self.species, self.counts)
+        )
+        return f"{sum(self.counts)} trees have unknown species: {labels}"
+
+
+@metrics.timed("load_species_info")
 def create_common_name_dictionary(csv_file_path):
+    import pandas as pd
+
     # Load the CSV file into a DataFrame
     df = pd.read_csv(csv_file_path)
 
-    # Initialize an empty dictionary to store the data
-    common_name_data = {}
-
-    # Iterate over each row in the DataFrame
-    for _, row in df.iterrows():
-        common_name = row["Common name"]
-        taxa = row["Taxa"].split()[0]  # Extract the first word from 'Taxa'
-        fia_species = row["FIA species code"]
-        wood_specific_gravity = row["Wood specific gravity"]
-        group = row["Group"]
-
-        # Add an entry to the dictionary
-        common_name_data[common_name] = {
+    # Extract the first word from 'Taxa', and add an entry per common name
+    genus = df["Taxa"].str.split().str[0]
+    common_name_data = {
+        common_name: {
             "taxa": taxa,
             "fia_species_code": fia_species,
             "spg": wood_specific_gravity,
             "group": group,
         }
+        for common_name, taxa, fia_species, wood_specific_gravity, group in zip(
+            df["Common name"].tolist(),
+            genus.tolist(),
+            df["FIA species code"].tolist(),
+            df["Wood specific gravity"].tolist(),
+            df["Group"].tolist(),
+        )
+    }
 
     return common_name_data
 
 
+def factorize_species(species) -> tuple:
+    """Encode species labels as integer codes into an array of the unique labels.
+
+    Args:
+        species (array-like): The species label of each tree.
+
+    Returns:
+        codes (np.ndarray): The index of each tree's label in `labels`.
+        labels (np.ndarray): The unique labels, in the order they first appear.
+    """
+    import pandas as pd
+
+    codes, labels = pd.factorize(
+        pd.Series(species, dtype=object), use_na_sentinel=False
+    )
+    return codes, labels.to_numpy()
+
+
+def _unknown_species_error(species: list, unknown: set) -> UnknownSpeciesError:
+    """Build the error listing the unknown labels among the trees' `species`."""
+    counts = Counter(label for label in species if label in unknown)
+    return UnknownSpeciesError(list(counts), list(counts.values()))
+
+
+def _database_keys(labels, database: dict, resolver=None) -> dict:
+    """Map each species label to its key in the database: the label itself if it is
+    there, otherwise the common name found by `resolver`, or None."""
+    keys = {}
+    for label in labels:
+        if label in database:
+            keys[label] = label
+        elif resolver is not None:
+            name = resolver.resolve(label)
+            keys[label] = name if name in database else None
+        else:
+            keys[label] = None
+    return keys
+
+
+def _species_entries(codes, labels, database: dict, resolver=None) -> list:
+    """Look up each unique species label in the database.
+
+    Raises:
+        UnknownSpeciesError: If any labels are not in the database.
+    """
+    import numpy as np
+
+    keys = _database_keys(labels, database, resolver)
+    unknown = [i for i, label in enumerate(labels) if keys[label] is None]
+    if unknown:
+        counts = np.bincount(codes, minlength=len(labels))
+        raise UnknownSpeciesError(
+            [labels[i] for i in unknown], [int(counts[i]) for i in unknown]
+        )
+    return [database[keys[label]] for label in labels]
+
+
+def enrich_species_codes(codes, labels, database: dict, resolver=None) -> dict:
+    """Look up the species information for factorized species labels.
+
+    Each unique label is looked up in the database once, and the information is
+    gathered out to the trees with the integer codes.
+
+    Args:
+        codes (np.ndarray): The index into `labels` of each tree's species, as
+            returned by `factorize_species`.
+        labels (array-like): The unique species labels.
+        database (dict): A dictionary containing information on the species, generated
+            by the `create_common_name_dictionary` function.
+        resolver (SpeciesResolver): If given, used to match species labels that are
+            not common names in the database (e.g. "oak tree").
+
+    Returns:
+        dict: Arrays of the "taxa", "group", "spg" and "fia_species_code" of each tree.
+
+    Raises:
+        UnknownSpeciesError: If any labels are not found in the common name
+            dictionary, listing all of them.
+    """
+    import numpy as np
+
+    entries = _species_entries(codes, labels, database, resolver)
+    columns = {}
+    for field in SPECIES_FIELDS:
+        values = [entry[field] for entry in entries]
+        if field == "spg":
+            values = np.array(values, dtype=float)
+        elif field == "fia_species_code":
+            values = np.array(values)
+        else:
+            values = np.array(values, dtype=object)
+        columns[field] = values[codes]
+    return columns
+
+
+def enrich_species_columns(species, database: dict, resolver=None) -> dict:
+    """Look up the species information for a whole column of species labels.
+
+    Args:
+        species (array-like): The species label of each tree.
+        database (dict): A dictionary containing information on the species, generated
+            by the `create_common_name_dictionary` function.
+        resolver (SpeciesResolver): If given, used to match species labels that are
+            not common names in the database (e.g. "oak tree").
+
+    Returns:
+        dict: Arrays of the "taxa", "group", "spg" and "fia_species_code" of each tree.
+
+    Raises:
+        UnknownSpeciesError: If any labels are not found in the common name
+            dictionary, listing all of them.
+    """
+    codes, labels = factorize_species(species)
+    return enrich_species_codes(codes, labels, database, resolver)
+
+
 def preprocess_tree_entry(tree: dict, database: dict) -> dict:
     """Preprocess a tree entry to add information on the taxa, group, etc.
 
@@ -62,7 +215,7 @@ def preprocess_tree_entry(tree: dict, database: dict) -> dict:
     return tree
 
 
-def preprocess_tree_entries(trees: list, database: dict) -> list:
+def preprocess_tree_entries(trees: list, database: dict, resolver=None) -> list:
     """Preprocess a list of tree entries.
 
     Args:
@@ -70,13 +223,125 @@ def preprocess_tree_entries(trees: list, database: dict) -> list:
             dictionary should include a "species" tag with a label for the species.
         database (dict): A dictionary containing information on the species, generated
             by the `create_common_name_dictionary` function.
+        resolver (SpeciesResolver): If given, used to match species labels that are
+            not common names in the database (e.g. "oak tree").
 
     Returns:
         list: The input list with additional information added on taxa, group,
             and specific gravity.
 
     Raises:
-        KeyError: If the species label of any tree is not found in the common name
-            dictionary.
+        UnknownSpeciesError: If the species label of any tree is not found in the
+            common name dictionary. This is a `KeyError` listing all of the unknown
+            labels.
     """
-    return [preprocess_tree_entry(tree, database) for tree in trees]
+    with metrics.stage("preprocess", len(trees)):
+        species = [tree["species"] for tree in trees]
+        keys = _database_keys(set(species), database, resolver)
+        unknown = {label for label, key in keys.items() if key is None}
+        if unknown:
+            raise _unknown_species_error(species, unknown)
+
+        # Look up each species once, then copy its information to all of its trees
+        values = {
+            label: tuple(database[key][field] for field in SPECIES_FIELDS)
+            for label, key in keys.items()
+        }
+        for tree, label in zip(trees, species):
+            (
+                tree["taxa"],
+                tree["group"],
+                tree["spg"],
+                tree["fia_species_code"],
+            ) = values[label]
+    return trees
+
+
+def preprocess_tree_frame(
+    trees: "pd.DataFrame", database: dict, resolver=None
+) -> "pd.DataFrame":
+    """Preprocess a table of tree entries, one tree per row.
+
+    This is the columnar counterpart of `preprocess_tree_entries`: the species
+    information is joined onto the table column by column, without building a
+    dictionary per tree.
+
+    Args:
+        trees (pd.DataFrame): A table of trees. Should include a "species" column with
+            a label for the species of each tree.
+        database (dict): A dictionary containing information on the species, generated
+            by the `create_common_name_dictionary` function.
+        resolver (SpeciesResolver): If given, used to match species labels that are
+            not common names in the database (e.g. "oak tree").
+
+    Returns:
+        pd.DataFrame: A copy of the input table with "taxa", "group", "spg" and
+            "fia_species_code" columns added.
+
+    Raises:
+        UnknownSpeciesError: If the species label of any tree is not found in the
+            common name dictionary. This is a `KeyError` listing all of the unknown
+            labels.
+    """
+    with metrics.stage("preprocess", len(trees)):
+        columns = enrich_species_columns(
+            trees["species"].to_numpy(), database, resolver
+        )
+
+        trees = trees.copy()
+        for column in SPECIES_FIELDS:
+            trees[column] = columns[column]
+
+    return trees
+
+
+def preprocess_tree_batch(batch, database: dict, resolver=None):
+    """Preprocess a `TreeBatch` of tree entries.
+
+    This is the struct-of-arrays counterpart of `preprocess_tree_entries`: each
+    distinct species label is looked up once, and the "group", "taxa" and "spg"
+    columns are gathered out to the trees with the species codes, so the group and
+    taxa stay integer codes.
+
+    Args:
+        batch (TreeBatch): The trees. Should include a "species" column.
+        database (dict): A dictionary containing information on the species, generated
+            by the `create_common_name_dictionary` function.
+        resolver (SpeciesResolver): If given, used to match species labels that are
+            not common names in the database (e.g. "oak tree").
+
+    Returns:
+        TreeBatch: The input batch with "group", "taxa" and "spg" columns added.
+
+    Raises:
+        UnknownSpeciesError: If the species label of any tree is not found in the
+            common name dictionary (or is missing), listing all of the unknown labels.
+    """
+    import numpy as np
+
+    with metrics.stage("preprocess", len(batch)):
+        # Keep only the labels in use (a selection of rows shares all the labels of
+        # its batch), with missing labels reported as an unknown None species
+        used, codes = np.unique(batch.codes["species"], return_inverse=True)
+        labels = np.append(batch.labels["species"], None)[used]
+        codes = codes.reshape(-1)
+        if len(used) and used[0] < 0:
+            # Report the missing labels last, like the trees' codes they come after
+            used = np.roll(used, -1)
+            labels = np.roll(labels, -1)
+            codes = (codes - 1) % len(used)
+        entries = _species_entries(codes, labels, database, resolver)
+
+        for field in ("group", "taxa"):
+            # The code of each species' group (or taxa) among the distinct values
+            field_codes: dict = {}
+            species_codes = np.array(
+                [
+                    field_codes.setdefault(entry[field], len(field_codes))
+                    for entry in entries
+                ],
+                dtype=batch.codes["species"].dtype,
+            )
+            batch.set_codes(field, species_codes[codes], list(field_codes))
+        batch["spg"] = np.array([entry["spg"] for entry in entries], dtype=float)[codes]
+    return batch
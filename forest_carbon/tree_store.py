@@ -0,0 +1,346 @@
+"""
+A memory-mapped, on-disk store of preprocessed trees.
+
+Running many analyses against the same large inventory (with different `config`
+values, coefficient sets or spatial windows) would otherwise re-parse and re-preprocess
+its JSON every time. `build_tree_store` does that once and saves the resulting
+`TreeBatch` as a directory with one raw `.npy` file per column and a `meta.json`
+holding the labels and the layout. `open_tree_store` then maps the columns with
+`np.load(mmap_mode="r")`, so opening a store costs nothing however large it is, only
+the pages that are read are loaded, and the OS page cache is shared between the
+processes that read the same store.
+
+A store can be sliced by row range (`TreeStore.rows`) or, if it was built with a
+`tile_size`, by square spatial tile (`TreeStore.tile`, `TreeStore.window`): the trees
+are then saved sorted by tile, so every tile is a contiguous range of rows, and both
+kinds of slices are views of the mapped columns rather than copies.
+`TreeStore.input_rows` maps the stored rows back to the input order.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+from . import combined_agb_calculator, config
+from .instrumentation import metrics
+from .tree_batch import TreeBatch
+
+# Bump when the layout of the store changes
+STORE_VERSION = 1
+
+META_FILE = "meta.json"
+INPUT_ROWS_FILE = "input_rows.npy"
+
+
+def _column_file(name: str) -> str:
+    """The file of a column ("AGB value" has a space, so is renamed)."""
+    return name.replace(" ", "_") + ".npy"
+
+
+def _file_signature(path: str) -> list:
+    """The modification time and size of a file."""
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _file_hash(path: str) -> str:
+    """Hash the contents of a file."""
+    with open(path, "rb") as source:
+        return hashlib.sha256(source.read()).hexdigest()
+
+
+def is_tree_store(path: str) -> bool:
+    """Return True if the path is a tree store directory."""
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+
+def _check_store_path(store_path: str):
+    """Refuse to replace anything at a path other than a tree store."""
+    if os.path.lexists(store_path) and not is_tree_store(store_path):
+        raise FileExistsError(f"{store_path} exists and is not a tree store")
+
+
+class TreeStore:
+    """
+    A tree store opened with `open_tree_store`.
+
+    Attributes:
+        path (str): The store directory.
+        meta (dict): The contents of its `meta.json`.
+        batch (TreeBatch): All the trees, with columns mapped from the store's files.
+        input_rows (np.ndarray): The row of the input file each stored tree came from
+            (stored rows are sorted by tile if the store has tiles).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as meta_file:
+            self.meta = json.load(meta_file)
+        if self.meta.get("version") != STORE_VERSION:
+            raise ValueError(f"{path} is not a tree store of version {STORE_VERSION}")
+
+        def load(filename):
+            return np.load(os.path.join(path, filename), mmap_mode="r")
+
+        self.batch = TreeBatch(
+            {name: load(_column_file(name)) for name in self.meta["columns"]},
+            {name: load(_column_file(name)) for name in self.meta["labels"]},
+            self.meta["labels"],
+            {name: np.dtype(dtype) for name, dtype in self.meta["columns"].items()},
+        )
+        self.input_rows = load(INPUT_ROWS_FILE)
+        tiles = self.meta.get("tiles")
+        self._tiles = {
+            (tile_x, tile_y): (start, stop)
+            for tile_x, tile_y, start, stop in (tiles or [])
+        }
+
+    def __len__(self) -> int:
+        return len(self.batch)
+
+    @property
+    def tile_size(self) -> Optional[float]:
+        """The width of the spatial tiles, or None if the store has no tiles."""
+        return self.meta.get("tile_size")
+
+    @property
+    def tiles(self) -> list:
+        """The (tile_x, tile_y) index of each tile with trees, in storage order. Tile
+        (i, j) covers x in [i * tile_size, (i + 1) * tile_size) and likewise for y."""
+        return list(self._tiles)
+
+    def rows(self, start: int, stop: int) -> TreeBatch:
+        """The trees in a range of stored rows, as views of the mapped columns."""
+        return self.batch[start:stop]
+
+    def tile(self, tile_x: int, tile_y: int) -> TreeBatch:
+        """
+        The trees in a spatial tile, as views of the mapped columns.
+
+        Raises:
+            ValueError: If the store has no tiles.
+        """
+        start, stop = self._tile_range(tile_x, tile_y)
+        return self.batch[start:stop]
+
+    def _tile_range(self, tile_x: int, tile_y: int) -> Tuple[int, int]:
+        if self.tile_size is None:
+            raise ValueError("The store was built without a tile_size")
+        return self._tiles.get((tile_x, tile_y), (0, 0))
+
+    def iter_tiles(self) -> Iterator[Tuple[Tuple[int, int], TreeBatch]]:
+        """Iterate over the (tile index, trees) of each tile."""
+        for tile_x, tile_y in self.tiles:
+            yield (tile_x, tile_y), self.tile(tile_x, tile_y)
+
+    def window(
+        self, x_min: float, x_max: float, y_min: float, y_max: float
+    ) -> TreeBatch:
+        """
+        The trees with x_min <= x_pos < x_max and y_min <= y_pos < y_max.
+
+        Only the tiles that overlap the window are read; their trees are then
+        filtered by position, so unlike `rows` and `tile` the result is a copy.
+
+        Raises:
+            ValueError: If the store has no tiles.
+        """
+        if self.tile_size is None:
+            raise ValueError("The store was built without a tile_size")
+        first_x, first_y = np.floor(np.array([x_min, y_min]) / self.tile_size)
+        last_x, last_y = np.floor(np.array([x_max, y_max]) / self.tile_size)
+        ranges = [
+            (start, stop)
+            for (tile_x, tile_y), (start, stop) in self._tiles.items()
+            if first_x <= tile_x <= last_x and first_y <= tile_y <= last_y
+        ]
+        rows = np.concatenate(
+            [np.arange(start, stop) for start, stop in ranges]
+            or [np.empty(0, dtype=np.intp)]
+        )
+        x_pos, y_pos = self.batch["x_pos"][rows], self.batch["y_pos"][rows]
+        inside = (x_pos >= x_min) & (x_pos < x_max) & (y_pos >= y_min) & (y_pos < y_max)
+        return self.batch[rows[inside]]
+
+
+def open_tree_store(path: str) -> TreeStore:
+    """Open a tree store saved with `build_tree_store`."""
+    with metrics.stage("open_tree_store") as stage:
+        store = TreeStore(path)
+        stage.items = len(store)
+    return store
+
+
+def save_tree_store(
+    batch: TreeBatch,
+    store_path: str,
+    tile_size: Optional[float] = None,
+    source: Optional[dict] = None,
+) -> TreeStore:
+    """
+    Save a batch of trees as a tree store, replacing any store at the path.
+
+    Args:
+        batch (TreeBatch): The trees.
+        store_path (str): The directory to save the store to.
+        tile_size (float): If given, sort the trees into square tiles of this width
+            (using "x_pos" and "y_pos"), so that each tile can be read on its own.
+            Trees without a position are left out of the tiles, at the end.
+        source (dict): A description of the input, saved in the metadata.
+
+    Returns:
+        TreeStore: The saved store, opened.
+
+    Raises:
+        FileExistsError: If something other than a tree store is at the path.
+    """
+    _check_store_path(store_path)
+    order = np.arange(len(batch))
+    tiles = None
+    if tile_size is not None:
+        with np.errstate(invalid="ignore"):
+            tile_x = np.floor(batch["x_pos"] / tile_size)
+            tile_y = np.floor(batch["y_pos"] / tile_size)
+        placed = np.isfinite(tile_x) & np.isfinite(tile_y)
+        # Trees without a position sort last
+        order = np.lexsort((tile_x, tile_y, ~placed))
+        num_placed = int(placed.sum())
+        sorted_x = tile_x[order[:num_placed]].astype(np.int64)
+        sorted_y = tile_y[order[:num_placed]].astype(np.int64)
+        starts = np.flatnonzero(
+            np.r_[
+                num_placed > 0,
+                (sorted_x[1:] != sorted_x[:-1]) | (sorted_y[1:] != sorted_y[:-1]),
+            ]
+        )
+        stops = np.r_[starts[1:], num_placed]
+        tiles = [
+            [int(sorted_x[start]), int(sorted_y[start]), int(start), int(stop)]
+            for start, stop in zip(starts.tolist(), stops.tolist())
+        ]
+
+    meta = {
+        "version": STORE_VERSION,
+        "count": len(batch),
+        "columns": {name: column.dtype.str for name, column in batch.columns.items()},
+        "labels": {name: labels.tolist() for name, labels in batch.labels.items()},
+        "tile_size": tile_size,
+        "tiles": tiles,
+        "source": source,
+    }
+
+    # Write into a temporary directory, then move it into place. It is made with
+    # `os.mkdir`, which respects the umask, so that other users can share the store
+    # (`tempfile.mkdtemp` would make it private to its owner)
+    temp_path = f"{os.path.abspath(store_path)}.{uuid.uuid4().hex}.tmp"
+    os.mkdir(temp_path)
+    try:
+        for name, column in list(batch.columns.items()) + list(batch.codes.items()):
+            np.save(os.path.join(temp_path, _column_file(name)), column[order])
+        np.save(os.path.join(temp_path, INPUT_ROWS_FILE), order)
+        with open(os.path.join(temp_path, META_FILE), "w") as meta_file:
+            json.dump(meta, meta_file)
+        if is_tree_store(store_path):
+            shutil.rmtree(store_path)
+        os.replace(temp_path, store_path)
+    except BaseException:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise
+    return open_tree_store(store_path)
+
+
+def _source_description(input_data_path: str, preprocessing_species_info_path: str):
+    """Identify an input file and species table, to tell when a store is stale."""
+    return {
+        "path": os.path.abspath(input_data_path),
+        "signature": _file_signature(input_data_path),
+        "species_info": _file_hash(preprocessing_species_info_path),
+        "config": [config.RESOLVE_SPECIES_LABELS, config.SPECIES_ALIASES],
+    }
+
+
+def build_tree_store(
+    input_data_path: str,
+    store_path: str,
+    tile_size: Optional[float] = None,
+    preprocessing_species_info_path: Optional[str] = None,
+) -> TreeStore:
+    """
+    Load and preprocess a file of trees once, and save it as a tree store.
+
+    Args:
+        input_data_path (str): Path to a JSON, NDJSON, CSV, Parquet or Arrow file of
+            trees.
+        store_path (str): The directory to save the store to.
+        tile_size (float): As for `save_tree_store`.
+        preprocessing_species_info_path (str): Path to the species info CSV.
+            Defaults to `config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO`.
+
+    Returns:
+        TreeStore: The saved store, opened.
+
+    Raises:
+        FileExistsError: If something other than a tree store is at `store_path`.
+        KeyError: If a tree's species is not in the species database.
+    """
+    _check_store_path(store_path)
+    if preprocessing_species_info_path is None:
+        preprocessing_species_info_path = config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO
+    batch = combined_agb_calculator.load_tree_batch(
+        input_data_path, preprocessing_species_info_path
+    )
+    with metrics.stage("save_tree_store", len(batch)):
+        return save_tree_store(
+            batch,
+            store_path,
+            tile_size,
+            _source_description(input_data_path, preprocessing_species_info_path),
+        )
+
+
+def load_tree_store(
+    input_data_path: str,
+    store_path: Optional[str] = None,
+    tile_size: Optional[float] = None,
+) -> TreeStore:
+    """
+    Open the tree store of a file of trees, building it first if it is missing or
+    out of date.
+
+    A store is rebuilt when the input file or species table has changed since it was
+    built (by the input's modification time and size, and the table's contents), or
+    when it was built with a different `tile_size`.
+
+    Args:
+        input_data_path (str): Path to the file of trees.
+        store_path (str): The store directory. Defaults to the input path with
+            ".trees" appended.
+        tile_size (float): As for `save_tree_store`.
+
+    Returns:
+        TreeStore: The store, opened.
+    """
+    if store_path is None:
+        store_path = input_data_path + ".trees"
+    if is_tree_store(store_path):
+        try:
+            store = open_tree_store(store_path)
+        except ValueError:
+            store = None
+        if (
+            store is not None
+            and store.tile_size == tile_size
+            and store.meta["source"]
+            == _source_description(
+                input_data_path, config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO
+            )
+        ):
+            metrics.count("tree_store.hits")
+            return store
+    metrics.count("tree_store.builds")
+    return build_tree_store(input_data_path, store_path, tile_size)
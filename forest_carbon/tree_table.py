@@ -0,0 +1,100 @@
+"""
+Columnar input and output of tree inventories.
+
+Tree inventories can be read from and written to CSV, Parquet and Arrow (Feather)
+files, in addition to the JSON formats handled by `combined_agb_calculator` and
+`streaming`. Tables hold one tree per row, with the same fields as the JSON format as
+columns. Parquet and Arrow support requires the optional `pyarrow` package.
+"""
+
+import os
+from typing import TYPE_CHECKING
+
+from . import streaming
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# File formats for each supported columnar file extension
+COLUMNAR_FORMATS = {
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".arrow": "feather",
+    ".feather": "feather",
+}
+
+# Columns of the tables produced by `combined_agb_calculator` and their types
+TREE_COLUMNS = {
+    "dbh": "float64",
+    "group": "category",
+    "taxa": "category",
+    "x_pos": "float64",
+    "y_pos": "float64",
+    "height": "float64",
+    "spg": "float64",
+}
+AGB_COLUMN = "AGB value"
+
+
+def table_format(path: str):
+    """Return the columnar format of a file ("csv", "parquet" or "feather"), or None
+    if the path does not name a columnar file."""
+    return COLUMNAR_FORMATS.get(os.path.splitext(path)[1].lower())
+
+
+def is_columnar(path: str) -> bool:
+    """Return True if the path names a CSV, Parquet or Arrow file."""
+    return table_format(path) is not None
+
+
+def read_tree_table(data_path: str) -> "pd.DataFrame":
+    """
+    Read a table of trees from a file.
+
+    Args:
+        data_path (str): Path to a CSV, Parquet, Arrow, JSON or newline-delimited JSON
+            file. JSON files are read into a table with one column per tree field.
+
+    Returns:
+        pd.DataFrame: The trees, one per row.
+    """
+    import pandas as pd
+
+    file_format = table_format(data_path)
+    if file_format == "csv":
+        return pd.read_csv(data_path, float_precision="round_trip")
+    if file_format == "parquet":
+        return pd.read_parquet(data_path)
+    if file_format == "feather":
+        return pd.read_feather(data_path)
+    return pd.DataFrame.from_records(list(streaming.iter_trees(data_path)))
+
+
+def write_tree_table(trees: "pd.DataFrame", save_path: str):
+    """
+    Write a table of trees to a CSV, Parquet or Arrow file.
+
+    Args:
+        trees (pd.DataFrame): The trees, one per row.
+        save_path (str): Path of the file to write. The format is chosen by the file
+            extension.
+
+    Raises:
+        ValueError: If the extension is not a supported columnar format.
+    """
+    file_format = table_format(save_path)
+    if file_format == "csv":
+        trees.to_csv(save_path, index=False)
+    elif file_format == "parquet":
+        trees.to_parquet(save_path, index=False)
+    elif file_format == "feather":
+        trees.reset_index(drop=True).to_feather(save_path)
+    else:
+        raise ValueError(f"Unsupported table format: {save_path}")
+
+
+def tree_table_records(trees: "pd.DataFrame") -> list:
+    """Convert a table of trees to the list-of-dictionaries format, with missing
+    values as None."""
+    return trees.astype(object).where(trees.notna(), None).to_dict("records")
@@ -0,0 +1,100 @@
+"""
+Runtime type checking that can be switched off for the per-tree hot path.
+
+Functions decorated with `typechecked` are checked with beartype by default. In fast
+mode they run without any checks: callers that process many trees are expected to
+validate the whole batch once up front (e.g. with `validate_tree_records`) instead
+of paying for the checks on every call.
+
+Fast mode is off unless the `FOREST_CARBON_FAST_MODE` environment variable is set
+(see `config.TYPECHECK_FAST_MODE`); it can also be changed at runtime with
+`set_fast_mode` or the `fast_mode` context manager.
+"""
+
+import contextlib
+import functools
+from typing import Callable, Iterator, Mapping, Sequence
+
+from beartype import beartype
+
+from . import config
+
+_fast_mode = config.TYPECHECK_FAST_MODE
+
+# The fields of a preprocessed tree that the per-tree models check, and their types
+TREE_SCHEMA = {"group": str, "taxa": str, "dbh": float, "spg": float}
+
+
+def fast_mode_enabled() -> bool:
+    """Return True if type checks are currently skipped."""
+    return _fast_mode
+
+
+def set_fast_mode(enabled: bool):
+    """Skip (True) or run (False) the checks of `typechecked` functions."""
+    global _fast_mode
+    _fast_mode = bool(enabled)
+
+
+@contextlib.contextmanager
+def fast_mode(enabled: bool = True) -> Iterator[None]:
+    """Temporarily enable (or disable) fast mode."""
+    previous = _fast_mode
+    set_fast_mode(enabled)
+    try:
+        yield
+    finally:
+        set_fast_mode(previous)
+
+
+def typechecked(function: Callable) -> Callable:
+    """
+    Decorate a function with beartype checks that are skipped in fast mode.
+
+    The unchecked function is available as `__wrapped__` and the checked one as
+    `checked`.
+    """
+    checked = beartype(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _fast_mode:
+            return function(*args, **kwargs)
+        return checked(*args, **kwargs)
+
+    wrapper.checked = checked
+    return wrapper
+
+
+def validate_tree_records(
+    trees: Sequence[dict], schema: Mapping[str, type] = TREE_SCHEMA
+):
+    """
+    Check the fields of a whole batch of tree dictionaries at once.
+
+    Args:
+        trees (list): The preprocessed trees.
+        schema (dict): The type that each field must be an instance of.
+
+    Raises:
+        KeyError: If a tree is missing one of the fields.
+        TypeError: If a field of a tree has the wrong type.
+    """
+    for name, expected in schema.items():
+        try:
+            values = [tree[name] for tree in trees]
+        except KeyError:
+            index = next(i for i, tree in enumerate(trees) if name not in tree)
+            raise KeyError(f"Tree {index} has no {name!r} field") from None
+
+        # Checking the distinct types is much cheaper than checking every value
+        if all(issubclass(kind, expected) for kind in set(map(type, values))):
+            continue
+        index, value = next(
+            (i, value)
+            for i, value in enumerate(values)
+            if not isinstance(value, expected)
+        )
+        raise TypeError(
+            f"Tree {index} has {name}={value!r}, expected {expected.__name__}"
+        )
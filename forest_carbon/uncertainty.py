@@ -0,0 +1,269 @@
+"""
+Monte Carlo propagation of model and measurement error through the AGB models.
+
+`apply_model` returns one estimate per tree. `estimate_uncertainty` instead draws
+`num_samples` plausible AGB values for every tree, as a (samples x trees) array, and
+summarizes them as per-tree and per-plot intervals. Each sample perturbs:
+
+- the measurements: dbh and spg are multiplied by log-normal noise with relative
+  standard deviations of about `config.DBH_RELATIVE_ERROR` and
+  `config.SPG_RELATIVE_ERROR`. A perturbed spg can cross into the neighboring spg bin
+  of a taxa (e.g. from "Abies < 0.35 spg" to "Abies >= 0.35 spg"), and then uses that
+  bin's model,
+- the model parameters: the intercept of each model is shifted by its standard error,
+  sigma / sqrt(n). The shift is shared by all the trees that use the model in a
+  sample, so unlike the residuals it does not average out over a plot, and
+- the residual of each tree, with the model's residual standard error sigma.
+
+Errors are on the log scale, where the models are fitted. For the taxa-level models,
+sigma is derived from the fit statistics in the parameter table: since R^2 is the
+share of the variance of ln(AGB) explained by b1 * ln(D), sigma^2 = (1 - R^2) / R^2 *
+b1^2 * Var(ln D), taking the diameters of the fitting data to be spread evenly over
+the model's diameter range. For the generic models, sigma is set in the config.
+
+The samples are drawn a chunk of trees at a time, with at most
+`config.UNCERTAINTY_CHUNK_ELEMENTS` values in memory; only the per-plot totals of
+each sample are kept between chunks. Samples are centered on the point estimates on
+the log scale, so each tree's median is close to its `apply_model` estimate, and its
+mean is higher.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+from . import combined_agb_calculator, config, reference_tables
+from .instrumentation import metrics
+from .taxa_index import TaxaModelIndex
+
+
+def _log_diameter_variance(lower: np.ndarray, upper: np.ndarray) -> np.ndarray:
+    """Var(ln D) for D uniformly distributed between `lower` and `upper`."""
+    width = upper - lower
+    mean = (upper * np.log(upper) - upper - lower * np.log(lower) + lower) / width
+
+    def second_moment(d):
+        return d * (np.log(d) ** 2 - 2 * np.log(d) + 2)
+
+    return (second_moment(upper) - second_moment(lower)) / width - mean**2
+
+
+def model_residual_errors(df: TaxaModelIndex) -> np.ndarray:
+    """
+    The residual standard errors of the AGB models, on the log scale.
+
+    Args:
+        df (TaxaModelIndex): The taxa-level model index.
+
+    Returns:
+        np.ndarray: The residual standard error of each row of the index, followed by
+            those of the generic height and no-height models. Rows without a diameter
+            range or R^2 get `config.TAXA_MODEL_RSE`.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        variance = (
+            (1 - df.rsquared)
+            / df.rsquared
+            * df.b1**2
+            * _log_diameter_variance(df.diameter_min, df.diameter_max)
+        )
+    rse = np.where(np.isfinite(variance), np.sqrt(variance), config.TAXA_MODEL_RSE)
+    return np.concatenate([rse, [config.HEIGHT_MODEL_RSE, config.NO_HEIGHT_MODEL_RSE]])
+
+
+def model_parameter_errors(df: TaxaModelIndex, residual_errors: np.ndarray):
+    """
+    The standard errors of the intercepts of the AGB models, on the log scale.
+
+    Args:
+        df (TaxaModelIndex): The taxa-level model index.
+        residual_errors (np.ndarray): As returned by `model_residual_errors`.
+
+    Returns:
+        np.ndarray: The standard error of each model, in the same order as
+            `residual_errors`. Models fitted to an unknown number of observations are
+            given none.
+    """
+    observations = np.concatenate(
+        [df.num_observations, [config.GENERIC_MODEL_OBSERVATIONS] * 2]
+    )
+    return np.nan_to_num(residual_errors / np.sqrt(observations))
+
+
+def _sample_chunk(
+    columns: dict,
+    df: TaxaModelIndex,
+    residual_errors: np.ndarray,
+    parameter_shifts: np.ndarray,
+    rng: np.random.Generator,
+    model_height,
+    model_no_height,
+) -> np.ndarray:
+    """Draw the AGB samples, with shape (samples, trees), for a chunk of trees."""
+    num_samples = len(parameter_shifts)
+    shape = (num_samples, len(columns["dbh"]))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_dbh = np.log(columns["dbh"]) + rng.normal(
+            0.0, config.DBH_RELATIVE_ERROR, shape
+        )
+    spg = columns["spg"] * np.exp(rng.normal(0.0, config.SPG_RELATIVE_ERROR, shape))
+    height = columns["height"]
+    if height is None:
+        height = np.full(shape[1], np.nan)
+
+    # Whether a taxa-level model matches depends only on the group and taxa, but
+    # which spg bin's model is used depends on each sample's spg
+    rows = df.lookup_rows(columns["group"], columns["taxa"], spg)
+    species_mask = rows[0] >= 0
+    has_height = ~np.isnan(height) & (height != 0)
+    height_mask = ~species_mask & has_height
+    no_height_mask = ~species_mask & ~has_height
+
+    # The model of each sample of each tree, with the generic models after the rows
+    models = rows
+    models[:, height_mask] = len(df)
+    models[:, no_height_mask] = len(df) + 1
+
+    log_agb = np.empty(shape)
+    if species_mask.any():
+        species_rows = models[:, species_mask]
+        if not np.isin(
+            df.diameter_class[np.unique(species_rows)], ("dbh", "drc")
+        ).all():
+            raise ValueError
+        # ln(AGB) = b0 + b1 * ln(D), where a root collar diameter is first converted
+        # to a dbh with ln(D) = 0.36738 + 0.94932 * ln(drc)
+        drc = df.diameter_class == "drc"
+        intercept = df.b0 + np.where(drc, df.b1 * 0.36738, 0.0)
+        slope = df.b1 * np.where(drc, 0.94932, 1.0)
+        log_agb[:, species_mask] = (
+            intercept[species_rows] + slope[species_rows] * log_dbh[:, species_mask]
+        )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if height_mask.any():
+            log_agb[:, height_mask] = np.log(
+                model_height(
+                    spg[:, height_mask],
+                    np.exp(log_dbh[:, height_mask]),
+                    height[height_mask],
+                )
+            )
+        if no_height_mask.any():
+            log_agb[:, no_height_mask] = np.log(
+                model_no_height(
+                    spg[:, no_height_mask], np.exp(log_dbh[:, no_height_mask]), config.E
+                )
+            )
+
+    log_agb += np.take_along_axis(parameter_shifts, models, axis=1)
+    log_agb += residual_errors[models] * rng.standard_normal(shape)
+    return np.exp(log_agb)
+
+
+def estimate_uncertainty(
+    trees,
+    path_to_taxa_level_parameters: str = config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS,
+    num_samples: Optional[int] = None,
+    seed: Optional[int] = None,
+    interval: float = 0.95,
+    plot: Optional[str] = None,
+) -> dict:
+    """
+    Estimate the AGB of each tree and plot with Monte Carlo confidence intervals.
+
+    Args:
+        trees: Preprocessed trees (with "group", "taxa", "dbh", "spg" and optionally
+            "height"), as a list of dictionaries, a DataFrame, or a mapping from
+            column name to array.
+        path_to_taxa_level_parameters (str): Path to the taxa-level parameters.
+        num_samples (int): The number of samples per tree. Defaults to
+            `config.UNCERTAINTY_SAMPLES`.
+        seed (int): The random seed. Defaults to `config.UNCERTAINTY_SEED`; the
+            same seed gives the same results.
+        interval (float): The probability covered by the "lower" to "upper"
+            interval.
+        plot (str): A column holding the plot of each tree. By default all the
+            trees form one plot.
+
+    Returns:
+        dict: "trees" and "plots", each a dictionary of arrays with the "median",
+            "mean", "std", "lower" and "upper" AGB of each tree or plot (plot AGB is
+            the total of its trees, leaving out trees without an estimate). "plots"
+            also has the "labels" of the plots.
+    """
+    if num_samples is None:
+        num_samples = config.UNCERTAINTY_SAMPLES
+    if seed is None:
+        seed = config.UNCERTAINTY_SEED
+    if not 0 < interval < 1:
+        raise ValueError("interval must be between 0 and 1")
+    quantiles = [(1 - interval) / 2, 0.5, (1 + interval) / 2]
+
+    columns = combined_agb_calculator._tree_columns(trees)
+    num_trees = len(columns["dbh"])
+    if plot is None:
+        labels, plot_codes = ["all"], np.zeros(num_trees, dtype=np.intp)
+    else:
+        plot_labels = (
+            [tree[plot] for tree in trees] if isinstance(trees, list) else trees[plot]
+        )
+        labels, plot_codes = np.unique(np.asarray(plot_labels), return_inverse=True)
+        labels, plot_codes = labels.tolist(), plot_codes.reshape(-1)
+
+    df = reference_tables.load_taxa_model_index(path_to_taxa_level_parameters)
+    model_height, model_no_height = combined_agb_calculator._create_fallback_models()
+    residual_errors = model_residual_errors(df)
+    rng = np.random.default_rng(seed)
+    # The parameter shifts are drawn once, so that they are shared across chunks
+    parameter_shifts = model_parameter_errors(df, residual_errors) * (
+        rng.standard_normal((num_samples, len(residual_errors)))
+    )
+
+    tree_stats = {
+        name: np.empty(num_trees)
+        for name in ("median", "mean", "std", "lower", "upper")
+    }
+    plot_totals = np.zeros((num_samples, len(labels)))
+    sample_offsets = (np.arange(num_samples) * len(labels))[:, None]
+    chunk_size = max(1, config.UNCERTAINTY_CHUNK_ELEMENTS // num_samples)
+
+    with metrics.stage("uncertainty", num_trees):
+        for start in range(0, num_trees, chunk_size):
+            chunk = slice(start, start + chunk_size)
+            samples = _sample_chunk(
+                {
+                    name: None if column is None else column[chunk]
+                    for name, column in columns.items()
+                },
+                df,
+                residual_errors,
+                parameter_shifts,
+                rng,
+                model_height,
+                model_no_height,
+            )
+            lower, median, upper = np.quantile(samples, quantiles, axis=0)
+            tree_stats["lower"][chunk] = lower
+            tree_stats["median"][chunk] = median
+            tree_stats["upper"][chunk] = upper
+            tree_stats["mean"][chunk] = samples.mean(axis=0)
+            tree_stats["std"][chunk] = samples.std(axis=0)
+
+            # Add each sample's trees to its plot totals in one bincount
+            cells = sample_offsets + plot_codes[chunk]
+            plot_totals += np.bincount(
+                cells.ravel(),
+                np.nan_to_num(samples).ravel(),
+                plot_totals.size,
+            ).reshape(plot_totals.shape)
+
+    lower, median, upper = np.quantile(plot_totals, quantiles, axis=0)
+    plot_stats = {
+        "labels": labels,
+        "median": median,
+        "mean": plot_totals.mean(axis=0),
+        "std": plot_totals.std(axis=0),
+        "lower": lower,
+        "upper": upper,
+    }
+    return {"trees": tree_stats, "plots": plot_stats}
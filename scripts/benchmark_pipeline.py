@@ -0,0 +1,396 @@
+"""
+A benchmark suite for the AGB pipeline, timing each stage separately at increasing
+numbers of trees.
+
+Synthetic inventories are generated with `scripts/generate_test_data.py` (and kept
+in `--data-dir`, so they are only generated once per scale, species mix and seed). At each scale,
+the stages of the JSON pipeline are run in order:
+
+- `json_load`: parse the JSON file of trees
+- `preprocess`: add the species information to each tree
+- `table_load`: build the species database and taxa-level model index from their
+  CSV files (without the reference table cache)
+- `model_lookup`: find the taxa-level model of each tree
+- `agb_evaluation`: evaluate the biomass equations
+- `serialization`: write the trees with their AGB values as JSON
+
+Each stage is timed (best of `--repeat` runs) and then run once more under
+`tracemalloc` to record its peak memory use. The report is saved as JSON, and can be
+compared against an earlier report to catch regressions:
+
+    poetry run python scripts/benchmark_pipeline.py --scales 1000 10000 100000
+    poetry run python scripts/benchmark_pipeline.py -o new.json --compare old.json
+
+The script exits with status 1 if any stage is slower than in the compared report
+by more than `--threshold`.
+"""
+
+import argparse
+import copy
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from forest_carbon import (
+    agb_biomass,
+    combined_agb_calculator,
+    config,
+    streaming,
+    tree_preprocessing,
+)
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from generate_test_data import iter_tree_blocks, species_mix, write_trees  # noqa: E402
+
+STAGES = [
+    "json_load",
+    "preprocess",
+    "table_load",
+    "model_lookup",
+    "agb_evaluation",
+    "serialization",
+]
+
+DEFAULT_SCALES = [1000, 10000, 100000]
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), "forest_carbon_benchmark")
+
+
+def inventory_path(
+    num_trees: int, data_dir: str, seed: int = 0, species: str = "all"
+) -> str:
+    """
+    Return the path to a synthetic inventory of `num_trees` trees, generating it
+    first if it doesn't exist.
+
+    Args:
+        num_trees: the number of trees
+        data_dir: the directory in which inventories are kept
+        seed: the random seed used to generate the trees
+        species: the species mix, "example" or "all" (see `species_mix`)
+
+    Returns:
+        the path to a JSON file of trees
+    """
+    path = os.path.join(data_dir, f"{num_trees}_trees_{species}_seed{seed}.json")
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        # Plots hold about one tree per 25 square meters
+        blocks = iter_tree_blocks(
+            num_trees,
+            seed=seed,
+            width=(num_trees * 25) ** 0.5,
+            species=species_mix(species),
+        )
+        temp_path = path + ".tmp.json"
+        write_trees(temp_path, blocks)
+        os.replace(temp_path, path)
+    return path
+
+
+def _measure(run: Callable[[], object], repeat: int) -> dict:
+    """Time `run` (best of `repeat`) and record its peak memory use."""
+    seconds = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": seconds, "peak_bytes": peak}
+
+
+def benchmark_scale(data_path: str, repeat: int = 5) -> Dict[str, dict]:
+    """
+    Run each stage of the pipeline on the trees in `data_path`.
+
+    Each stage works on the output of the previous one, which is computed once
+    outside of the measurements.
+
+    Args:
+        data_path: path to a JSON file of trees
+        repeat: the number of times to run each stage; the best time is reported
+
+    Returns:
+        a dictionary with the seconds, microseconds per tree and peak memory (bytes) of
+        each stage
+    """
+    species_path = config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO
+    parameters_path = config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS
+
+    def json_load():
+        with open(data_path) as f:
+            return json.load(f)["trees"]
+
+    def table_load():
+        return (
+            tree_preprocessing.create_common_name_dictionary(species_path),
+            agb_biomass.load_taxa_model_index(parameters_path),
+        )
+
+    trees = json_load()
+    database, index = table_load()
+
+    def preprocess():
+        preprocessed = tree_preprocessing.preprocess_tree_entries(
+            copy.copy(trees), database
+        )
+        return combined_agb_calculator._tree_records(preprocessed)
+
+    records = preprocess()
+    columns = combined_agb_calculator._tree_columns(records)
+    height = np.full(len(records), np.nan)
+    model_height, model_no_height = combined_agb_calculator._create_fallback_models()
+
+    def model_lookup():
+        return index.lookup_rows(columns["group"], columns["taxa"], columns["spg"])
+
+    rows = model_lookup()
+
+    def agb_evaluation():
+        return combined_agb_calculator._evaluate_model_rows(
+            rows,
+            columns["dbh"],
+            columns["spg"],
+            height,
+            index,
+            model_height,
+            model_no_height,
+        )
+
+    for tree, value in zip(records, agb_evaluation().tolist()):
+        tree["AGB value"] = value
+
+    fd, output_path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+
+    def serialization():
+        with streaming.JsonTreeWriter(output_path) as writer:
+            writer.write_many(records)
+
+    stages = {
+        "json_load": json_load,
+        "preprocess": preprocess,
+        "table_load": table_load,
+        "model_lookup": model_lookup,
+        "agb_evaluation": agb_evaluation,
+        "serialization": serialization,
+    }
+    try:
+        results = {name: _measure(stages[name], repeat) for name in STAGES}
+    finally:
+        os.remove(output_path)
+
+    for result in results.values():
+        result["us_per_tree"] = result["seconds"] / len(trees) * 1e6
+    return results
+
+
+def _max_rss_bytes() -> int:
+    """The high-water mark of this process's resident memory."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def _git_commit() -> Optional[str]:
+    """The commit of the checked out repository, if available."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    scales: List[int],
+    data_dir: str,
+    seed: int = 0,
+    repeat: int = 5,
+    species: str = "all",
+) -> dict:
+    """
+    Benchmark every stage of the pipeline at each scale.
+
+    Args:
+        scales: the numbers of trees to benchmark
+        data_dir: the directory in which the synthetic inventories are kept
+        seed: the random seed used to generate the inventories
+        repeat: the number of times to run each stage; the best time is reported
+        species: the species mix of the inventories, "example" or "all"
+
+    Returns:
+        the report, with the environment and the results per scale
+    """
+    import pandas as pd
+
+    report = {
+        "metadata": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "seed": seed,
+            "species": species,
+            "repeat": repeat,
+        },
+        "results": {},
+    }
+    for num_trees in scales:
+        data_path = inventory_path(num_trees, data_dir, seed, species)
+        results = benchmark_scale(data_path, repeat)
+        report["results"][str(num_trees)] = {
+            "stages": results,
+            "max_rss_bytes": _max_rss_bytes(),
+        }
+    return report
+
+
+def compare_reports(report: dict, baseline: dict, threshold: float = 1.2) -> list:
+    """
+    Find the stages that are slower than in a baseline report.
+
+    Args:
+        report: the new report
+        baseline: the report to compare against
+        threshold: the slowdown (ratio of times) above which a stage regressed
+
+    Returns:
+        a list of (scale, stage, ratio) for each regressed stage
+    """
+    regressions = []
+    for scale, result in report["results"].items():
+        baseline_result = baseline["results"].get(scale)
+        if baseline_result is None:
+            continue
+        for stage, timing in result["stages"].items():
+            baseline_timing = baseline_result["stages"].get(stage)
+            if baseline_timing is None or baseline_timing["seconds"] <= 0:
+                continue
+            ratio = timing["seconds"] / baseline_timing["seconds"]
+            if ratio > threshold:
+                regressions.append((scale, stage, ratio))
+    return regressions
+
+
+def format_report(report: dict, baseline: Optional[dict] = None) -> str:
+    """Format a report as a table, with the change from `baseline` if given."""
+    lines = [
+        f"{'trees':>10} {'stage':<15} {'seconds':>10} {'us/tree':>9} "
+        f"{'peak MiB':>9}" + (f" {'vs base':>8}" if baseline else "")
+    ]
+    for scale, result in report["results"].items():
+        for stage, timing in result["stages"].items():
+            line = (
+                f"{int(scale):>10,} {stage:<15} {timing['seconds']:>10.4f} "
+                f"{timing['us_per_tree']:>9.3f} {timing['peak_bytes'] / 2**20:>9.1f}"
+            )
+            if baseline:
+                base = baseline["results"].get(scale, {}).get("stages", {}).get(stage)
+                line += (
+                    f" {timing['seconds'] / base['seconds']:>7.2f}x"
+                    if base and base["seconds"] > 0
+                    else f" {'-':>8}"
+                )
+            lines.append(line)
+        lines.append(
+            f"{int(scale):>10,} {'max RSS':<15} {'':>10} {'':>9} "
+            f"{result['max_rss_bytes'] / 2**20:>9.1f}"
+        )
+    return "\n".join(lines)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark each stage of the AGB pipeline at increasing scales."
+    )
+    parser.add_argument(
+        "--scales",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SCALES,
+        help="Numbers of trees to benchmark (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="Runs per stage; the best time is reported (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed for the synthetic inventories."
+    )
+    parser.add_argument(
+        "--species",
+        choices=["example", "all"],
+        default="all",
+        help="Sample the example species, or every species in "
+        "tree_species_info.csv (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--data-dir",
+        default=DEFAULT_DATA_DIR,
+        help="Directory for the synthetic inventories (default: %(default)s).",
+    )
+    parser.add_argument("-o", "--output", help="Save the report to this JSON file.")
+    parser.add_argument(
+        "--compare", help="A report to compare against, saved by an earlier run."
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.2,
+        help="Slowdown that counts as a regression (default: %(default)s).",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    report = run_benchmarks(
+        args.scales, args.data_dir, args.seed, args.repeat, args.species
+    )
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print(format_report(report, baseline))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare_reports(report, baseline, args.threshold)
+        for scale, stage, ratio in regressions:
+            print(f"Regression: {stage} at {int(scale):,} trees is {ratio:.2f}x slower")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""
+A script for measuring the cost of the runtime type checks on the per-tree path.
+
+Runs `combined_agb_calculator.apply_model` (one tree at a time) on an example file
+with the checks enabled and in fast mode, and reports the best time of each.
+
+    poetry run python scripts/benchmark_typecheck.py [example_data/1000_trees.json]
+"""
+
+import copy
+import sys
+import timeit
+
+from forest_carbon import combined_agb_calculator, config, typecheck
+
+
+def benchmark(data_path: str, repeat: int = 50) -> dict:
+    """
+    Time `apply_model` on the trees in `data_path` with and without type checks.
+
+    Args:
+        data_path: path to a JSON file of trees
+        repeat: the number of times to run each mode; the best time is reported
+
+    Returns:
+        a dictionary with the number of trees and the best time (seconds) per mode
+    """
+    trees = combined_agb_calculator.load_tree_data_from_json(
+        data_path, config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO
+    )
+    results = {"trees": len(trees)}
+    for name, fast in [("checked", False), ("fast", True)]:
+        with typecheck.fast_mode(fast):
+            results[name] = min(
+                timeit.repeat(
+                    lambda: combined_agb_calculator.apply_model(
+                        copy.copy(trees),
+                        config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS,
+                    ),
+                    number=1,
+                    repeat=repeat,
+                )
+            )
+    return results
+
+
+if __name__ == "__main__":
+    data_path = sys.argv[1] if len(sys.argv) > 1 else "example_data/1000_trees.json"
+    results = benchmark(data_path)
+    for name in ["checked", "fast"]:
+        seconds = results[name]
+        print(
+            f"{name:>8}: {seconds * 1e3:8.2f} ms "
+            f"({results['trees'] / seconds:,.0f} trees/s)"
+        )
+    print(f" speedup: {results['checked'] / results['fast']:.2f}x")
@@ -3,9 +3,21 @@ A script for generating random example data in the R88 format.
 
 Generates trees that have different species and diameters, but adds some spatial
 structure so that they can be used as test cases for mapping algorithms.
+
+`generate_tree_examples` builds trees one at a time and is kept for the small
+examples. For load testing, `iter_tree_blocks` generates whole blocks of trees with
+a NumPy `Generator`, and `write_trees` streams them to JSON, NDJSON, CSV or Parquet
+(which needs `pyarrow`, from the `columnar` extra):
+
+    python scripts/generate_test_data.py 100000000 -o trees.parquet --seed 1 \
+        --species all --width 10000
 """
+import argparse
+import csv
 import json
+import os
 import random
+from typing import Dict, Iterator, List, Optional
 
 import numpy as np
 
@@ -18,6 +30,26 @@ TREE_SPECIES_MEAN_DBH = {
     "Pine, lodgepole": 0.24,
 }
 
+# Mean DBH (meters) of species without a mean in TREE_SPECIES_MEAN_DBH
+DEFAULT_MEAN_DBH = 0.23
+
+PATH_TO_SPECIES_INFO = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "forest_carbon",
+    "data",
+    "tree_species_info.csv",
+)
+
+# File extensions that `write_trees` can write, and their formats
+OUTPUT_FORMATS = {
+    ".json": "json",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+    ".csv": "csv",
+    ".parquet": "parquet",
+}
+
 
 def random_tree_diameter(
     species: str, x_pos: float, y_pos: float, width: float = 12
@@ -107,13 +139,232 @@ def generate_tree_examples(num_examples: int, width: float = 12):
     return [generate_tree_example(width) for _ in range(num_examples)]
 
 
-if __name__ == "__main__":
-    # Generate some examples and save to a file
-    num_examples = 1000
-    trees = generate_tree_examples(num_examples)
+def species_mix(
+    source: str = "example", species_info_path: str = PATH_TO_SPECIES_INFO
+) -> Dict[str, float]:
+    """
+    Return the species to sample, with the mean DBH (meters) of each.
+
+    Args:
+        source: "example" for the species in TREE_SPECIES_MEAN_DBH, or "all" for
+            every species in the species information CSV file (species without a
+            mean in TREE_SPECIES_MEAN_DBH use DEFAULT_MEAN_DBH)
+        species_info_path: path to the species information CSV file
+
+    Returns:
+        a dictionary from common name to mean DBH
+
+    Raises:
+        ValueError if `source` is not "example" or "all"
+    """
+    if source == "example":
+        return dict(TREE_SPECIES_MEAN_DBH)
+    if source != "all":
+        raise ValueError(f"Unknown species source: {source!r}")
+
+    with open(species_info_path, newline="") as f:
+        names = dict.fromkeys(row["Common name"] for row in csv.DictReader(f))
+    return {name: TREE_SPECIES_MEAN_DBH.get(name, DEFAULT_MEAN_DBH) for name in names}
+
+
+def random_tree_diameters(
+    rng: np.random.Generator,
+    mean_dbh: np.ndarray,
+    x_pos: np.ndarray,
+    y_pos: np.ndarray,
+    width: float = 12,
+) -> np.ndarray:
+    """
+    Samples random tree diameters for arrays of trees.
+
+    This is the vectorized counterpart of `random_tree_diameter`, with the same
+    distribution.
+
+    Args:
+        rng: the random number generator
+        mean_dbh: the mean DBH of each tree's species
+        x_pos: the x position (meters) of each tree
+        y_pos: the y position (meters) of each tree
+        width: the width and height of the plot
+
+    Returns:
+        an array of DBH measurements (meters)
+    """
+    x = (x_pos - width / 2.0) / width * 12
+    y = (y_pos - width / 2.0) / width * 12
+    himmelblau_value = (x**2 + y - 11) ** 2 + (x + y**2 - 7) ** 2
+    dbh_scale_factor = 1.8 - 1 / (1 + np.exp(-himmelblau_value / 100))
+    return rng.normal(mean_dbh * dbh_scale_factor, 0.1 * mean_dbh)
 
-    data = {"trees": trees}
-    json_data = json.dumps(data, indent=2)
 
-    with open(f"example_data/{num_examples}_trees.json", "w") as f:
-        f.write(json_data)
+def iter_tree_blocks(
+    num_trees: int,
+    seed: Optional[int] = None,
+    width: float = 12,
+    species: Optional[Dict[str, float]] = None,
+    weights: Optional[List[float]] = None,
+    block_size: int = 1_000_000,
+) -> Iterator[Dict[str, np.ndarray]]:
+    """Generate random trees in blocks of columns.
+
+    The trees are the same for the same seed and block size.
+
+    Args:
+        num_trees: the number of trees to generate
+        seed: the seed of the random number generator
+        width: the width and height of the plot (meters)
+        species: the species to sample, with the mean DBH of each, as returned by
+            `species_mix` (default: the example species)
+        weights: the relative frequency of each species (default: equal)
+        block_size: the maximum number of trees per block
+
+    Yields:
+        dictionaries with "dbh", "species", "x_pos" and "y_pos" arrays
+    """
+    if species is None:
+        species = species_mix()
+    names = np.array(list(species), dtype=object)
+    mean_dbh = np.array(list(species.values()), dtype=float)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)
+        weights = weights / weights.sum()
+
+    rng = np.random.default_rng(seed)
+    for start in range(0, num_trees, block_size):
+        size = min(block_size, num_trees - start)
+        x_pos = rng.uniform(0, width, size)
+        y_pos = rng.uniform(0, width, size)
+        codes = rng.choice(len(names), size=size, p=weights)
+        dbh = random_tree_diameters(rng, mean_dbh[codes], x_pos, y_pos, width)
+        yield {"dbh": dbh, "species": names[codes], "x_pos": x_pos, "y_pos": y_pos}
+
+
+def _csv_name(name: str) -> str:
+    """Quote a species name for a CSV file, if needed."""
+    if any(char in name for char in ',"\n'):
+        return '"' + name.replace('"', '""') + '"'
+    return name
+
+
+def _format_records(block: Dict[str, np.ndarray], output_format: str) -> List[str]:
+    """Format a block of trees as JSON objects or CSV rows, one string per tree.
+
+    JSON objects are the same as `json.dumps` gives for each tree. Each species name
+    is only encoded once.
+    """
+    encode = json.dumps if output_format in ("json", "ndjson") else _csv_name
+    names = {name: encode(name) for name in dict.fromkeys(block["species"])}
+    columns = zip(
+        block["dbh"].tolist(),
+        block["species"].tolist(),
+        block["x_pos"].tolist(),
+        block["y_pos"].tolist(),
+    )
+    if output_format == "csv":
+        return [f"{d!r},{names[n]},{x!r},{y!r}" for d, n, x, y in columns]
+    return [
+        f'{{"dbh": {d!r}, "species": {names[n]}, "x_pos": {x!r}, "y_pos": {y!r}}}'
+        for d, n, x, y in columns
+    ]
+
+
+def write_trees(path: str, blocks: Iterator[Dict[str, np.ndarray]]) -> int:
+    """Stream blocks of trees to a file, one block at a time.
+
+    Args:
+        path: the output path; the format (JSON, NDJSON, CSV or Parquet) is chosen
+            by its extension. JSON files hold a {"trees": [...]} document.
+        blocks: the blocks of trees, e.g. from `iter_tree_blocks`
+
+    Returns:
+        the number of trees written
+
+    Raises:
+        ValueError if the extension of `path` is not in OUTPUT_FORMATS
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {path}")
+    output_format = OUTPUT_FORMATS[extension]
+
+    if output_format == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        count = 0
+        writer = None
+        try:
+            for block in blocks:
+                table = pa.table(block)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+                count += table.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+        return count
+
+    count = 0
+    with open(path, "w", newline="") as f:
+        if output_format == "json":
+            f.write('{"trees": [')
+        elif output_format == "csv":
+            f.write("dbh,species,x_pos,y_pos\n")
+        for block in blocks:
+            records = _format_records(block, output_format)
+            if output_format == "json":
+                f.write((", " if count else "") + ", ".join(records))
+            else:
+                f.writelines(record + "\n" for record in records)
+            count += len(records)
+        if output_format == "json":
+            f.write("]}")
+    return count
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generate random example trees.")
+    parser.add_argument(
+        "num_trees", type=int, nargs="?", default=1000, help="Number of trees."
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Output file; the format is chosen by its extension (.json, .ndjson, "
+        ".jsonl, .csv or .parquet). Default: example_data/<num_trees>_trees.json.",
+    )
+    parser.add_argument("--seed", type=int, help="Seed for reproducible output.")
+    parser.add_argument(
+        "--width",
+        type=float,
+        default=12,
+        help="Width and height of the plot in meters (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--species",
+        choices=["example", "all"],
+        default="example",
+        help="Sample the example species, or every species in "
+        "tree_species_info.csv (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=1_000_000,
+        help="Trees generated and written at a time (default: %(default)s).",
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    output = args.output or f"example_data/{args.num_trees}_trees.json"
+    blocks = iter_tree_blocks(
+        args.num_trees,
+        seed=args.seed,
+        width=args.width,
+        species=species_mix(args.species),
+        block_size=args.chunk_size,
+    )
+    write_trees(output, blocks)
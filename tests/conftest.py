@@ -0,0 +1,14 @@
+import pytest
+
+from forest_carbon import config
+
+
+@pytest.fixture(scope="session", autouse=True)
+def reference_table_cache(tmp_path_factory):
+    """Keep the reference table caches of the test run out of the user's real cache
+    directory, including in subprocesses and worker processes."""
+    cache_dir = str(tmp_path_factory.mktemp("cache"))
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("FOREST_CARBON_CACHE_DIR", cache_dir)
+        monkeypatch.setattr(config, "REFERENCE_TABLE_CACHE_DIR", cache_dir)
+        yield cache_dir
@@ -0,0 +1,152 @@
+import contextlib
+import functools
+import io
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from unittest.mock import patch
+
+from forest_carbon import batch_runner, combined_agb_calculator, config, parallel
+from forest_carbon.__main__ import main
+
+example_data = os.path.join(os.path.dirname(__file__), "..", "example_data")
+
+
+class TestBatchRunner(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+
+    def test_outputs_match_run_model(self):
+        pairs = []
+        for i in range(6):
+            name = "10_trees.json" if i % 2 else "100_trees.json"
+            extension = ".ndjson" if i % 3 == 0 else ".json"
+            pairs.append(
+                (
+                    os.path.join(example_data, name),
+                    os.path.join(self.test_dir, f"plot_{i}{extension}"),
+                )
+            )
+        results = batch_runner.run_files(pairs, workers=2, max_pending=3)
+
+        self.assertEqual(
+            [result["output"] for result in results], [p for _, p in pairs]
+        )
+        for (input_path, output_path), result in zip(pairs, results):
+            self.assertIsNone(result["error"])
+            expected_path = os.path.join(self.test_dir, "expected" + output_path[-7:])
+            num_trees = combined_agb_calculator.run_model(input_path, expected_path)
+            self.assertEqual(result["trees"], num_trees)
+            with open(expected_path) as expected, open(output_path) as output:
+                self.assertEqual(output.read(), expected.read())
+            # Outputs get the same permissions as run_model's
+            self.assertEqual(
+                os.stat(output_path).st_mode, os.stat(expected_path).st_mode
+            )
+
+    def test_failed_files_are_isolated(self):
+        malformed = os.path.join(self.test_dir, "malformed.json")
+        with open(malformed, "w") as f:
+            f.write('{"trees": [{"dbh": 0.2,')
+        unknown = os.path.join(self.test_dir, "unknown.json")
+        with open(unknown, "w") as f:
+            f.write('{"trees": [{"dbh": 0.2, "species": "Not a tree"}]}')
+        pairs = [
+            (malformed, os.path.join(self.test_dir, "malformed_processed.json")),
+            (
+                os.path.join(self.test_dir, "missing.json"),
+                os.path.join(self.test_dir, "missing_processed.json"),
+            ),
+            (unknown, os.path.join(self.test_dir, "unknown_processed.json")),
+            (
+                os.path.join(example_data, "10_trees.json"),
+                os.path.join(self.test_dir, "good_processed.json"),
+            ),
+            # Columnar files are written by the workers themselves
+            (unknown, os.path.join(self.test_dir, "unknown_processed.csv")),
+            (
+                os.path.join(example_data, "10_trees.json"),
+                os.path.join(self.test_dir, "good_processed.csv"),
+            ),
+        ]
+        results = batch_runner.run_files(pairs, workers=2)
+
+        self.assertIn("JSONDecodeError", results[0]["error"])
+        self.assertIn("FileNotFoundError", results[1]["error"])
+        self.assertIn("UnknownSpeciesError", results[2]["error"])
+        self.assertIsNone(results[3]["error"])
+        self.assertEqual(results[3]["trees"], 10)
+        self.assertIn("UnknownSpeciesError", results[4]["error"])
+        self.assertEqual(results[5]["trees"], 10)
+        # Failed files leave no output behind
+        self.assertEqual(
+            sorted(os.listdir(self.test_dir)),
+            [
+                "good_processed.csv",
+                "good_processed.json",
+                "malformed.json",
+                "unknown.json",
+            ],
+        )
+
+    def test_failed_columnar_write_leaves_no_output(self):
+        def write_partially(trees, save_path):
+            with open(save_path, "w") as f:
+                f.write("dbh,")
+            raise OSError("disk full")
+
+        output_path = os.path.join(self.test_dir, "processed.csv")
+        with patch.object(
+            batch_runner.tree_table, "write_tree_table", side_effect=write_partially
+        ), self.assertRaises(OSError):
+            batch_runner._process_file_in_worker(
+                os.path.join(example_data, "10_trees.json"), output_path, None
+            )
+        self.assertEqual(os.listdir(self.test_dir), [])
+
+    def test_workers_get_settings_without_fork(self):
+        # Workers started with "spawn" don't inherit config changed at runtime
+        spawn_pool = functools.partial(
+            ProcessPoolExecutor, mp_context=multiprocessing.get_context("spawn")
+        )
+        input_path = os.path.join(self.test_dir, "labels.json")
+        with open(input_path, "w") as f:
+            f.write('{"trees": [{"dbh": 0.2, "species": "oak tree"}]}')
+        output_path = os.path.join(self.test_dir, "labels_processed.json")
+        with patch.object(config, "RESOLVE_SPECIES_LABELS", True), patch.object(
+            parallel, "ProcessPoolExecutor", spawn_pool
+        ):
+            results = batch_runner.run_files([(input_path, output_path)], workers=1)
+        self.assertIsNone(results[0]["error"])
+        self.assertEqual(results[0]["trees"], 1)
+
+    def test_cli(self):
+        malformed = os.path.join(self.test_dir, "malformed.json")
+        with open(malformed, "w") as f:
+            f.write("[")
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), self.assertRaises(SystemExit):
+            main(
+                [
+                    os.path.join(example_data, "10_trees.json"),
+                    malformed,
+                    "--output-dir",
+                    self.test_dir,
+                    "--concurrent",
+                    "--workers",
+                    "2",
+                ]
+            )
+        self.assertIn("malformed.json: failed: JSONDecodeError", output.getvalue())
+        self.assertIn("Processed 10 trees from 1 file(s)", output.getvalue())
+        self.assertTrue(
+            os.path.exists(os.path.join(self.test_dir, "10_trees_processed.json"))
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,4 @@
+import copy
 import json
 import os
 import shutil
@@ -5,7 +6,9 @@ import tempfile
 import unittest
 from unittest.mock import patch
 
-from forest_carbon import combined_agb_calculator
+import numpy as np
+
+from forest_carbon import combined_agb_calculator, config
 
 table5_filename = "./table5.csv"
 
@@ -98,6 +101,77 @@ class TestBiomassCalculator(unittest.TestCase):
                     os.path.join(self.test_dir, "test_data_processed.csv"),
                 )
 
+    def test_run_model_missing_or_malformed_file(self):
+        malformed = os.path.join(self.test_dir, "malformed.json")
+        with open(malformed, "w") as f:
+            f.write('{"trees": [{"dbh": 10,')
+        for input_path in [os.path.join(self.test_dir, "missing.json"), malformed]:
+            output_path = os.path.join(self.test_dir, "processed.json")
+            with self.assertRaises(ValueError):
+                combined_agb_calculator.run_model(input_path, output_path)
+            self.assertFalse(os.path.exists(output_path))
+
+    def test_apply_model_batch_matches_per_tree(self):
+        tree_data = combined_agb_calculator.load_tree_data_from_json(
+            os.path.join(
+                os.path.dirname(__file__), "..", "example_data", "100_trees.json"
+            ),
+            config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO,
+        )
+        # Exercise the fallback branches as well as the species branch
+        tree_data[0]["taxa"] = "Unknown"
+        tree_data[1]["taxa"] = "Unknown"
+        tree_data[1]["height"] = 12.5
+        tree_data[2].update({"group": "Conifer", "taxa": "Abies", "spg": 2.0})
+
+        expected = combined_agb_calculator.apply_model(
+            copy.deepcopy(tree_data), config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS
+        )
+        result = combined_agb_calculator.apply_model_batch(
+            tree_data, config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS
+        )
+        self.assertIsInstance(result, np.ndarray)
+        self.assertEqual(result.tolist(), [tree["AGB value"] for tree in expected])
+
+        # A diameter the no-height model can't take fails as it does per tree
+        tree_data[0]["dbh"] = 0.0
+        with self.assertRaises(ValueError):
+            combined_agb_calculator.apply_model_batch(
+                tree_data, config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS
+            )
+
+    def test_apply_model_batch_columns(self):
+        trees = {
+            "group": np.array(["Conifer", "Woodland"]),
+            "taxa": np.array(["Cupressoceae", "Fabaceae"]),
+            "dbh": np.array([10.0, 20.0]),
+            "spg": np.array([0.2, 0.5]),
+        }
+        result = combined_agb_calculator.apply_model_batch(
+            trees, config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS
+        )
+        drc = np.exp(0.36738 + 0.94932 * np.log(20.0))
+        np.testing.assert_allclose(
+            result,
+            [
+                np.exp(-1.9615 + 2.1063 * np.log(10.0)),
+                np.exp(-2.9255 + 2.4109 * np.log(drc)),
+            ],
+        )
+
+    def test_apply_model_vectorized(self):
+        test_data = [
+            {"group": "Conifer", "taxa": "Larix", "dbh": 10.0, "spg": 0.49},
+            {"group": "Conifer", "taxa": "Larix", "dbh": 15.0, "spg": 0.49},
+        ]
+        result = combined_agb_calculator.apply_model(
+            test_data, config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS, vectorized=True
+        )
+        self.assertEqual(len(result), 2)
+        self.assertAlmostEqual(
+            result[1]["AGB value"], np.exp(-2.3012 + 2.3853 * np.log(15.0))
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,103 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from forest_carbon import __main__ as cli
+
+example_data = os.path.join(os.path.dirname(__file__), "..", "example_data")
+
+
+class TestCli(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        self.plot_dir = os.path.join(self.test_dir, "plots")
+        os.makedirs(self.plot_dir)
+        for name in ["a.json", "b.json"]:
+            shutil.copy(
+                os.path.join(example_data, "10_trees.json"),
+                os.path.join(self.plot_dir, name),
+            )
+        # Neither of these should be picked up from the directory
+        open(os.path.join(self.plot_dir, "notes.txt"), "w").close()
+        open(os.path.join(self.plot_dir, "a_processed.json"), "w").close()
+
+    def test_expand_inputs(self):
+        a = os.path.join(self.plot_dir, "a.json")
+        b = os.path.join(self.plot_dir, "b.json")
+        self.assertEqual(cli.expand_inputs([self.plot_dir]), [a, b])
+        self.assertEqual(cli.expand_inputs([b, self.plot_dir]), [b, a])
+        self.assertEqual(
+            cli.expand_inputs([os.path.join(self.plot_dir, "[ab].json")]), [a, b]
+        )
+        with self.assertRaises(FileNotFoundError):
+            cli.expand_inputs([os.path.join(self.plot_dir, "missing*.json")])
+
+    def test_output_path_for(self):
+        self.assertEqual(
+            cli.output_path_for("plots/a.json"),
+            os.path.join("plots", "a_processed.json"),
+        )
+        self.assertEqual(
+            cli.output_path_for("plots/a.json", "out", "csv"),
+            os.path.join("out", "a_processed.csv"),
+        )
+
+    def test_main(self):
+        output_dir = os.path.join(self.test_dir, "out")
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            cli.main([self.plot_dir, "--output-dir", output_dir, "--format", "ndjson"])
+
+        self.assertEqual(
+            sorted(os.listdir(output_dir)), ["a_processed.ndjson", "b_processed.ndjson"]
+        )
+        with open(os.path.join(output_dir, "a_processed.ndjson")) as output_file:
+            trees = [json.loads(line) for line in output_file]
+        self.assertEqual(len(trees), 10)
+        self.assertTrue(all("AGB value" in tree for tree in trees))
+        self.assertIn("Processed 20 trees from 2 file(s)", stdout.getvalue())
+        self.assertIn("trees/s", stdout.getvalue())
+        # With the time of each pipeline stage
+        for stage in ("load_trees:", "preprocess:", "estimate:", "write_output:"):
+            self.assertIn(stage, stdout.getvalue())
+
+    def test_failed_files_are_reported(self):
+        malformed = os.path.join(self.plot_dir, "malformed.json")
+        with open(malformed, "w") as f:
+            f.write("[")
+        output_dir = os.path.join(self.test_dir, "out")
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout), self.assertRaises(SystemExit) as exit:
+            cli.main([self.plot_dir, "--output-dir", output_dir])
+
+        self.assertEqual(exit.exception.code, "1 file(s) failed")
+        self.assertIn("malformed.json: failed: ValueError", stdout.getvalue())
+        self.assertIn("Processed 20 trees from 2 file(s)", stdout.getvalue())
+        self.assertEqual(
+            sorted(os.listdir(output_dir)), ["a_processed.json", "b_processed.json"]
+        )
+
+        # A missing input is reported before anything is processed
+        missing = os.path.join(self.plot_dir, "missing.json")
+        with contextlib.redirect_stdout(io.StringIO()), self.assertRaises(
+            SystemExit
+        ) as exit:
+            cli.main([missing, "--output-dir", output_dir])
+        self.assertIn("No input files found", exit.exception.code)
+
+        # A missing file is reported like any other failure
+        with contextlib.redirect_stdout(stdout), patch.object(
+            cli, "PATH_TO_DATA", missing
+        ), self.assertRaises(SystemExit):
+            cli.main(["--output-dir", output_dir])
+        self.assertIn("missing.json: failed: ValueError", stdout.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
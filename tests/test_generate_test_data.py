@@ -0,0 +1,97 @@
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from forest_carbon import combined_agb_calculator, config, reference_tables
+
+has_pyarrow = importlib.util.find_spec("pyarrow") is not None
+
+# The script isn't part of the package, so load it from its path
+spec = importlib.util.spec_from_file_location(
+    "generate_test_data",
+    os.path.join(os.path.dirname(__file__), "..", "scripts", "generate_test_data.py"),
+)
+generate_test_data = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(generate_test_data)
+
+
+class TestGenerateTestData(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+
+    def blocks(self, seed, **kwargs):
+        return list(
+            generate_test_data.iter_tree_blocks(
+                250, seed=seed, block_size=100, **kwargs
+            )
+        )
+
+    def test_same_seed_same_trees(self):
+        blocks = self.blocks(3)
+        self.assertEqual([len(block["dbh"]) for block in blocks], [100, 100, 50])
+        for block, again in zip(blocks, self.blocks(3)):
+            for name in ["dbh", "species", "x_pos", "y_pos"]:
+                np.testing.assert_array_equal(block[name], again[name])
+        self.assertFalse(np.array_equal(blocks[0]["dbh"], self.blocks(4)[0]["dbh"]))
+
+        mean_dbh = np.full(10, 0.2)
+        x_pos = y_pos = np.linspace(0, 12, 10)
+        np.testing.assert_array_equal(
+            generate_test_data.random_tree_diameters(
+                np.random.default_rng(1), mean_dbh, x_pos, y_pos
+            ),
+            generate_test_data.random_tree_diameters(
+                np.random.default_rng(1), mean_dbh, x_pos, y_pos
+            ),
+        )
+
+    def test_species_are_in_the_database(self):
+        database = reference_tables.load_species_database(
+            config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO
+        )
+        for source in ["example", "all"]:
+            species = generate_test_data.species_mix(source)
+            self.assertLessEqual(set(species), set(database))
+            for block in self.blocks(0, species=species):
+                self.assertLessEqual(set(block["species"]), set(database))
+                self.assertTrue((block["dbh"] > 0).all())
+        with self.assertRaises(ValueError):
+            generate_test_data.species_mix("some")
+
+    def test_write_trees_round_trips_through_run_model(self):
+        extensions = [".json", ".ndjson", ".csv"] + (
+            [".parquet"] if has_pyarrow else []
+        )
+        # All the species, so that names with commas and quotes are written too
+        species = generate_test_data.species_mix("all")
+        blocks = self.blocks(5, species=species)
+        for extension in extensions:
+            input_path = os.path.join(self.test_dir, "trees" + extension)
+            output_path = os.path.join(self.test_dir, "trees_processed.json")
+            self.assertEqual(
+                generate_test_data.write_trees(input_path, iter(blocks)), 250
+            )
+            self.assertEqual(
+                combined_agb_calculator.run_model(input_path, output_path), 250
+            )
+            with open(output_path) as f:
+                trees = json.load(f)
+            for name in ["dbh", "x_pos", "y_pos"]:
+                np.testing.assert_allclose(
+                    [tree[name] for tree in trees],
+                    np.concatenate([block[name] for block in blocks]),
+                    rtol=1e-15,
+                )
+            self.assertTrue(all(tree["AGB value"] > 0 for tree in trees))
+        with self.assertRaises(ValueError):
+            generate_test_data.write_trees("trees.txt", iter(blocks))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import math
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from forest_carbon import combined_agb_calculator, gridding
+from forest_carbon.__main__ import main
+
+example_data = os.path.join(os.path.dirname(__file__), "..", "example_data")
+
+
+class TestCarbonGrid(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+
+    def test_add(self):
+        grid = gridding.CarbonGrid(2.0)
+        added = grid.add(
+            [1.0, 3.0, 3.5, -1.0, np.nan],
+            [1.0, 1.0, 1.5, 5.0, 0.0],
+            [1.0, 2.0, 4.0, 3.0, 5.0],
+            [0.2, 0.2, np.nan, 0.4, 0.1],
+        )
+        self.assertEqual(added, 4)
+        self.assertEqual(grid.skipped, 1)
+        self.assertEqual(grid.bounds, (-2.0, 4.0, 0.0, 6.0))
+        np.testing.assert_array_equal(
+            grid.agb, [[0.0, 1.0, 6.0], [0.0, 0.0, 0.0], [3.0, 0.0, 0.0]]
+        )
+        np.testing.assert_array_equal(grid.stems, [[0, 1, 2], [0, 0, 0], [1, 0, 0]])
+        self.assertAlmostEqual(grid.basal_area[0, 1], math.pi * 0.01)
+        self.assertAlmostEqual(grid.basal_area[0, 2], math.pi * 0.01)
+        self.assertAlmostEqual(grid.basal_area[2, 0], math.pi * 0.04)
+
+        x, y = grid.cell_centers()
+        np.testing.assert_array_equal(x, [-1.0, 1.0, 3.0])
+        np.testing.assert_array_equal(y, [1.0, 3.0, 5.0])
+
+    def test_incremental_matches_single_batch(self):
+        rng = np.random.default_rng(0)
+        x, y = rng.uniform(-50, 50, (2, 1000))
+        agb, dbh = rng.uniform(0, 1, (2, 1000))
+
+        whole = gridding.CarbonGrid(7.5, origin=(1.0, 2.0))
+        whole.add(x, y, agb, dbh)
+        chunked = gridding.CarbonGrid(7.5, origin=(1.0, 2.0))
+        for start in range(0, 1000, 300):
+            part = slice(start, start + 300)
+            chunked.add(x[part], y[part], agb[part], dbh[part])
+        merged = gridding.CarbonGrid(7.5, origin=(1.0, 2.0))
+        for part in (slice(0, 500), slice(500, 1000)):
+            other = gridding.CarbonGrid(7.5, origin=(1.0, 2.0))
+            other.add(x[part], y[part], agb[part], dbh[part])
+            merged.merge(other)
+
+        for grid in (chunked, merged):
+            self.assertEqual(grid.bounds, whole.bounds)
+            np.testing.assert_array_equal(grid.stems, whole.stems)
+            np.testing.assert_allclose(grid.agb, whole.agb)
+            np.testing.assert_allclose(grid.basal_area, whole.basal_area)
+        self.assertEqual(whole.stems.sum(), 1000)
+        self.assertAlmostEqual(whole.agb.sum(), agb.sum())
+
+        with self.assertRaises(ValueError):
+            merged.merge(gridding.CarbonGrid(5.0))
+
+    def test_save_and_load(self):
+        grid = gridding.CarbonGrid(3.0)
+        grid.add([1.0, 10.0], [-4.0, 2.0], [1.5, 2.5], [0.3, None])
+        path = os.path.join(self.test_dir, "grid.npz")
+        grid.save(path)
+
+        loaded = gridding.CarbonGrid.load(path)
+        self.assertEqual(loaded.bounds, grid.bounds)
+        self.assertEqual(loaded.cell_size, grid.cell_size)
+        for name in gridding.GRID_LAYERS:
+            np.testing.assert_array_equal(getattr(loaded, name), getattr(grid, name))
+
+    def test_run_model_and_aggregate_files(self):
+        output_paths = []
+        grid = gridding.CarbonGrid(4.0)
+        for name, output in [
+            ("10_trees.json", "10_trees.json"),
+            ("100_trees.json", "100_trees.ndjson"),
+        ]:
+            output_paths.append(os.path.join(self.test_dir, output))
+            combined_agb_calculator.run_model(
+                os.path.join(example_data, name), output_paths[-1], grid=grid
+            )
+        self.assertEqual(grid.stems.sum() + grid.skipped, 110)
+
+        aggregated = gridding.aggregate_files(output_paths, 4.0, chunk_size=7)
+        np.testing.assert_array_equal(aggregated.stems, grid.stems)
+        np.testing.assert_allclose(aggregated.agb, grid.agb)
+
+    def test_cli(self):
+        path = os.path.join(self.test_dir, "grid.npz")
+        main(
+            [
+                os.path.join(example_data, "100_trees.json"),
+                "--output-dir",
+                self.test_dir,
+                "--grid",
+                path,
+                "--cell-size",
+                "5",
+            ]
+        )
+        grid = gridding.CarbonGrid.load(path)
+        self.assertEqual(grid.cell_size, 5.0)
+        self.assertEqual(grid.stems.sum() + grid.skipped, 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
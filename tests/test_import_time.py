@@ -0,0 +1,67 @@
+"""
+Import-time checks: starting the CLI and running the core JSON pipeline should not
+pull in heavy modules that the work doesn't need. Which modules are imported is
+checked rather than how long the imports take, which depends on the machine.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+# Modules that must not be imported just to start the CLI
+HEAVY_MODULES = ["numpy", "pandas", "beartype", "torch", "matplotlib", "pykrige"]
+
+
+def run_python(script: str, env: dict = None) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, "-c", script],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=ROOT,
+        env={**os.environ, **(env or {})},
+    )
+
+
+class TestImportTime(unittest.TestCase):
+    def test_cli_does_not_import_heavy_modules(self):
+        result = run_python(
+            "import sys\n"
+            "import forest_carbon.__main__\n"
+            f"print([m for m in {HEAVY_MODULES!r} if m in sys.modules])\n"
+        )
+        self.assertEqual(result.stdout.strip(), "[]")
+
+    def test_json_pipeline_does_not_import_pandas(self):
+        test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, test_dir)
+        script = (
+            "import sys\n"
+            "from forest_carbon import combined_agb_calculator\n"
+            "combined_agb_calculator.run_model(\n"
+            "    'example_data/10_trees.json', sys.argv[1] + '/processed.json'\n"
+            ")\n"
+            "print('pandas' in sys.modules)\n"
+        )
+        env = {"FOREST_CARBON_CACHE_DIR": os.path.join(test_dir, "cache")}
+
+        # The first run parses the reference tables with pandas and caches them
+        run_python(script.replace("sys.argv[1]", repr(test_dir)), env)
+        result = run_python(script.replace("sys.argv[1]", repr(test_dir)), env)
+        self.assertEqual(result.stdout.strip().splitlines()[-1], "False")
+
+    def test_config_import_is_light(self):
+        result = run_python(
+            "import sys\n"
+            "import forest_carbon.config\n"
+            "print('numpy' in sys.modules)\n"
+        )
+        self.assertEqual(result.stdout.strip(), "False")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from forest_carbon import __main__ as cli
+from forest_carbon import combined_agb_calculator, config, gridding, incremental
+
+example_data = os.path.join(os.path.dirname(__file__), "..", "example_data")
+
+
+class TestIncremental(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        with open(os.path.join(example_data, "100_trees.json")) as f:
+            self.trees = json.load(f)["trees"]
+        self.input_path = os.path.join(self.test_dir, "trees.json")
+        self.output_path = os.path.join(self.test_dir, "trees_processed.json")
+        self.write_input(self.trees)
+
+    def write_input(self, trees):
+        with open(self.input_path, "w") as f:
+            json.dump({"trees": trees}, f)
+
+    def assert_matches_run_model(self):
+        expected_path = os.path.join(self.test_dir, "expected.json")
+        combined_agb_calculator.run_model(self.input_path, expected_path)
+        with open(expected_path) as expected, open(self.output_path) as output:
+            self.assertEqual(output.read(), expected.read())
+
+    def test_reuses_unchanged_trees(self):
+        counts = incremental.run_model_incremental(self.input_path, self.output_path)
+        self.assertEqual(counts, {"trees": 100, "reused": 0, "recomputed": 100})
+        self.assert_matches_run_model()
+        # The manifest is as readable as the output
+        self.assertEqual(
+            os.stat(incremental.manifest_path(self.output_path)).st_mode,
+            os.stat(self.output_path).st_mode,
+        )
+
+        counts = incremental.run_model_incremental(self.input_path, self.output_path)
+        self.assertEqual(counts, {"trees": 100, "reused": 100, "recomputed": 0})
+        self.assert_matches_run_model()
+
+        # Re-survey: one tree grew, one was removed and one was added
+        trees = [dict(tree) for tree in self.trees[1:]]
+        trees[0]["dbh"] += 0.01
+        trees.append(dict(self.trees[5], x_pos=1.0, y_pos=2.0))
+        self.write_input(trees)
+        counts = incremental.run_model_incremental(self.input_path, self.output_path)
+        self.assertEqual(counts, {"trees": 100, "reused": 98, "recomputed": 2})
+        self.assert_matches_run_model()
+
+    def test_model_changes_recompute(self):
+        incremental.run_model_incremental(self.input_path, self.output_path)
+        with mock.patch.object(config, "COEF_D", config.COEF_D + 0.1):
+            counts = incremental.run_model_incremental(
+                self.input_path, self.output_path
+            )
+        self.assertEqual(counts["recomputed"], 100)
+
+        # A previous output without a manifest can't be reused either
+        os.remove(incremental.manifest_path(self.output_path))
+        counts = incremental.run_model_incremental(self.input_path, self.output_path)
+        self.assertEqual(counts["recomputed"], 100)
+
+    def test_damaged_output_recomputes(self):
+        incremental.run_model_incremental(self.input_path, self.output_path)
+        with open(self.output_path) as f:
+            contents = f.read()
+        with open(self.output_path, "w") as f:
+            f.write(contents[: len(contents) // 2])
+        for _ in range(2):
+            counts = incremental.run_model_incremental(
+                self.input_path, self.output_path
+            )
+        self.assertEqual(counts["reused"], 100)
+        self.assert_matches_run_model()
+
+        # A crash between saving the output and its manifest leaves no manifest
+        with mock.patch.object(incremental, "_write_manifest", side_effect=OSError):
+            with self.assertRaises(OSError):
+                incremental.run_model_incremental(self.input_path, self.output_path)
+        self.assertFalse(os.path.exists(incremental.manifest_path(self.output_path)))
+        counts = incremental.run_model_incremental(self.input_path, self.output_path)
+        self.assertEqual(counts["recomputed"], 100)
+
+    def test_fingerprint(self):
+        tree = {"species": "Ash", "dbh": 1, "x_pos": 2.0, "y_pos": 3.0}
+        self.assertEqual(
+            incremental.tree_fingerprint(tree),
+            incremental.tree_fingerprint(dict(tree, dbh=1.0, height=float("nan"))),
+        )
+        self.assertNotEqual(
+            incremental.tree_fingerprint(tree),
+            incremental.tree_fingerprint(dict(tree, height=10.0)),
+        )
+
+    def test_cli(self):
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            for _ in range(2):
+                cli.main([self.input_path, "--incremental"])
+        self.assertIn("(0 reused, 100 recomputed)", stdout.getvalue())
+        self.assertIn("(100 reused, 0 recomputed)", stdout.getvalue())
+        self.assertEqual(cli.expand_inputs([self.test_dir]), [self.input_path])
+
+    def test_cli_grid_and_workers(self):
+        grid_path = os.path.join(self.test_dir, "grid.npz")
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            for _ in range(2):
+                cli.main(
+                    [self.input_path, "--incremental", "--grid", grid_path]
+                    + ["--workers", "2"]
+                )
+        self.assertIn("(100 reused, 0 recomputed)", stdout.getvalue())
+        # The reused trees are added to the grid as well as the recomputed ones
+        grid = gridding.CarbonGrid.load(grid_path)
+        self.assertEqual(grid.stems.sum() + grid.skipped, len(self.trees))
+
+        with contextlib.redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+            cli.main([self.input_path, "--incremental", "--chunk-size", "10"])
+
+
+if __name__ == "__main__":
+    unittest.main()
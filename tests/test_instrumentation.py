@@ -0,0 +1,134 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from forest_carbon import combined_agb_calculator, config
+from forest_carbon.instrumentation import Instrumentation, metrics
+
+example_data = os.path.join(os.path.dirname(__file__), "..", "example_data")
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_stages_and_counters(self):
+        instrumentation = Instrumentation()
+        with instrumentation.stage("load", 10):
+            pass
+        with instrumentation.stage("load") as stage:
+            stage.items = 5
+        instrumentation.count("hits")
+        instrumentation.count("hits", 2)
+
+        snapshot = instrumentation.snapshot()
+        self.assertEqual(snapshot["stages"]["load"]["calls"], 2)
+        self.assertEqual(snapshot["stages"]["load"]["items"], 15)
+        self.assertGreaterEqual(snapshot["stages"]["load"]["seconds"], 0)
+        self.assertEqual(snapshot["counters"], {"hits": 3})
+        self.assertEqual(json.loads(instrumentation.to_json()), snapshot)
+
+        instrumentation.reset()
+        self.assertEqual(instrumentation.snapshot()["stages"], {})
+
+    def test_merge(self):
+        worker = Instrumentation()
+        with worker.stage("estimate", 10):
+            pass
+        worker.count("hits", 2)
+        instrumentation = Instrumentation()
+        instrumentation.count("hits")
+        for _ in range(2):
+            instrumentation.merge(worker.snapshot(), stage_prefix="worker.")
+        self.assertEqual(instrumentation.stages["worker.estimate"]["calls"], 2)
+        self.assertEqual(instrumentation.stages["worker.estimate"]["items"], 20)
+        self.assertEqual(instrumentation.counters, {"hits": 5})
+
+    def test_timed(self):
+        instrumentation = Instrumentation()
+
+        @instrumentation.timed("square")
+        def square(x):
+            return x * x
+
+        self.assertEqual(square(3), 9)
+        self.assertEqual(instrumentation.stages["square"]["calls"], 1)
+
+    def test_disabled(self):
+        instrumentation = Instrumentation(enabled=False)
+        with instrumentation.stage("load", 10):
+            pass
+        instrumentation.count("hits")
+        self.assertEqual(instrumentation.stages, {})
+        self.assertEqual(instrumentation.counters, {})
+
+    def test_pipeline(self):
+        test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, test_dir)
+        metrics.reset()
+        num_trees = combined_agb_calculator.run_model(
+            os.path.join(example_data, "100_trees.json"),
+            os.path.join(test_dir, "trees.json"),
+        )
+
+        snapshot = metrics.snapshot()
+        for stage in ["load_trees", "preprocess", "estimate", "write_output"]:
+            self.assertEqual(snapshot["stages"][stage]["items"], num_trees)
+        branches = sum(
+            value
+            for name, value in snapshot["counters"].items()
+            if name.startswith("model_branch.")
+        )
+        self.assertEqual(branches, num_trees)
+        self.assertIn("model_selection", snapshot["caches"])
+        self.assertEqual(
+            snapshot["caches"]["model_selection"]["hit_rate"] is None,
+            snapshot["caches"]["model_selection"]["hits"] == 0,
+        )
+
+    def test_batch_branches_match_per_tree(self):
+        trees = combined_agb_calculator.load_tree_data_from_json(
+            os.path.join(example_data, "100_trees.json"),
+            config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO,
+        )
+        counters = []
+        for vectorized in [False, True]:
+            metrics.reset()
+            combined_agb_calculator.apply_model(
+                [dict(tree) for tree in trees],
+                config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS,
+                vectorized=vectorized,
+            )
+            counters.append(
+                {
+                    name: value
+                    for name, value in metrics.counters.items()
+                    if name.startswith(("model_branch.", "taxa_model."))
+                }
+            )
+        # Some of the example trees have no taxa-level model
+        self.assertGreater(counters[0]["taxa_model.no_match"], 0)
+        self.assertEqual(counters[0], counters[1])
+
+    def test_parallel_workers_hand_back_metrics(self):
+        test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, test_dir)
+        for chunk_size in (None, 10):
+            metrics.reset()
+            num_trees = combined_agb_calculator.run_model(
+                os.path.join(example_data, "100_trees.json"),
+                os.path.join(test_dir, "trees.json"),
+                chunk_size=chunk_size,
+                workers=2,
+            )
+            snapshot = metrics.snapshot()
+            self.assertEqual(snapshot["stages"]["worker.estimate"]["items"], num_trees)
+            branches = sum(
+                value
+                for name, value in snapshot["counters"].items()
+                if name.startswith("model_branch.")
+            )
+            self.assertEqual(branches, num_trees)
+
+
+if __name__ == "__main__":
+    unittest.main()
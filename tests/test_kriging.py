@@ -0,0 +1,141 @@
+import os
+import unittest
+
+import numpy as np
+
+from forest_carbon import combined_agb_calculator, config, kriging
+
+example_data = os.path.join(os.path.dirname(__file__), "..", "example_data")
+
+
+def global_kriging(x, y, values, query_x, query_y, model, parameters):
+    """Ordinary kriging with all points, solving one system per query point."""
+    n = len(x)
+    matrix = np.ones((n + 1, n + 1))
+    matrix[n, n] = 0
+    matrix[:n, :n] = kriging.variogram(
+        model, parameters, np.hypot(x[:, None] - x, y[:, None] - y)
+    )
+    estimates = []
+    for qx, qy in zip(query_x, query_y):
+        rhs = np.ones(n + 1)
+        rhs[:n] = kriging.variogram(model, parameters, np.hypot(x - qx, y - qy))
+        weights = np.linalg.solve(matrix, rhs)[:n]
+        estimates.append(weights @ values)
+    return np.array(estimates)
+
+
+class TestKriging(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.x = rng.uniform(0, 12, 200)
+        self.y = rng.uniform(0, 12, 200)
+        self.values = np.sin(self.x / 3) + np.cos(self.y / 4) + rng.normal(0, 0.1, 200)
+
+    def test_variogram_models(self):
+        for model, names in kriging.VARIOGRAM_PARAMETERS.items():
+            parameters = [1.0] * len(names)
+            gamma = kriging.variogram(model, parameters, [0.0, 0.5, 100.0])
+            self.assertEqual(gamma[0], 0.0)
+            self.assertGreater(gamma[2], gamma[1])
+
+        lags = np.linspace(1, 10, 10)
+        parameters = kriging.fit_variogram("linear", lags, 0.5 * lags + 0.2)
+        np.testing.assert_allclose(parameters, (0.5, 0.2))
+        parameters = kriging.fit_variogram(
+            "spherical", lags, kriging.variogram("spherical", (2.0, 6.0, 0.1), lags)
+        )
+        np.testing.assert_allclose(parameters, (2.0, 6.0, 0.1), rtol=0.05)
+
+    def test_nearest_neighbors(self):
+        grid = kriging.PointGrid(self.x, self.y)
+        query_x, query_y = np.random.default_rng(1).uniform(-2, 14, (2, 300))
+        indices, distances = kriging.nearest_neighbors(grid, query_x, query_y, 7)
+
+        d = np.hypot(query_x[:, None] - self.x, query_y[:, None] - self.y)
+        np.testing.assert_allclose(distances, np.sort(d, axis=1)[:, :7])
+        np.testing.assert_allclose(
+            np.take_along_axis(d, indices, axis=1), np.sort(d, axis=1)[:, :7]
+        )
+
+        indices, distances = kriging.nearest_neighbors(
+            grid, query_x, query_y, 7, search_radius=1.0
+        )
+        self.assertTrue(((indices >= 0) == (distances <= 1.0)).all())
+        self.assertEqual(
+            (indices >= 0).sum(), np.minimum((d <= 1.0).sum(axis=1), 7).sum()
+        )
+
+    def test_matches_global_kriging(self):
+        grid_x = np.linspace(0, 12, 7)
+        grid_y = np.linspace(0, 12, 5)
+        parameters = (0.3, 5.0, 0.01)
+        estimates, variances = kriging.ordinary_kriging(
+            self.x,
+            self.y,
+            self.values,
+            grid_x,
+            grid_y,
+            variogram_model="spherical",
+            variogram_parameters=parameters,
+            num_neighbors=len(self.x),
+            batch_size=8,
+        )
+        self.assertEqual(estimates.shape, (5, 7))
+        query_x, query_y = np.meshgrid(grid_x, grid_y)
+        expected = global_kriging(
+            self.x,
+            self.y,
+            self.values,
+            query_x.ravel(),
+            query_y.ravel(),
+            "spherical",
+            parameters,
+        )
+        np.testing.assert_allclose(estimates.ravel(), expected, rtol=1e-6)
+        self.assertTrue((variances > 0).all())
+
+    def test_exact_at_data_points(self):
+        estimates, variances = kriging.ordinary_kriging(
+            self.x[:3],
+            self.y[:3],
+            self.values[:3],
+            self.x[:1],
+            self.y[:1],
+            variogram_parameters=(1.0, 0.0),
+        )
+        self.assertAlmostEqual(estimates[0, 0], self.values[0])
+        self.assertAlmostEqual(variances[0, 0], 0.0)
+
+    def test_search_radius(self):
+        estimates, _ = kriging.ordinary_kriging(
+            self.x,
+            self.y,
+            self.values,
+            [6.0, 100.0],
+            [6.0],
+            search_radius=2.0,
+            min_neighbors=3,
+        )
+        self.assertTrue(np.isfinite(estimates[0, 0]))
+        self.assertTrue(np.isnan(estimates[0, 1]))
+
+    def test_krige_trees(self):
+        trees = combined_agb_calculator.apply_model(
+            combined_agb_calculator.load_tree_data_from_json(
+                os.path.join(example_data, "100_trees.json"),
+                config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO,
+            ),
+            config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS,
+            vectorized=True,
+        )
+        result = kriging.krige_trees(
+            trees, cell_size=1.0, bounds=(0, 12, 0, 12), variogram_model="spherical"
+        )
+        self.assertEqual(len(result["x"]), 13)
+        self.assertEqual(result["estimate"].shape, (13, 13))
+        self.assertTrue(np.isfinite(result["estimate"]).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import unittest
+from unittest.mock import patch
+
+from forest_carbon import agb_biomass
+from forest_carbon.model_cache import ModelSelectionCache
+
+table5_filename = os.path.join(
+    os.path.dirname(__file__),
+    "..",
+    "forest_carbon",
+    "data",
+    "taxa_level_agb_model_parameters.csv",
+)
+
+
+class TestModelSelectionCache(unittest.TestCase):
+    def setUp(self):
+        self.index = agb_biomass.load_taxa_model_index(table5_filename)
+        self.cache = ModelSelectionCache(max_size=2)
+
+    def test_matches_model_selection(self):
+        for group, taxa, spg in [
+            ("Conifer", "Cupressoceae", 0.40),
+            ("Hardwood", "Oleaceae", 0.51),
+            ("Hardwood", "Fagaceae,", 0.59),
+            ("Woodland", "Fabaceae", None),
+        ]:
+            expected = agb_biomass.agb_biomass_model(group, taxa, spg, self.index)
+            for _ in range(2):
+                self.assertEqual(
+                    self.cache.model_parameters(group, taxa, spg, self.index),
+                    expected,
+                )
+
+    def test_hits_and_misses(self):
+        with patch(
+            "forest_carbon.agb_biomass.agb_biomass_model",
+            wraps=agb_biomass.agb_biomass_model,
+        ) as model:
+            for spg in [0.40, 0.40, 0.40, 0.45, 0.40]:
+                self.cache.model_parameters("Conifer", "Cupressoceae", spg, self.index)
+        self.assertEqual(model.call_count, 2)
+        self.assertEqual(self.cache.stats()["hits"], 3)
+        self.assertEqual(self.cache.stats()["misses"], 2)
+
+    def test_bounded(self):
+        for spg in [0.30, 0.40, 0.45, 0.50]:
+            self.cache.model_parameters("Conifer", "Cupressoceae", spg, self.index)
+        self.assertEqual(len(self.cache), 2)
+
+    def test_invalidated_by_new_table(self):
+        self.cache.model_parameters("Conifer", "Cupressoceae", 0.40, self.index)
+        self.cache.model_parameters("Conifer", "Cupressoceae", 0.40, self.index)
+        self.assertEqual(self.cache.invalidations, 0)
+
+        index = agb_biomass.load_taxa_model_index(table5_filename)
+        index.b0 = index.b0 + 1.0
+        index.fingerprint = "changed"
+        model_para = self.cache.model_parameters("Conifer", "Cupressoceae", 0.40, index)
+        self.assertEqual(self.cache.invalidations, 1)
+        self.assertEqual(model_para, (-2.6327 + 1.0, 2.4757, 0.76, "dbh"))
+
+    def test_fingerprint(self):
+        index = agb_biomass.load_taxa_model_index(table5_filename)
+        self.assertEqual(index.fingerprint, self.index.fingerprint)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import functools
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from unittest.mock import patch
+
+import numpy as np
+
+from forest_carbon import combined_agb_calculator, config, parallel, typecheck
+
+example_filename = os.path.join(
+    os.path.dirname(__file__), "..", "example_data", "100_trees.json"
+)
+
+
+class TestParallel(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.trees = combined_agb_calculator.load_tree_data_from_json(
+            example_filename, config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_row_shards(self):
+        self.assertEqual(parallel.row_shards(10, 3), [(0, 3), (3, 6), (6, 10)])
+        self.assertEqual(parallel.row_shards(2, 4), [(0, 1), (1, 2)])
+        self.assertEqual(parallel.row_shards(0, 4), [])
+
+    def test_tile_shards(self):
+        rng = np.random.default_rng(0)
+        x_pos, y_pos = rng.uniform(0, 12, 500), rng.uniform(0, 12, 500)
+        order, shards = parallel.tile_shards(x_pos, y_pos, 3.0, 100)
+
+        self.assertEqual(sorted(order.tolist()), list(range(500)))
+        self.assertEqual(shards[0][0], 0)
+        self.assertEqual(shards[-1][1], 500)
+        # Each tile lies entirely within one shard
+        tiles = (x_pos[order] // 3.0) * 100 + (y_pos[order] // 3.0)
+        shard_tiles = [set(tiles[start:stop]) for start, stop in shards]
+        for i, tiles_i in enumerate(shard_tiles):
+            for tiles_j in shard_tiles[i + 1 :]:
+                self.assertFalse(tiles_i & tiles_j)
+
+    def test_apply_model_parallel(self):
+        expected = combined_agb_calculator.apply_model_batch(
+            self.trees, config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS
+        )
+        for tile_size in (None, 4.0):
+            result = combined_agb_calculator.apply_model_parallel(
+                self.trees,
+                config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS,
+                workers=2,
+                shard_size=30,
+                tile_size=tile_size,
+            )
+            self.assertEqual(result.tolist(), expected.tolist())
+
+    def test_run_model_workers(self):
+        expected_path = os.path.join(self.test_dir, "expected.json")
+        combined_agb_calculator.run_model(example_filename, expected_path)
+        with open(expected_path) as f:
+            expected = f.read()
+
+        for chunk_size in (None, 7):
+            output_path = os.path.join(self.test_dir, "processed.json")
+            combined_agb_calculator.run_model(
+                example_filename, output_path, chunk_size=chunk_size, workers=2
+            )
+            with open(output_path) as f:
+                self.assertEqual(f.read(), expected)
+
+    def test_workers_get_settings_without_fork(self):
+        # Workers started with "spawn" don't inherit config changed at runtime
+        spawn_pool = functools.partial(
+            ProcessPoolExecutor, mp_context=multiprocessing.get_context("spawn")
+        )
+        input_path = os.path.join(self.test_dir, "labels.json")
+        with open(input_path, "w") as f:
+            json.dump(
+                {
+                    "trees": [
+                        {"dbh": 0.2, "species": "oak tree", "x_pos": 1, "y_pos": 2},
+                        {"dbh": 0.3, "species": "ash tree", "x_pos": 3, "y_pos": 4},
+                        # Estimated with the no-height model, which depends on E
+                        {"dbh": 0.4, "species": "Sequoia, giant"},
+                    ]
+                },
+                f,
+            )
+        expected_path = os.path.join(self.test_dir, "expected.json")
+        output_path = os.path.join(self.test_dir, "processed.json")
+        with patch.object(config, "RESOLVE_SPECIES_LABELS", True), patch.object(
+            config, "E", 0.5
+        ), patch.object(
+            parallel, "ProcessPoolExecutor", spawn_pool
+        ), typecheck.fast_mode():
+            self.assertTrue(
+                combined_agb_calculator._worker_initargs(None, "")[2]["fast_mode"]
+            )
+            combined_agb_calculator.run_model(input_path, expected_path)
+            combined_agb_calculator.run_model(
+                input_path, output_path, chunk_size=1, workers=2
+            )
+        with open(expected_path) as expected, open(output_path) as output:
+            expected, output = json.load(expected), json.load(output)
+        # The no-height model is evaluated with NumPy in the workers and with `math`
+        # in a single process, which can differ in the last place
+        for expected_tree, output_tree in zip(expected, output):
+            self.assertAlmostEqual(
+                output_tree.pop("AGB value"), expected_tree.pop("AGB value")
+            )
+        self.assertEqual(output, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from forest_carbon import agb_biomass, config, reference_tables, tree_preprocessing
+
+
+class TestReferenceTables(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.test_dir, "cache")
+        self.species_path = os.path.join(self.test_dir, "tree_species_info.csv")
+        self.taxa_path = os.path.join(self.test_dir, "taxa_parameters.csv")
+        shutil.copy(config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO, self.species_path)
+        shutil.copy(config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS, self.taxa_path)
+
+        patcher = patch.object(config, "REFERENCE_TABLE_CACHE_DIR", self.cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        reference_tables.clear_memory_cache()
+
+    def tearDown(self):
+        reference_tables.clear_memory_cache()
+        shutil.rmtree(self.test_dir)
+
+    def test_load_species_database(self):
+        database = reference_tables.load_species_database(self.species_path)
+        self.assertEqual(
+            database,
+            tree_preprocessing.create_common_name_dictionary(self.species_path),
+        )
+        # Memoized in the process
+        self.assertIs(
+            reference_tables.load_species_database(self.species_path), database
+        )
+
+    def test_load_taxa_model_index(self):
+        index = reference_tables.load_taxa_model_index(self.taxa_path)
+        expected = agb_biomass.load_taxa_model_index(self.taxa_path)
+        self.assertEqual(index.b0.tolist(), expected.b0.tolist())
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+        # A new process (simulated by clearing the memory cache) reads the pickle
+        reference_tables.clear_memory_cache()
+        with patch.object(
+            reference_tables, "_build_taxa_model_index", side_effect=AssertionError
+        ):
+            index = reference_tables.load_taxa_model_index(self.taxa_path)
+        self.assertEqual(index.b0.tolist(), expected.b0.tolist())
+
+    def test_cache_invalidated_when_source_changes(self):
+        index = reference_tables.load_taxa_model_index(self.taxa_path)
+        self.assertEqual(
+            index.lookup("Conifer", "Larix", 0.49), (-2.3012, 2.3853, 0.85, "dbh")
+        )
+
+        with open(self.taxa_path) as f:
+            contents = f.read()
+        with open(self.taxa_path, "w") as f:
+            f.write(contents.replace("-2.3012,2.3853", "-2.0000,2.3853"))
+
+        index = reference_tables.load_taxa_model_index(self.taxa_path)
+        self.assertEqual(
+            index.lookup("Conifer", "Larix", 0.49), (-2.0, 2.3853, 0.85, "dbh")
+        )
+
+    def test_cached_load_does_not_import_pandas(self):
+        reference_tables.load_species_database(self.species_path)
+        reference_tables.load_taxa_model_index(self.taxa_path)
+
+        script = (
+            "import sys\n"
+            "from forest_carbon import reference_tables\n"
+            f"reference_tables.load_species_database({self.species_path!r})\n"
+            f"reference_tables.load_taxa_model_index({self.taxa_path!r})\n"
+            "print('pandas' in sys.modules)\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.join(os.path.dirname(__file__), ".."),
+            env={**os.environ, "FOREST_CARBON_CACHE_DIR": self.cache_dir},
+        )
+        self.assertEqual(result.stdout.strip(), "False")
+
+    def test_untrusted_cache_files_are_not_loaded(self):
+        reference_tables.load_taxa_model_index(self.taxa_path)
+        (cache_file,) = os.listdir(self.cache_dir)
+        cache_path = os.path.join(self.cache_dir, cache_file)
+        # A cache file that others could have written to is rebuilt, not unpickled
+        os.chmod(cache_path, 0o666)
+        reference_tables.clear_memory_cache()
+        with patch.object(
+            reference_tables, "_build_taxa_model_index", return_value="rebuilt"
+        ), patch.object(reference_tables.pickle, "load", side_effect=AssertionError):
+            index = reference_tables.load_taxa_model_index(self.taxa_path)
+        self.assertEqual(index, "rebuilt")
+
+    def test_cache_disabled(self):
+        with patch.object(config, "REFERENCE_TABLE_CACHE_DIR", None):
+            reference_tables.load_species_database(self.species_path)
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import http.client
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from forest_carbon import combined_agb_calculator
+from forest_carbon.server import EstimationServer, EstimationService
+
+example_data = os.path.join(os.path.dirname(__file__), "..", "example_data")
+
+
+class TestServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Wait a little for other requests to join each batch
+        cls.server = EstimationServer(
+            ("127.0.0.1", 0), EstimationService(batch_wait=0.01)
+        )
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+
+    def request(self, method, path, body=None):
+        connection = http.client.HTTPConnection("127.0.0.1", self.server.server_port)
+        self.addCleanup(connection.close)
+        connection.request(method, path, body)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    def expected_output(self, name):
+        output_path = os.path.join(self.test_dir, name)
+        combined_agb_calculator.run_model(os.path.join(example_data, name), output_path)
+        with open(output_path) as f:
+            return json.load(f)
+
+    def test_estimate_matches_run_model(self):
+        with open(os.path.join(example_data, "100_trees.json")) as f:
+            body = f.read()
+        status, trees = self.request("POST", "/estimate", body)
+        self.assertEqual(status, 200)
+        self.assertEqual(trees, self.expected_output("100_trees.json"))
+
+    def test_concurrent_requests_are_batched(self):
+        with open(os.path.join(example_data, "10_trees.json")) as f:
+            trees = json.load(f)["trees"]
+        expected = self.expected_output("10_trees.json")
+        before = self.server.service.stats()
+
+        # Each request gets a different slice of the trees, and some fail
+        bodies = [json.dumps(trees[i : i + 3]) for i in range(8)]
+        bodies[5] = json.dumps([{"dbh": 0.2, "species": "Not a tree"}])
+        bodies[6] = "{not json"
+        responses = [None] * len(bodies)
+
+        def send(i):
+            responses[i] = self.request("POST", "/estimate", bodies[i])
+
+        threads = [threading.Thread(target=send, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for i, (status, body) in enumerate(responses):
+            if i == 5:
+                self.assertEqual(status, 400)
+                self.assertEqual(body["species"], ["Not a tree"])
+            elif i == 6:
+                self.assertEqual(status, 400)
+                self.assertIn("Invalid request", body["error"])
+            else:
+                self.assertEqual(status, 200)
+                self.assertEqual(body, expected[i : i + 3])
+
+        stats = self.server.service.stats()
+        self.assertEqual(stats["requests"] - before["requests"], 8)
+        self.assertEqual(stats["failed"] - before["failed"], 2)
+        self.assertLess(stats["batches"] - before["batches"], 7)
+
+    def test_invalid_trees(self):
+        for trees, message in [
+            ([{"dbh": "abc", "species": "Ash"}], "Tree 0 has dbh='abc'"),
+            ([{"dbh": 0.2, "species": "Ash"}, {"dbh": 0.2}], "Tree 1 has no species"),
+            ([{"dbh": 0.2, "species": "Ash", "x_pos": [1]}], "Tree 0 has x_pos=[1]"),
+        ]:
+            status, body = self.request("POST", "/estimate", json.dumps(trees))
+            self.assertEqual(status, 400)
+            self.assertIn(message, body["error"])
+
+        # Positions are optional
+        status, body = self.request(
+            "POST", "/estimate", json.dumps([{"dbh": 0.2, "species": "Ash"}])
+        )
+        self.assertEqual(status, 200)
+        self.assertIsNone(body[0]["x_pos"])
+
+        # Values a model can't take are the client's error; anything else is ours
+        trees = json.dumps([{"dbh": 0.0, "species": "Ash"}])
+        service = self.server.service
+        with patch.object(service, "_process", side_effect=ValueError("math domain")):
+            self.assertEqual(self.request("POST", "/estimate", trees)[0], 400)
+        with patch.object(service, "_process", side_effect=RuntimeError("bug")):
+            self.assertEqual(self.request("POST", "/estimate", trees)[0], 500)
+
+    def test_metrics_and_health(self):
+        self.request("POST", "/estimate", json.dumps({"trees": []}))
+        status, metrics = self.request("GET", "/metrics")
+        self.assertEqual(status, 200)
+        self.assertGreaterEqual(metrics["requests"], 1)
+        self.assertIsNotNone(metrics["latency"]["p99"])
+        self.assertIn("stages", metrics["instrumentation"])
+        self.assertEqual(self.request("GET", "/health"), (200, {"status": "ok"}))
+        self.assertEqual(self.request("GET", "/missing")[0], 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
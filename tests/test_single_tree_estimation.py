@@ -1,6 +1,9 @@
+import math
 import unittest
 
-from forest_carbon import single_tree_estimation
+import numpy as np
+
+from forest_carbon import config, single_tree_estimation
 
 
 class TestSingleTreeEstimation(unittest.TestCase):
@@ -9,6 +12,83 @@ class TestSingleTreeEstimation(unittest.TestCase):
         agb = single_tree_estimation.apply_AGB_model(agb_func, 1.0, 2.0, 3.0)
         self.assertEqual(round(agb, 3), 0.672)  # Assert that result is equal to 5
 
+    def test_array_models_match_scalar(self):
+        rng = np.random.default_rng(0)
+        rho, d, h = (
+            rng.uniform(0.2, 1.0, 500),
+            rng.uniform(1, 100, 500),
+            rng.uniform(1, 40, 500),
+        )
+        model_height = single_tree_estimation.create_AGB_function(
+            config.COEF, config.EXP
+        )
+        model_no_height = single_tree_estimation.create_AGB_function_no_height(
+            config.CONST,
+            config.COEF_E,
+            config.COEF_RHO,
+            config.COEF_D,
+            config.COEF_D_SQUARED,
+        )
+
+        # NumPy's functions can differ from the math module's in the last place
+        np.testing.assert_allclose(
+            model_height(rho, d, h),
+            [
+                model_height(*values)
+                for values in zip(rho.tolist(), d.tolist(), h.tolist())
+            ],
+            rtol=1e-14,
+        )
+        np.testing.assert_allclose(
+            model_no_height(rho, d, config.E),
+            [model_no_height(r, x, config.E) for r, x in zip(rho.tolist(), d.tolist())],
+            rtol=1e-14,
+        )
+
+    def test_scalar_models(self):
+        model_no_height = single_tree_estimation.create_AGB_function_no_height(
+            1.803, 0.976, 0.976, 2.673, 0.0299
+        )
+        agb = model_no_height(0.5, 20.0, 1.0)
+        self.assertEqual(
+            agb,
+            math.exp(
+                1.803
+                - 0.976 * 1.0
+                + 0.976 * math.log(0.5)
+                + 2.673 * math.log(20.0)
+                - 0.0299 * math.log(20.0**2)
+            ),
+        )
+        # NumPy scalars are scalars too
+        result = model_no_height(np.float64(0.5), np.float64(20.0), np.float32(1.0))
+        self.assertIs(type(result), float)
+        self.assertEqual(result, agb)
+        # A diameter that isn't positive is an error, not a NaN estimate
+        with self.assertRaises(ValueError):
+            model_no_height(0.5, 0.0, 1.0)
+
+    def test_array_model_output_buffer(self):
+        model = single_tree_estimation.create_AGB_function(0.0673, 0.926)
+        out = np.empty(3)
+        result = model(
+            np.array([1.0, 0.5, 0.8]), np.array([2.0, 3.0, 4.0]), 3.0, out=out
+        )
+        self.assertIs(result, out)
+        self.assertAlmostEqual(out[0], 0.672, places=3)
+
+    def test_float32_model(self):
+        model = single_tree_estimation.create_AGB_function_no_height(
+            1.803, 0.976, 0.976, 2.673, 0.0299, dtype=np.float32
+        )
+        model64 = single_tree_estimation.create_AGB_function_no_height(
+            1.803, 0.976, 0.976, 2.673, 0.0299
+        )
+        rho, d = np.array([0.5, 0.6, 0.7]), np.array([10.0, 20.0, 30.0])
+        agb = model(rho, d, 1.0)
+        self.assertEqual(agb.dtype, np.float32)
+        np.testing.assert_allclose(agb, model64(rho, d, 1.0), rtol=1e-5)
+
 
 if __name__ == "__main__":
     unittest.main()
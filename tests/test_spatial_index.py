@@ -0,0 +1,115 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from forest_carbon import combined_agb_calculator, spatial_index
+from forest_carbon.spatial_index import SpatialIndex
+
+example_data = os.path.join(os.path.dirname(__file__), "..", "example_data")
+
+
+class TestSpatialIndex(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        rng = np.random.default_rng(0)
+        self.rng = rng
+        self.x, self.y = rng.uniform(0, 100, (2, 5000))
+        self.x[::50] = np.nan
+        self.agb = rng.uniform(0, 2, 5000)
+        self.agb[::7] = np.nan
+        self.index = SpatialIndex(self.x, self.y, self.agb, cell_size=3.0)
+
+    def assert_query(self, rows, expected):
+        np.testing.assert_array_equal(rows, np.flatnonzero(expected))
+
+    def test_box(self):
+        self.assertEqual(self.index.skipped, 100)
+        x, y = self.x, self.y
+        for _ in range(50):
+            x_min, x_max = np.sort(self.rng.uniform(-10, 110, 2))
+            y_min, y_max = np.sort(self.rng.uniform(-10, 110, 2))
+            expected = (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+            self.assert_query(
+                self.index.query_box(x_min, x_max, y_min, y_max), expected
+            )
+            self.assertAlmostEqual(
+                self.index.sum_box(x_min, x_max, y_min, y_max),
+                np.nansum(self.agb[expected]),
+            )
+        self.assertEqual(len(self.index.query_box(200, 300, 0, 100)), 0)
+        self.assertEqual(self.index.sum_box(-20, -10, 0, 100), 0.0)
+
+    def test_radius(self):
+        for _ in range(50):
+            center_x, center_y = self.rng.uniform(-10, 110, 2)
+            radius = self.rng.uniform(0, 40)
+            distance_squared = (self.x - center_x) ** 2 + (self.y - center_y) ** 2
+            expected = distance_squared <= radius**2
+            self.assert_query(
+                self.index.query_radius(center_x, center_y, radius), expected
+            )
+            self.assertAlmostEqual(
+                self.index.sum_radius(center_x, center_y, radius),
+                np.nansum(self.agb[expected]),
+            )
+        with self.assertRaises(ValueError):
+            self.index.query_radius(0, 0, -1)
+
+    def test_polygon(self):
+        # A concave polygon: a square with a triangular notch
+        vertices = [(10, 10), (90, 10), (90, 90), (50, 40), (10, 90)]
+        x, y = self.x, self.y
+        in_square = (x > 10) & (x < 90) & (y > 10) & (y < 90)
+        in_notch = (y > 40) & (np.abs(x - 50) < (y - 40) * 40 / 50)
+        expected = in_square & ~in_notch
+        self.assert_query(self.index.query_polygon(vertices), expected)
+        self.assertAlmostEqual(
+            self.index.sum_polygon(vertices), np.nansum(self.agb[expected])
+        )
+        with self.assertRaises(ValueError):
+            self.index.query_polygon([(0, 0), (1, 1)])
+
+    def test_polygon_interior_cells(self):
+        # Cells wholly inside the polygon are taken whole, not tested tree by tree
+        vertices = [(5, 5), (95, 8), (92, 95), (8, 92)]
+        tested = []
+        points_in_polygon = spatial_index._points_in_polygon
+
+        def count(x, y, polygon):
+            tested.append(len(x))
+            return points_in_polygon(x, y, polygon)
+
+        with patch.object(spatial_index, "_points_in_polygon", side_effect=count):
+            rows = self.index.query_polygon(vertices)
+        expected = spatial_index._points_in_polygon(self.x, self.y, np.array(vertices))
+        self.assert_query(rows, expected)
+        self.assertLess(sum(tested), expected.sum() / 2)
+
+    def test_from_trees_and_save(self):
+        input_path = os.path.join(example_data, "100_trees.json")
+        output_path = os.path.join(self.test_dir, "trees_processed.json")
+        combined_agb_calculator.run_model(input_path, output_path)
+        with open(output_path) as f:
+            trees = json.load(f)
+        index = SpatialIndex.from_trees(trees)
+        self.assertEqual(len(index) + index.skipped, len(trees))
+
+        path = os.path.join(self.test_dir, "index.npz")
+        index.save(path)
+        loaded = SpatialIndex.load(path)
+        rows = loaded.query_radius(5.0, 5.0, 4.0)
+        np.testing.assert_array_equal(rows, index.query_radius(5.0, 5.0, 4.0))
+        self.assertAlmostEqual(
+            loaded.sum_radius(5.0, 5.0, 4.0),
+            sum(trees[row]["AGB value"] for row in rows),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from forest_carbon import combined_agb_calculator, config, reference_tables
+from forest_carbon.species_resolver import SpeciesResolver, normalize_label
+from forest_carbon.tree_preprocessing import (
+    UnknownSpeciesError,
+    preprocess_tree_entries,
+)
+
+example_data = os.path.join(os.path.dirname(__file__), "..", "example_data")
+
+
+class TestSpeciesResolver(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        self.resolver = SpeciesResolver.from_csv(
+            config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO,
+            aliases={"pine tree": "Pine, lodgepole"},
+        )
+
+    def test_normalize_label(self):
+        self.assertEqual(normalize_label("Oak, white"), normalize_label("white oak"))
+        self.assertEqual(normalize_label("Oaks"), normalize_label("oak tree"))
+        self.assertEqual(normalize_label("  Douglas-fir "), "dougla fir")
+
+    def test_resolve(self):
+        expected = {
+            "Ash": "Ash",
+            "ash tree": "Ash",
+            "oak tree": "Oaks",
+            "pine tree": "Pine, lodgepole",
+            "sugar maple": "Maple, sugar",
+            "Pinus contorta": "Pine, lodgepole",
+            "Abies fraseri": "Fir, Fraser",
+            "802": "Oak, white",
+            "Mapel, sugar": "Maple, sugar",
+            "Birch": None,
+        }
+        for label, name in expected.items():
+            self.assertEqual(self.resolver.resolve(label), name, label)
+
+    def test_lru_cache(self):
+        resolver = SpeciesResolver.from_csv(
+            config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO, max_size=2
+        )
+        for label in ["ash tree", "oak tree", "ash tree", "white oak"]:
+            resolver.resolve(label)
+        self.assertEqual((resolver.hits, resolver.misses), (1, 3))
+        self.assertEqual(list(resolver.cache), ["ash tree", "white oak"])
+
+    def test_save_and_load(self):
+        path = os.path.join(self.test_dir, "labels.json")
+        self.resolver.resolve("oak tree")
+        self.resolver.save(path)
+
+        resolver = SpeciesResolver.from_csv(
+            config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO,
+            aliases={"pine tree": "Pine, lodgepole"},
+        )
+        self.assertTrue(resolver.load(path))
+        self.assertEqual(resolver.resolve("oak tree"), "Oaks")
+        self.assertEqual(resolver.misses, 0)
+
+        # A cache saved with different aliases is ignored
+        other = SpeciesResolver.from_csv(config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO)
+        self.assertFalse(other.load(path))
+
+        # So is one saved for a table with different scientific names or FIA codes
+        with open(config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO) as f:
+            table = f.read()
+        for old, new in [("P. contorta", "P. murrayana"), (",802,", ",899,")]:
+            self.assertIn(old, table)
+            species_path = os.path.join(self.test_dir, "species.csv")
+            with open(species_path, "w") as f:
+                f.write(table.replace(old, new))
+            edited = SpeciesResolver.from_csv(
+                species_path, aliases={"pine tree": "Pine, lodgepole"}
+            )
+            self.assertFalse(edited.load(path))
+
+    def test_unknown_alias_target(self):
+        with self.assertRaises(ValueError):
+            SpeciesResolver.from_csv(
+                config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO,
+                aliases={"pine tree": "Pine, imaginary"},
+            )
+
+    def test_preprocess_with_resolver(self):
+        database = reference_tables.load_species_database(
+            config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO
+        )
+        trees = [{"species": "oak tree"}, {"species": "Ash"}, {"species": "Birch"}]
+        with self.assertRaises(UnknownSpeciesError) as context:
+            preprocess_tree_entries(trees, database, self.resolver)
+        self.assertEqual(context.exception.species, ["Birch"])
+
+        trees = preprocess_tree_entries(trees[:2], database, self.resolver)
+        self.assertEqual(trees[0]["species"], "oak tree")
+        self.assertEqual(trees[0]["taxa"], database["Oaks"]["taxa"])
+        self.assertEqual(trees[1]["spg"], database["Ash"]["spg"])
+
+    def test_pipeline_resolves_labels(self):
+        cache_dir = os.path.join(self.test_dir, "cache")
+        with patch.object(config, "RESOLVE_SPECIES_LABELS", True), patch.object(
+            config, "REFERENCE_TABLE_CACHE_DIR", cache_dir
+        ):
+            trees = combined_agb_calculator.load_tree_table(
+                os.path.join(example_data, "100_trees.csv"),
+                config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO,
+            )
+        self.assertEqual(len(trees), 100)
+        self.assertFalse(trees["spg"].isna().any())
+        self.assertTrue(os.path.exists(os.path.join(cache_dir, "species_labels.json")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from forest_carbon import combined_agb_calculator, streaming
+
+example_filename = os.path.join(
+    os.path.dirname(__file__), "..", "example_data", "100_trees.json"
+)
+
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        with open(example_filename) as f:
+            self.trees = json.load(f)["trees"]
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_iter_json_trees(self):
+        # Use a tiny read size so values straddle the read boundaries
+        trees = list(streaming.iter_json_trees(example_filename, read_size=5))
+        self.assertEqual(trees, self.trees)
+
+    def test_iter_json_trees_skips_other_keys(self):
+        path = os.path.join(self.test_dir, "trees.json")
+        with open(path, "w") as f:
+            f.write('{"meta": {"note": "]}"}, "trees": [{"dbh": 1.5e-1}, {"dbh": 2}]}')
+        trees = list(streaming.iter_json_trees(path, read_size=3))
+        self.assertEqual(trees, [{"dbh": 0.15}, {"dbh": 2}])
+
+    def test_iter_json_trees_list(self):
+        path = os.path.join(self.test_dir, "trees.json")
+        with open(path, "w") as f:
+            json.dump(self.trees, f, indent=2)
+        trees = list(streaming.iter_json_trees(path, read_size=7))
+        self.assertEqual(trees, self.trees)
+
+    def test_iter_json_trees_missing_key(self):
+        path = os.path.join(self.test_dir, "trees.json")
+        with open(path, "w") as f:
+            f.write('{"plots": []}')
+        with self.assertRaises(KeyError):
+            list(streaming.iter_json_trees(path))
+
+    def test_iter_chunks(self):
+        chunks = list(streaming.iter_chunks(range(7), 3))
+        self.assertEqual(chunks, [[0, 1, 2], [3, 4, 5], [6]])
+
+    def test_writers_round_trip(self):
+        for filename in ("trees.json", "trees.ndjson"):
+            path = os.path.join(self.test_dir, filename)
+            with streaming.open_tree_writer(path) as writer:
+                writer.write_many(self.trees)
+            with open(path) as f:
+                if streaming.is_ndjson(path):
+                    written = [json.loads(line) for line in f]
+                else:
+                    written = json.load(f)
+            self.assertEqual(written, self.trees)
+
+    def test_failed_run_leaves_no_output(self):
+        # A species that isn't in the database, after some chunks were written
+        trees = [dict(tree) for tree in self.trees]
+        trees[70]["species"] = "Not a tree"
+        input_path = os.path.join(self.test_dir, "trees.json")
+        with open(input_path, "w") as f:
+            json.dump({"trees": trees}, f)
+        for filename in ("out.json", "out.ndjson"):
+            output_path = os.path.join(self.test_dir, filename)
+            with self.assertRaises(KeyError):
+                combined_agb_calculator.run_model(
+                    input_path, output_path, chunk_size=10
+                )
+            self.assertEqual(sorted(os.listdir(self.test_dir)), ["trees.json"])
+
+        # An existing output is only replaced by a complete one
+        output_path = os.path.join(self.test_dir, "out.json")
+        with open(output_path, "w") as f:
+            f.write("previous")
+        with self.assertRaises(RuntimeError):
+            with streaming.open_tree_writer(output_path) as writer:
+                writer.write_many(self.trees)
+                raise RuntimeError
+        with open(output_path) as f:
+            self.assertEqual(f.read(), "previous")
+
+    def test_run_model_streaming_matches_run_model(self):
+        expected_path = os.path.join(self.test_dir, "expected.json")
+        combined_agb_calculator.run_model(example_filename, expected_path)
+
+        streamed_path = os.path.join(self.test_dir, "streamed.json")
+        count = combined_agb_calculator.run_model_streaming(
+            example_filename, streamed_path, chunk_size=7
+        )
+        self.assertEqual(count, len(self.trees))
+        with open(expected_path) as expected, open(streamed_path) as streamed:
+            self.assertEqual(streamed.read(), expected.read())
+
+    def test_run_model_ndjson(self):
+        input_path = os.path.join(self.test_dir, "trees.ndjson")
+        with open(input_path, "w") as f:
+            for tree in self.trees:
+                f.write(json.dumps(tree) + "\n")
+        output_path = os.path.join(self.test_dir, "processed.ndjson")
+        combined_agb_calculator.run_model(input_path, output_path)
+        with open(output_path) as f:
+            processed = [json.loads(line) for line in f]
+        self.assertEqual(len(processed), len(self.trees))
+        self.assertTrue(all("AGB value" in tree for tree in processed))
+
+
+if __name__ == "__main__":
+    unittest.main()
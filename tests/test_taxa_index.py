@@ -0,0 +1,103 @@
+import os
+import unittest
+
+import numpy as np
+
+from forest_carbon import agb_biomass
+from forest_carbon.taxa_index import TaxaModelIndex
+
+table5_filename = os.path.join(
+    os.path.dirname(__file__),
+    "..",
+    "forest_carbon",
+    "data",
+    "taxa_level_agb_model_parameters.csv",
+)
+
+
+class TestTaxaModelIndex(unittest.TestCase):
+    def setUp(self):
+        self.df = agb_biomass.load_taxa_agb_model_data(table5_filename)
+        self.index = agb_biomass.load_taxa_model_index(table5_filename)
+
+        # Every group with every taxa name in the table, plus some that don't match
+        names = set()
+        for label in self.df.iloc[:, 1]:
+            names.update(part.strip() for part in label.split("/"))
+            names.update(label.split())
+        names.update(["Unknown", "Fagaceae,"])
+        self.queries = [
+            (group, name)
+            for group in ["Conifer", "Hardwood", "Woodland"]
+            for name in sorted(names)
+        ]
+        self.spg_values = [None, 0.0, 0.2, 0.3, 0.35, 0.4, 0.45, 0.49, 0.5, 0.6, 1.5]
+
+    def test_matches_row_scan(self):
+        for group, taxa in self.queries:
+            for spg in self.spg_values:
+                expected = agb_biomass.agb_biomass_model(group, taxa, spg, self.df)
+                self.assertEqual(
+                    self.index.model_parameters(group, taxa, spg),
+                    expected,
+                    (group, taxa, spg),
+                )
+
+    def test_agb_biomass_model_accepts_index(self):
+        model_para = agb_biomass.agb_biomass_model(
+            "Conifer", "Cupressoceae", 0.40, self.index
+        )
+        self.assertEqual(model_para, (-2.6327, 2.4757, 0.76, "dbh"))
+
+    def test_lookup(self):
+        self.assertEqual(
+            self.index.lookup("Woodland", "Fabaceae", 0.5),
+            (-2.9255, 2.4109, 0.89, "drc"),
+        )
+        self.assertIsNone(self.index.lookup("Hardwood", "Unknown", 0.5))
+
+    def test_lookup_rows(self):
+        groups, taxa, spg = [], [], []
+        for group, name in self.queries:
+            for value in self.spg_values:
+                groups.append(group)
+                taxa.append(name)
+                spg.append(np.nan if value is None else value)
+        rows = self.index.lookup_rows(groups, taxa, spg)
+
+        for row, group, name, value in zip(rows, groups, taxa, spg):
+            expected = self.index.lookup(
+                group, name, None if np.isnan(value) else value
+            )
+            if expected is None:
+                self.assertEqual(row, -1)
+            else:
+                self.assertEqual(
+                    (
+                        self.index.b0[row],
+                        self.index.b1[row],
+                        self.index.rsquared[row],
+                        self.index.diameter_class[row],
+                    ),
+                    expected,
+                )
+
+    def test_lookup_rows_samples(self):
+        groups, taxa = zip(*self.queries)
+        spg = np.random.default_rng(0).uniform(0.2, 0.6, (5, len(groups)))
+        rows = self.index.lookup_rows(groups, taxa, spg)
+        self.assertEqual(rows.shape, spg.shape)
+        for sample_rows, sample_spg in zip(rows, spg):
+            np.testing.assert_array_equal(
+                sample_rows, self.index.lookup_rows(groups, taxa, sample_spg)
+            )
+
+    def test_from_dataframe(self):
+        index = TaxaModelIndex.from_dataframe(self.df)
+        self.assertEqual(len(index), len(self.df))
+        self.assertEqual((index.diameter_min[0], index.diameter_max[0]), (3.0, 69.0))
+        self.assertEqual(index.num_observations[0], 131)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from forest_carbon import combined_agb_calculator, config, tree_preprocessing
+from forest_carbon.tree_batch import TreeBatch, write_tree_batch
+
+example_data = os.path.join(os.path.dirname(__file__), "..", "example_data")
+
+
+class TestTreeBatch(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+
+    def test_records_round_trip(self):
+        trees = [
+            {"dbh": 0.2, "group": "C", "taxa": "Abies", "x_pos": 1.0, "spg": 0.4},
+            {"dbh": None, "group": "H", "taxa": None, "x_pos": 2.5, "spg": 0.6},
+            {"dbh": 0.3, "group": "C", "taxa": "Abies", "x_pos": None, "spg": 0.4},
+        ]
+        batch = TreeBatch.from_records(trees, dtypes={"x_pos": np.float32})
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(batch.columns["x_pos"].dtype, np.float32)
+        np.testing.assert_array_equal(batch.codes["group"], [0, 1, 0])
+        np.testing.assert_array_equal(batch.codes["taxa"], [0, -1, 0])
+        self.assertEqual(batch.to_records(), trees)
+        self.assertEqual(list(batch.iter_records(chunk_size=2)), trees)
+
+        selected = batch[1:]
+        self.assertEqual(selected.to_records(), trees[1:])
+        self.assertTrue(np.shares_memory(selected["dbh"], batch["dbh"]))
+        self.assertEqual(batch[np.array([2, 0])].to_records(), [trees[2], trees[0]])
+        self.assertEqual(TreeBatch.from_frame(batch.to_frame()).to_records(), trees)
+
+    def test_concatenate(self):
+        first = TreeBatch.from_columns(dbh=[0.1, 0.2], taxa=["Abies", None])
+        second = TreeBatch.from_columns(dbh=[0.3], taxa=["Pinus"])
+        third = TreeBatch.from_columns(dbh=[0.4, 0.5], taxa=["Pinus", "Abies"])
+        joined = TreeBatch.concatenate([first, second, third])
+        np.testing.assert_array_equal(joined["dbh"], [0.1, 0.2, 0.3, 0.4, 0.5])
+        self.assertEqual(
+            joined["taxa"].tolist(), ["Abies", None, "Pinus", "Pinus", "Abies"]
+        )
+        self.assertEqual(joined.labels["taxa"].tolist(), ["Abies", "Pinus"])
+
+        with self.assertRaises(ValueError):
+            TreeBatch.concatenate([first, TreeBatch.from_columns(dbh=[0.1])])
+
+    def test_pipeline_matches_tree_dicts(self):
+        input_path = os.path.join(example_data, "100_trees.json")
+        expected_path = os.path.join(self.test_dir, "expected.json")
+        combined_agb_calculator.run_model(input_path, expected_path)
+        with open(expected_path) as f:
+            expected = json.load(f)
+
+        batch = combined_agb_calculator.load_tree_batch(
+            input_path, config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO, chunk_size=7
+        )
+        batch = combined_agb_calculator.apply_model(
+            batch, config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS
+        )
+        self.assertIsInstance(batch, TreeBatch)
+        self.assertEqual(batch.to_records(), expected)
+        # About 60 bytes per tree, rather than about 1 KB as dicts
+        self.assertLessEqual(batch.nbytes, 64 * len(batch))
+
+        output_path = os.path.join(self.test_dir, "batch.json")
+        combined_agb_calculator.run_model_tree_batch(input_path, output_path)
+        with open(expected_path) as expected_file, open(output_path) as output:
+            self.assertEqual(output.read(), expected_file.read())
+
+        with open(input_path) as f:
+            raw = TreeBatch.from_records(json.load(f)["trees"])
+        csv_path = os.path.join(self.test_dir, "trees.csv")
+        write_tree_batch(raw, csv_path)
+        from_csv = combined_agb_calculator.load_tree_batch(
+            csv_path, config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO
+        )
+        np.testing.assert_array_equal(
+            combined_agb_calculator.apply_model_batch(
+                from_csv, config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS
+            ),
+            batch["AGB value"],
+        )
+
+    def test_unknown_species(self):
+        batch = TreeBatch.from_columns(
+            dbh=[0.1, 0.2, 0.3], species=["Ash", "Not a tree", None]
+        )
+        database = {"Ash": {"taxa": "Fraxinus", "group": "H", "spg": 0.55}}
+        with self.assertRaises(tree_preprocessing.UnknownSpeciesError) as error:
+            tree_preprocessing.preprocess_tree_batch(batch, database)
+        self.assertEqual(error.exception.species, ["Not a tree", None])
+
+        batch = tree_preprocessing.preprocess_tree_batch(batch[:1], database)
+        self.assertEqual(
+            batch.to_records(),
+            [
+                {
+                    "dbh": 0.1,
+                    "species": "Ash",
+                    "group": "H",
+                    "taxa": "Fraxinus",
+                    "spg": 0.55,
+                }
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,15 @@
+import pickle
 import unittest
 
 import pandas as pd
 
 from forest_carbon.tree_preprocessing import (
+    UnknownSpeciesError,
     create_common_name_dictionary,
+    enrich_species_columns,
     preprocess_tree_entries,
     preprocess_tree_entry,
+    preprocess_tree_frame,
 )
 
 
@@ -60,6 +64,52 @@ class TestTreeProcessing(unittest.TestCase):
         self.assertEqual(result_trees[1]["spg"], 0.7)
         self.assertEqual(result_trees[1]["group"], "GroupC")
 
+    def test_preprocess_tree_frame(self):
+        trees = pd.DataFrame({"species": ["Pine", "Maple", "Pine"], "dbh": [1, 2, 3]})
+        result = preprocess_tree_frame(trees, self.common_name_dict)
+        self.assertEqual(list(result["taxa"]), ["Genus2", "Genus3", "Genus2"])
+        self.assertEqual(list(result["fia_species_code"]), [102, 103, 102])
+        self.assertEqual(list(result["spg"]), [0.5, 0.7, 0.5])
+        self.assertEqual(list(result["group"]), ["GroupB", "GroupC", "GroupB"])
+        self.assertNotIn("taxa", trees)
+
+    def test_preprocess_tree_frame_unknown_species(self):
+        trees = pd.DataFrame({"species": ["Pine", "Birch"]})
+        with self.assertRaises(KeyError):
+            preprocess_tree_frame(trees, self.common_name_dict)
+
+    def test_enrich_species_columns(self):
+        columns = enrich_species_columns(
+            ["Maple", "Oak", "Maple", "Maple"], self.common_name_dict
+        )
+        self.assertEqual(
+            list(columns["taxa"]), ["Genus3", "Genus1", "Genus3", "Genus3"]
+        )
+        self.assertEqual(
+            list(columns["group"]), ["GroupC", "GroupA", "GroupC", "GroupC"]
+        )
+        self.assertEqual(list(columns["spg"]), [0.7, 0.6, 0.7, 0.7])
+        self.assertEqual(list(columns["fia_species_code"]), [103, 101, 103, 103])
+
+    def test_unknown_species_reported_in_bulk(self):
+        species = ["Elm", "Pine", "Birch", "Elm"]
+        with self.assertRaises(UnknownSpeciesError) as context:
+            enrich_species_columns(species, self.common_name_dict)
+        self.assertEqual(context.exception.species, ["Elm", "Birch"])
+        self.assertEqual(context.exception.counts, [2, 1])
+
+        trees = [{"species": label} for label in species]
+        with self.assertRaises(UnknownSpeciesError) as context:
+            preprocess_tree_entries(trees, self.common_name_dict)
+        self.assertEqual(context.exception.species, ["Elm", "Birch"])
+        self.assertEqual(context.exception.counts, [2, 1])
+        self.assertIn("3 trees have unknown species", str(context.exception))
+        self.assertNotIn("taxa", trees[1])
+
+        # The error survives being sent back from a worker process
+        error = pickle.loads(pickle.dumps(context.exception))
+        self.assertEqual((error.species, error.counts), (["Elm", "Birch"], [2, 1]))
+
 
 if __name__ == "__main__":
     unittest.main()
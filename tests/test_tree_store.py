@@ -0,0 +1,111 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from forest_carbon import combined_agb_calculator, config, tree_store
+from forest_carbon.instrumentation import metrics
+
+example_data = os.path.join(os.path.dirname(__file__), "..", "example_data")
+
+
+class TestTreeStore(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        self.input_path = os.path.join(self.test_dir, "trees.json")
+        shutil.copy(os.path.join(example_data, "100_trees.json"), self.input_path)
+        self.store_path = os.path.join(self.test_dir, "trees.trees")
+        self.batch = combined_agb_calculator.load_tree_batch(
+            self.input_path, config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO
+        )
+
+    def test_build_and_open(self):
+        tree_store.build_tree_store(self.input_path, self.store_path)
+        self.assertTrue(tree_store.is_tree_store(self.store_path))
+        # The store gets the umask's permissions, like a directory made by hand
+        made_by_hand = os.path.join(self.test_dir, "made_by_hand")
+        os.mkdir(made_by_hand)
+        self.assertEqual(
+            os.stat(self.store_path).st_mode, os.stat(made_by_hand).st_mode
+        )
+        # Something other than a tree store is never replaced
+        with open(os.path.join(made_by_hand, "notes.txt"), "w") as f:
+            f.write("keep")
+        for path in (made_by_hand, os.path.join(made_by_hand, "notes.txt")):
+            with self.assertRaises(FileExistsError):
+                tree_store.build_tree_store(self.input_path, path)
+            with self.assertRaises(FileExistsError):
+                tree_store.save_tree_store(self.batch, path)
+        self.assertEqual(os.listdir(made_by_hand), ["notes.txt"])
+
+        store = tree_store.open_tree_store(self.store_path)
+        self.assertEqual(len(store), 100)
+        self.assertIsInstance(store.batch.columns["dbh"].base, np.memmap)
+        self.assertEqual(store.batch.to_records(), self.batch.to_records())
+        self.assertEqual(
+            store.rows(10, 20).to_records(), self.batch[10:20].to_records()
+        )
+        np.testing.assert_array_equal(store.input_rows, np.arange(100))
+
+        # The mapped trees estimate the same as the trees loaded from JSON
+        np.testing.assert_array_equal(
+            combined_agb_calculator.apply_model_batch(
+                store.batch, config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS
+            ),
+            combined_agb_calculator.apply_model_batch(
+                self.batch, config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS
+            ),
+        )
+
+    def test_tiles(self):
+        store = tree_store.build_tree_store(
+            self.input_path, self.store_path, tile_size=5.0
+        )
+        self.assertEqual(store.tile_size, 5.0)
+        count = 0
+        for (tile_x, tile_y), trees in store.iter_tiles():
+            self.assertTrue(np.shares_memory(trees["dbh"], store.batch["dbh"]))
+            np.testing.assert_array_equal(np.floor(trees["x_pos"] / 5.0), tile_x)
+            np.testing.assert_array_equal(np.floor(trees["y_pos"] / 5.0), tile_y)
+            count += len(trees)
+        self.assertEqual(count, 100)
+        self.assertEqual(len(store.tile(1000, 1000)), 0)
+
+        # The stored rows map back to the input order
+        np.testing.assert_array_equal(
+            store.batch["dbh"], self.batch["dbh"][store.input_rows]
+        )
+
+        window = store.window(2.0, 12.0, 3.0, 9.0)
+        x_pos, y_pos = self.batch["x_pos"], self.batch["y_pos"]
+        inside = (x_pos >= 2.0) & (x_pos < 12.0) & (y_pos >= 3.0) & (y_pos < 9.0)
+        self.assertEqual(len(window), int(inside.sum()))
+        self.assertEqual(
+            sorted(window["dbh"].tolist()), sorted(self.batch["dbh"][inside].tolist())
+        )
+
+        with self.assertRaises(ValueError):
+            tree_store.build_tree_store(self.input_path, self.store_path).tile(0, 0)
+
+    def test_load_tree_store_rebuilds_when_stale(self):
+        metrics.reset()
+        tree_store.load_tree_store(self.input_path, self.store_path)
+        tree_store.load_tree_store(self.input_path, self.store_path)
+        self.assertEqual(metrics.counters["tree_store.builds"], 1)
+        self.assertEqual(metrics.counters["tree_store.hits"], 1)
+
+        with open(self.input_path) as f:
+            trees = json.load(f)["trees"][:10]
+        with open(self.input_path, "w") as f:
+            json.dump({"trees": trees}, f)
+        store = tree_store.load_tree_store(self.input_path, self.store_path)
+        self.assertEqual(len(store), 10)
+        self.assertEqual(metrics.counters["tree_store.builds"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from forest_carbon import combined_agb_calculator, config, tree_table
+
+example_filename = os.path.join(
+    os.path.dirname(__file__), "..", "example_data", "100_trees.json"
+)
+has_pyarrow = importlib.util.find_spec("pyarrow") is not None
+
+
+class TestTreeTable(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        with open(example_filename) as f:
+            self.trees = pd.DataFrame(json.load(f)["trees"])
+
+        # The output of the JSON pipeline to compare against
+        self.expected_path = os.path.join(self.test_dir, "expected.json")
+        combined_agb_calculator.run_model(example_filename, self.expected_path)
+        with open(self.expected_path) as f:
+            self.expected = json.load(f)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_table_format(self):
+        self.assertEqual(tree_table.table_format("trees.CSV"), "csv")
+        self.assertEqual(tree_table.table_format("trees.parquet"), "parquet")
+        self.assertEqual(tree_table.table_format("trees.arrow"), "feather")
+        self.assertFalse(tree_table.is_columnar("trees.json"))
+
+    def test_load_tree_table(self):
+        trees = combined_agb_calculator.load_tree_table(
+            example_filename,
+            config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO,
+        )
+        self.assertEqual(list(trees.columns), list(tree_table.TREE_COLUMNS))
+        self.assertEqual(trees["dbh"].dtype, np.float64)
+        self.assertIsInstance(trees["group"].dtype, pd.CategoricalDtype)
+        self.assertTrue(trees["height"].isna().all())
+
+    def test_run_model_csv_to_json(self):
+        input_path = os.path.join(self.test_dir, "trees.csv")
+        self.trees.to_csv(input_path, index=False)
+        output_path = os.path.join(self.test_dir, "processed.json")
+        combined_agb_calculator.run_model(input_path, output_path)
+        with open(output_path) as f:
+            self.assertEqual(json.load(f), self.expected)
+
+    def test_run_model_json_to_csv(self):
+        output_path = os.path.join(self.test_dir, "processed.csv")
+        combined_agb_calculator.run_model(example_filename, output_path)
+        result = tree_table.read_tree_table(output_path)
+        self.assertEqual(
+            result["AGB value"].tolist(), [tree["AGB value"] for tree in self.expected]
+        )
+
+    @unittest.skipUnless(has_pyarrow, "pyarrow is not installed")
+    def test_run_model_parquet(self):
+        input_path = os.path.join(self.test_dir, "trees.parquet")
+        self.trees.to_parquet(input_path)
+        for extension in ("parquet", "arrow"):
+            output_path = os.path.join(self.test_dir, f"processed.{extension}")
+            combined_agb_calculator.run_model(input_path, output_path)
+            result = tree_table.read_tree_table(output_path)
+            self.assertEqual(result["AGB value"].dtype, np.float64)
+            self.assertEqual(
+                tree_table.tree_table_records(result), self.expected, extension
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
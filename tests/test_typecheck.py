@@ -0,0 +1,76 @@
+import os
+import unittest
+
+from beartype.roar import BeartypeCallHintParamViolation
+
+from forest_carbon import combined_agb_calculator, config, single_tree_estimation
+from forest_carbon import typecheck
+
+example_data = os.path.join(os.path.dirname(__file__), "..", "example_data")
+
+
+class TestTypecheck(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(typecheck.set_fast_mode, typecheck.fast_mode_enabled())
+        typecheck.set_fast_mode(False)
+        self.model = single_tree_estimation.create_AGB_function(coef=0.5, exp=1.0)
+
+    def test_checked_by_default(self):
+        with self.assertRaises(BeartypeCallHintParamViolation):
+            single_tree_estimation.apply_AGB_model(self.model, 1, 2.0, 3.0)
+
+    def test_fast_mode_skips_checks(self):
+        with typecheck.fast_mode():
+            self.assertTrue(typecheck.fast_mode_enabled())
+            self.assertEqual(
+                single_tree_estimation.apply_AGB_model(self.model, 1, 2.0, 3.0), 6.0
+            )
+        self.assertFalse(typecheck.fast_mode_enabled())
+
+    def test_validate_tree_records(self):
+        trees = [
+            {"group": "Hardwood", "taxa": "Fagaceae", "dbh": 20.0, "spg": 0.6},
+            {"group": "Hardwood", "taxa": "Oleaceae", "dbh": 19, "spg": 0.55},
+        ]
+        with self.assertRaisesRegex(TypeError, "Tree 1 has dbh=19"):
+            typecheck.validate_tree_records(trees)
+
+        trees[1]["dbh"] = 19.0
+        typecheck.validate_tree_records(trees)
+
+        del trees[0]["spg"]
+        with self.assertRaisesRegex(KeyError, "Tree 0 has no 'spg' field"):
+            typecheck.validate_tree_records(trees)
+
+    def test_fast_mode_matches_checked(self):
+        def estimate():
+            trees = combined_agb_calculator.load_tree_data_from_json(
+                os.path.join(example_data, "100_trees.json"),
+                config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO,
+            )
+            return combined_agb_calculator.apply_model(
+                trees, config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS
+            )
+
+        expected = estimate()
+        with typecheck.fast_mode():
+            self.assertEqual(estimate(), expected)
+
+    def test_fast_mode_validates_batch(self):
+        trees = [
+            {
+                "group": "Hardwood",
+                "taxa": "Oleaceae",
+                "dbh": 20,
+                "spg": 0.55,
+                "height": None,
+            }
+        ]
+        with typecheck.fast_mode(), self.assertRaises(TypeError):
+            combined_agb_calculator.apply_model(
+                trees, config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from forest_carbon import combined_agb_calculator, config, reference_tables
+from forest_carbon import uncertainty
+
+example_data = os.path.join(os.path.dirname(__file__), "..", "example_data")
+
+
+class TestUncertainty(unittest.TestCase):
+    def setUp(self):
+        self.trees = combined_agb_calculator.load_tree_data_from_json(
+            os.path.join(example_data, "100_trees.json"),
+            config.PATH_TO_TREE_PREPROCESSING_SPECIES_INFO,
+        )
+        self.estimates = np.array(
+            [
+                tree["AGB value"]
+                for tree in combined_agb_calculator.apply_model(
+                    [dict(tree) for tree in self.trees],
+                    config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS,
+                    vectorized=True,
+                )
+            ]
+        )
+
+    def test_model_errors(self):
+        df = reference_tables.load_taxa_model_index(
+            config.PATH_TO_TAXA_LEVEL_AGB_MODEL_PARAMETERS
+        )
+        residual_errors = uncertainty.model_residual_errors(df)
+        self.assertEqual(len(residual_errors), len(df) + 2)
+        self.assertTrue((residual_errors > 0).all())
+        self.assertEqual(residual_errors[-2], config.HEIGHT_MODEL_RSE)
+
+        parameter_errors = uncertainty.model_parameter_errors(df, residual_errors)
+        self.assertTrue((parameter_errors < residual_errors).all())
+
+    def test_intervals(self):
+        result = uncertainty.estimate_uncertainty(self.trees, num_samples=2000, seed=0)
+        trees = result["trees"]
+        self.assertEqual(trees["median"].shape, (len(self.trees),))
+        self.assertTrue((trees["lower"] < trees["median"]).all())
+        self.assertTrue((trees["median"] < trees["upper"]).all())
+        self.assertTrue((trees["lower"] < self.estimates).all())
+        self.assertTrue((self.estimates < trees["upper"]).all())
+        np.testing.assert_allclose(trees["median"], self.estimates, rtol=0.15)
+
+        plots = result["plots"]
+        self.assertEqual(plots["labels"], ["all"])
+        self.assertAlmostEqual(plots["mean"][0], trees["mean"].sum())
+        self.assertLess(plots["lower"][0], self.estimates.sum())
+        self.assertLess(self.estimates.sum(), plots["upper"][0])
+
+    def test_seed_and_chunks(self):
+        result = uncertainty.estimate_uncertainty(self.trees, num_samples=50, seed=1)
+        again = uncertainty.estimate_uncertainty(self.trees, num_samples=50, seed=1)
+        other = uncertainty.estimate_uncertainty(self.trees, num_samples=50, seed=2)
+        np.testing.assert_array_equal(result["trees"]["mean"], again["trees"]["mean"])
+        self.assertFalse(
+            np.array_equal(result["trees"]["mean"], other["trees"]["mean"])
+        )
+
+        # Chunks of 3 trees give the same kind of results
+        with mock.patch.object(config, "UNCERTAINTY_CHUNK_ELEMENTS", 150):
+            chunked = uncertainty.estimate_uncertainty(
+                self.trees, num_samples=50, seed=1
+            )
+        self.assertTrue(np.isfinite(chunked["trees"]["median"]).all())
+        self.assertAlmostEqual(
+            chunked["plots"]["mean"][0], chunked["trees"]["mean"].sum()
+        )
+
+    def test_plots(self):
+        trees = [dict(tree, plot=i % 3) for i, tree in enumerate(self.trees)]
+        result = uncertainty.estimate_uncertainty(
+            trees, num_samples=200, seed=0, plot="plot"
+        )
+        plots = result["plots"]
+        self.assertEqual(plots["labels"], [0, 1, 2])
+        for label in plots["labels"]:
+            self.assertAlmostEqual(
+                plots["mean"][label], result["trees"]["mean"][label::3].sum()
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()